@@ -3,11 +3,14 @@ import os
 from datetime import datetime
 from functools import wraps
 from werkzeug.utils import secure_filename
+from concurrent.futures import ThreadPoolExecutor
 import mimetypes
 
 # Import our enhanced models and configuration
 from models import EnhancedKnowledgeBase, UserManager, EnhancedAIAssistant
 from file_manager import FileManager
+from uploads import UploadSessionManager
+from jobs import IngestJobQueue, BulkImportJobs
 from config import Config
 import sqlite3
 
@@ -19,6 +22,13 @@ file_manager = FileManager()
 knowledge_base = EnhancedKnowledgeBase(file_manager)
 user_manager = UserManager()
 ai_assistant = EnhancedAIAssistant(knowledge_base, Config.GEMINI_API_KEY)
+ingest_jobs = IngestJobQueue(file_manager)
+bulk_jobs = BulkImportJobs(file_manager)
+bulk_jobs.resume_interrupted()
+upload_sessions = UploadSessionManager(file_manager, job_queue=ingest_jobs if Config.ASYNC_UPLOADS else None)
+
+# Bounded pool for processing the files of multi-file uploads
+upload_executor = ThreadPoolExecutor(max_workers=Config.UPLOAD_WORKERS)
 
 
 def login_required(f):
@@ -137,6 +147,122 @@ def chat():
         }), 500
 
 
+def process_upload(stream, filename, category, tags, description, user_id=None, document_id=None):
+    """Store and index one uploaded file, returning the response body and status"""
+    # ZIP bundles are ingested member by member without unpacking
+    if filename.lower().endswith('.zip') and Config.ASYNC_UPLOADS:
+        # Members are stored and each is indexed as a background job
+        result = ingest_jobs.upload_archive(
+            stream,
+            filename,
+            category=category,
+            tags=tags,
+            description=description,
+            user_id=user_id
+        )
+    elif filename.lower().endswith('.zip'):
+        result = file_manager.upload_archive(
+            stream,
+            filename,
+            category=category,
+            tags=tags,
+            description=description
+        )
+    elif document_id:
+        # A new version indexes only the chunks that changed, so it is written right away
+        if not file_manager.list_versions(document_id):
+            return {'success': False, 'error': 'Sənəd tapılmadı'}, 404
+        result = file_manager.upload_stream(
+            stream,
+            filename,
+            category=category,
+            tags=tags,
+            description=description,
+            document_id=document_id
+        )
+    elif Config.ASYNC_UPLOADS:
+        # Respond once the file is stored; indexing runs as a background job
+        result = ingest_jobs.upload_stream(
+            stream,
+            filename,
+            category=category,
+            tags=tags,
+            description=description,
+            user_id=user_id
+        )
+    else:
+        # Stream the upload straight into storage, hashing as it is copied
+        result = file_manager.upload_stream(
+            stream,
+            filename,
+            category=category,
+            tags=tags,
+            description=description
+        )
+    return upload_response(filename, result)
+
+
+def upload_response(filename, result):
+    """Turn a file manager upload result into the response body and status"""
+    if filename.lower().endswith('.zip') and not result.get('success'):
+        return {
+            'success': False,
+            'error': result.get('error', 'Arxiv emal edilə bilmədi')
+        }, 400
+    if 'archive' in result and result.get('queued'):
+        return {
+            'success': True,
+            'message': f'{filename}: {result["successful"]} fayl qəbul edildi, emal olunur, '
+                       f'{result["failed"]} fayl uğursuz oldu, {len(result["skipped"])} fayl buraxıldı',
+            'archive_info': result
+        }, 202
+    if 'archive' in result:
+        return {
+            'success': True,
+            'message': f'{filename}: {result["successful"]} fayl yükləndi, '
+                       f'{result["failed"]} fayl uğursuz oldu, {len(result["skipped"])} fayl buraxıldı',
+            'archive_info': result
+        }, 200
+
+    if result.get('queued'):
+        return {
+            'success': True,
+            'message': f'{filename} qəbul edildi, emal olunur',
+            'file_info': result
+        }, 202
+    elif result.get('success'):
+        if result.get('version', 1) > 1:
+            message = f'{filename} yeni versiya kimi yükləndi (versiya {result["version"]})'
+        elif result.get('deduplicated'):
+            message = f'{filename} artıq indekslənib, mövcud məzmundan istifadə edildi'
+        else:
+            message = f'{filename} uğurla yükləndi'
+        return {
+            'success': True,
+            'message': message,
+            'file_info': result
+        }, 200
+    elif result.get('extraction_failed'):
+        # The file could not be processed (timeout, memory limit, crash)
+        return {
+            'success': False,
+            'error': f'{filename} emal edilə bilmədi: {result["error"]}'
+        }, 422
+    else:
+        return {
+            'success': False,
+            'error': result.get('error', 'Fayl yüklənə bilmədi')
+        }, 500
+
+
+def upload_metadata():
+    """Category, description and tags sent with an upload form"""
+    category = request.form.get('category', 'Ümumi')
+    description = request.form.get('description', '')
+    tags = request.form.get('tags', '').split(',') if request.form.get('tags') else []
+    return category, description, tags
+
+
 @app.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
@@ -150,48 +276,202 @@ def upload_file():
             return jsonify({'error': 'Fayl seçilməyib'}), 400
 
         # Get additional metadata
-        category = request.form.get('category', 'Ümumi')
-        description = request.form.get('description', '')
-        tags = request.form.get('tags', '').split(',') if request.form.get('tags') else []
-
-        # Save file temporarily
-        filename = secure_filename(file.filename)
-        temp_path = os.path.join('temp', filename)
-        os.makedirs('temp', exist_ok=True)
-        file.save(temp_path)
-
-        # Process with file manager
-        result = file_manager.upload_file(
-            temp_path,
-            category=category,
-            tags=tags,
-            description=description
-        )
+        category, description, tags = upload_metadata()
 
-        # Clean up temp file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        body, status = process_upload(file.stream, secure_filename(file.filename), category, tags, description,
+                                      session['user_id'], request.form.get('document_id'))
+        return jsonify(body), status
 
-        if result.get('success'):
-            return jsonify({
-                'success': True,
-                'message': f'{filename} uğurla yükləndi',
-                'file_info': result
-            })
-        else:
+    except Exception as e:
+        print(f"Upload error: {e}")
+        return jsonify({
+            'success': False,
+            'error': 'Fayl yükləmə zamanı xəta baş verdi'
+        }), 500
+
+
+@app.route('/upload-multiple', methods=['POST'])
+@login_required
+def upload_multiple_files():
+    """Handle many files in one request, processed concurrently"""
+    try:
+        files = [file for file in request.files.getlist('files') + request.files.getlist('file')
+                 if file.filename]
+        if not files:
+            return jsonify({'error': 'Fayl seçilməyib'}), 400
+        if len(files) > Config.MAX_FILES_PER_UPLOAD:
             return jsonify({
                 'success': False,
-                'error': result.get('error', 'Fayl yüklənə bilmədi')
-            }), 500
+                'error': f'Bir dəfəyə ən çox {Config.MAX_FILES_PER_UPLOAD} fayl yükləmək olar'
+            }), 400
+
+        category, description, tags = upload_metadata()
+
+        # The request waits for every file, so the upload streams stay open
+        futures = [
+            (secure_filename(file.filename),
+             upload_executor.submit(process_upload, file.stream, secure_filename(file.filename),
+                                    category, tags, description, session['user_id']))
+            for file in files
+        ]
+
+        results = []
+        for filename, future in futures:
+            try:
+                body, status = future.result()
+            except Exception as e:
+                print(f"Upload error for {filename}: {e}")
+                body = {'success': False, 'error': 'Fayl yükləmə zamanı xəta baş verdi'}
+            body['filename'] = filename
+            results.append(body)
+
+        successful = sum(1 for body in results if body['success'])
+        return jsonify({
+            'success': successful == len(results),
+            'successful': successful,
+            'failed': len(results) - successful,
+            'results': results
+        })
 
     except Exception as e:
-        print(f"Upload error: {e}")
+        print(f"Multiple upload error: {e}")
         return jsonify({
             'success': False,
             'error': 'Fayl yükləmə zamanı xəta baş verdi'
         }), 500
 
 
+def find_upload_session(upload_id):
+    """The current user's upload session, or None"""
+    upload = upload_sessions.get_session(upload_id)
+    if upload is None or upload['user_id'] != session['user_id']:
+        return None
+    return upload
+
+
+@app.route('/uploads', methods=['POST'])
+@login_required
+def create_upload_session():
+    """Start a resumable upload"""
+    try:
+        data = request.json or {}
+        filename = secure_filename(data.get('filename', ''))
+        if not filename:
+            return jsonify({'error': 'Fayl seçilməyib'}), 400
+        try:
+            size = int(data.get('size'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Fayl ölçüsü göstərilməyib'}), 400
+
+        tags = data.get('tags') or []
+        if isinstance(tags, str):
+            tags = tags.split(',')
+
+        result = upload_sessions.create_session(
+            filename,
+            size,
+            category=data.get('category', 'Ümumi'),
+            tags=tags,
+            description=data.get('description', ''),
+            user_id=session['user_id']
+        )
+        if not result['success']:
+            return jsonify(result), 400
+        return jsonify(result), 201
+
+    except Exception as e:
+        print(f"Upload session error: {e}")
+        return jsonify({
+            'success': False,
+            'error': 'Yükləmə sessiyası yaradıla bilmədi'
+        }), 500
+
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def get_upload_session(upload_id):
+    """Report how many bytes of a resumable upload have been received"""
+    upload = find_upload_session(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Yükləmə sessiyası tapılmadı'}), 404
+    return jsonify({'success': True, **upload})
+
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_part(upload_id):
+    """Append a part of a resumable upload.
+
+    The part starts at the ``Upload-Offset`` header (or ``offset`` query
+    parameter), which must equal the received offset.
+    """
+    if find_upload_session(upload_id) is None:
+        return jsonify({'error': 'Yükləmə sessiyası tapılmadı'}), 404
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', request.args.get('offset', '')))
+    except ValueError:
+        return jsonify({'error': 'Başlanğıc mövqe göstərilməyib'}), 400
+
+    try:
+        result = upload_sessions.append(upload_id, offset, request.stream)
+    except Exception as e:
+        print(f"Upload part error: {e}")
+        upload = upload_sessions.get_session(upload_id)
+        return jsonify({
+            'success': False,
+            'error': 'Fayl hissəsi tam qəbul edilmədi',
+            'offset': upload['offset'] if upload else None
+        }), 500
+
+    if result['success']:
+        return jsonify(result)
+    return jsonify(result), 409 if result.get('offset_mismatch') else 400
+
+
+@app.route('/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload(upload_id):
+    """Ingest a completely received resumable upload"""
+    upload = find_upload_session(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Yükləmə sessiyası tapılmadı'}), 404
+
+    try:
+        result = upload_sessions.finalize(upload_id)
+        if result.get('incomplete'):
+            return jsonify(result), 409
+        body, status = upload_response(upload['filename'], result)
+        return jsonify(body), status
+
+    except Exception as e:
+        print(f"Upload finalize error: {e}")
+        return jsonify({
+            'success': False,
+            'error': 'Fayl yükləmə zamanı xəta baş verdi'
+        }), 500
+
+
+@app.route('/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    """Abort a resumable upload"""
+    if find_upload_session(upload_id) is None:
+        return jsonify({'error': 'Yükləmə sessiyası tapılmadı'}), 404
+    upload_sessions.cancel(upload_id)
+    return jsonify({'success': True})
+
+
+@app.route('/jobs/<job_id>')
+@login_required
+def get_ingest_job(job_id):
+    """Report the status and timings of a background upload job"""
+    job = ingest_jobs.get_job(job_id)
+    if job is None or (job['user_id'] != session['user_id'] and session.get('role') != 'admin'):
+        return jsonify({'error': 'Tapşırıq tapılmadı'}), 404
+    return jsonify({'success': True, **job})
+
+
 @app.route('/files')
 @login_required
 def list_files():
@@ -235,6 +515,20 @@ def get_file_content(file_id):
         }), 500
 
 
+@app.route('/files/<file_id>/versions')
+@login_required
+def list_file_versions(file_id):
+    """List the versions of a document"""
+    versions = file_manager.list_versions(file_id)
+    if not versions:
+        return jsonify({'error': 'File not found'}), 404
+
+    return jsonify({
+        'success': True,
+        'versions': versions
+    })
+
+
 @app.route('/search-files')
 @login_required
 def search_files():
@@ -261,6 +555,37 @@ def search_files():
         }), 500
 
 
+@app.route('/spreadsheet-rows', methods=['POST'])
+@login_required
+def query_spreadsheet_rows():
+    """Find spreadsheet rows by column values, e.g. {"filters": {"Project": "X"}}"""
+    try:
+        data = request.get_json(silent=True) or {}
+        filters = data.get('filters') or {}
+        if not isinstance(filters, dict):
+            return jsonify({'error': 'Filtrlər sütun adı və dəyər cütləri olmalıdır'}), 400
+        try:
+            limit = int(data.get('limit', 50))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Limit tam ədəd olmalıdır'}), 400
+
+        result = file_manager.query_spreadsheet_rows(
+            filters,
+            file_id=data.get('file_id'),
+            sheet=data.get('sheet'),
+            limit=min(max(limit, 1), 500)
+        )
+        if not result['success']:
+            return jsonify(result), 400
+        return jsonify(result)
+    except Exception as e:
+        print(f"Spreadsheet query error: {e}")
+        return jsonify({
+            'success': False,
+            'error': 'Cədvəl sətirlərinin axtarışı zamanı xəta baş verdi'
+        }), 500
+
+
 @app.route('/bulk-upload', methods=['POST'])
 @admin_required
 def bulk_upload():
@@ -269,6 +594,7 @@ def bulk_upload():
         data = request.json
         directory_path = data.get('directory_path')
         category = data.get('category', 'Bulk Upload')
+        workers = data.get('workers')
 
         if not directory_path:
             return jsonify({'error': 'Directory path tələb olunur'}), 400
@@ -276,17 +602,91 @@ def bulk_upload():
         if not os.path.exists(directory_path):
             return jsonify({'error': 'Directory tapılmadı'}), 400
 
-        result = file_manager.bulk_upload(directory_path, category=category)
+        if data.get('mode') == 'sync':
+            result = file_manager.sync_directory(
+                directory_path,
+                category=category,
+                workers=int(workers) if workers else None
+            )
+            return jsonify({
+                'success': True,
+                'result': result
+            })
+
+        # Imports run as checkpointed background jobs, see /bulk-jobs
+        job = bulk_jobs.create_job(
+            directory_path,
+            category=category,
+            workers=int(workers) if workers else None,
+            user_id=session['user_id']
+        )
+        if not job['success']:
+            return jsonify(job), 400
+        bulk_jobs.start(job['job_id'])
+
+        return jsonify(job), 202
+    except Exception as e:
+        print(f"Bulk upload error: {e}")
+        return jsonify({
+            'success': False,
+            'error': 'Bulk upload zamanı xəta baş verdi'
+        }), 500
+
+
+@app.route('/bulk-jobs')
+@admin_required
+def list_bulk_jobs():
+    """List recent bulk import jobs (Admin only)"""
+    return jsonify({'success': True, 'jobs': bulk_jobs.list_jobs()})
+
+
+@app.route('/bulk-jobs/<job_id>')
+@admin_required
+def get_bulk_job(job_id):
+    """Progress of a bulk import job (Admin only)"""
+    job = bulk_jobs.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Tapşırıq tapılmadı'}), 404
+    return jsonify({'success': True, **job})
+
+
+@app.route('/bulk-jobs/<job_id>/<action>', methods=['POST'])
+@admin_required
+def control_bulk_job(job_id, action):
+    """Pause, resume or cancel a bulk import job (Admin only)"""
+    actions = {'pause': bulk_jobs.pause, 'resume': bulk_jobs.resume, 'cancel': bulk_jobs.cancel}
+    if action not in actions:
+        return jsonify({'error': 'Naməlum əməliyyat'}), 404
+
+    job = bulk_jobs.get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Tapşırıq tapılmadı'}), 404
+    if not actions[action](job_id):
+        return jsonify({
+            'success': False,
+            'error': f'Tapşırıq {job["status"]} vəziyyətindədir, əməliyyat mümkün deyil'
+        }), 409
+
+    return jsonify({'success': True, **bulk_jobs.get_job(job_id)})
+
+
+@app.route('/reindex', methods=['POST'])
+@admin_required
+def reindex_files():
+    """Re-chunk and re-index stored files (Admin only)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        result = file_manager.reindex_files(data.get('file_ids'))
 
         return jsonify({
             'success': True,
             'result': result
         })
     except Exception as e:
-        print(f"Bulk upload error: {e}")
+        print(f"Reindex error: {e}")
         return jsonify({
             'success': False,
-            'error': 'Bulk upload zamanı xəta baş verdi'
+            'error': 'Yenidən indeksləmə zamanı xəta baş verdi'
         }), 500
 
 
@@ -316,6 +716,9 @@ def file_stats():
             # Sum file sizes
             stats['total_size'] += file_info.get('file_size', 0)
 
+        # Near-duplicate chunks stored once in the index
+        stats['chunk_deduplication'] = file_manager.chunk_dedup_stats()
+
         return jsonify({
             'success': True,
             'stats': stats
@@ -467,9 +870,18 @@ def get_file_info(file_id):
         cursor = conn.cursor()
 
         cursor.execute('''
-                       SELECT f.*, COUNT(c.id) as chunk_count
+                       SELECT f.id,
+                              f.filename,
+                              f.original_name,
+                              f.file_type,
+                              f.file_size,
+                              f.upload_date,
+                              f.category,
+                              f.description,
+                              COUNT(c.id) as chunk_count,
+                              f.duplicate_of
                        FROM files f
-                                LEFT JOIN chunks c ON f.id = c.file_id
+                                LEFT JOIN chunks c ON c.file_id = COALESCE(f.duplicate_of, f.id)
                        WHERE f.id = ?
                        GROUP BY f.id
                        ''', (file_id,))
@@ -484,12 +896,13 @@ def get_file_info(file_id):
             'file_id': file_data[0],
             'filename': file_data[1],
             'original_name': file_data[2],
-            'file_type': file_data[4],
-            'file_size': file_data[5],
-            'upload_date': file_data[7],
-            'category': file_data[9],
-            'description': file_data[11],
-            'chunk_count': file_data[14],
+            'file_type': file_data[3],
+            'file_size': file_data[4],
+            'upload_date': file_data[5],
+            'category': file_data[6],
+            'description': file_data[7],
+            'chunk_count': file_data[8],
+            'duplicate_of': file_data[9],
             'download_url': url_for('download_file', file_id=file_id)
         }
 
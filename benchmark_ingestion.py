@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Ingestion Benchmark Script
+Compares time and peak memory of the ingestion pipeline against the
+previous implementations on the large test documents
+"""
+
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Pool
+from pathlib import Path
+
+import docx
+import markdown
+from bs4 import BeautifulSoup
+
+from file_manager import DocumentChunker, DocumentProcessor, FileManager
+from test_large_files import create_test_documents
+
+LARGE_DOCUMENTS = ["nazirlik_tam_rehber.md", "layihe_menecment_kitabi.md", "hr_tam_prosedurlar.md"]
+
+
+def measure(func, repeat: int = 3):
+    """Return (best seconds, peak traced bytes) for a callable"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def print_comparison(label: str, baseline: tuple, candidate: tuple):
+    """Print a baseline/candidate line pair with the speedup"""
+    (base_time, base_peak), (new_time, new_peak) = baseline, candidate
+    print(f"   {label}:")
+    print(f"      - previous: {base_time * 1000:8.1f}ms, peak {base_peak / 1024 / 1024:7.2f} MB")
+    print(f"      - current:  {new_time * 1000:8.1f}ms, peak {new_peak / 1024 / 1024:7.2f} MB")
+    print(f"      - speedup: {base_time / new_time:.2f}x, memory: {base_peak / max(new_peak, 1):.2f}x less")
+
+
+def legacy_chunk_text(text: str, document_id: str, max_chunk_size: int = 4000, overlap_size: int = 200):
+    """The word-list chunker DocumentChunker used before offset-based chunking"""
+    chunks = []
+    words = text.split()
+
+    if len(words) <= max_chunk_size:
+        return [{'chunk_id': f"{document_id}_chunk_0", 'content': text, 'chunk_index': 0, 'total_chunks': 1}]
+
+    total_chunks = (len(words) + max_chunk_size - 1) // max_chunk_size
+    for i in range(0, len(words), max_chunk_size - overlap_size):
+        chunks.append({
+            'chunk_id': f"{document_id}_chunk_{len(chunks)}",
+            'content': ' '.join(words[i:i + max_chunk_size]),
+            'chunk_index': len(chunks),
+            'total_chunks': total_chunks
+        })
+        if i + max_chunk_size >= len(words):
+            break
+    return chunks
+
+
+def legacy_extract_docx(file_path: str) -> str:
+    """The python-docx paragraph walk used before the streaming DOCX extractor"""
+    doc = docx.Document(file_path)
+    text = ""
+    for paragraph in doc.paragraphs:
+        text += paragraph.text + "\n"
+    return text
+
+
+def legacy_extract_md(file_path: str) -> str:
+    """The Markdown -> HTML -> BeautifulSoup round trip used before the line-based extractor"""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return BeautifulSoup(markdown.markdown(file.read()), 'html.parser').get_text()
+
+
+def legacy_extract_html(file_path: str) -> str:
+    """The BeautifulSoup html.parser extraction used before the streaming HTML extractor"""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return BeautifulSoup(file.read(), 'html.parser').get_text()
+
+
+def create_large_docx(test_dir: Path, paragraphs: int = 20000, tables: int = 40) -> Path:
+    """Write a long DOCX with tables between the paragraphs"""
+    path = test_dir / "boyuk_hesabat.docx"
+    if path.exists():
+        return path
+
+    document = docx.Document()
+    per_table = paragraphs // tables
+    for i in range(paragraphs):
+        document.add_paragraph(f"Bənd {i + 1}. Nazirlik əməkdaşları üçün prosedur və qaydaların izahı, "
+                               f"məsul şəxslər və icra müddətləri haqqında məlumat.")
+        if (i + 1) % per_table == 0:
+            table = document.add_table(rows=20, cols=4)
+            for row_number, row in enumerate(table.rows):
+                for cell_number, cell in enumerate(row.cells):
+                    cell.text = f"Sətir {row_number + 1}, sütun {cell_number + 1}"
+    document.save(path)
+    return path
+
+
+def create_large_pdf(test_dir: Path, pages: int = 600) -> Path:
+    """Write a text-only PDF with many pages, without a PDF library"""
+    path = test_dir / "boyuk_hesabat.pdf"
+    if path.exists():
+        return path
+
+    # Objects 1-3 are the catalog, the page tree and the font; each page
+    # then takes two objects, the page and its content stream
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page_number in range(pages):
+        lines = " ".join(f"(Page {page_number + 1} line {line + 1}: ministry procedures and "
+                         f"responsibilities of the staff) '" for line in range(45))
+        stream = f"BT /F1 9 Tf 40 800 Td 11 TL {lines} ET".encode()
+        kids.append(f"{len(objects) + 1} 0 R")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects) + 2} 0 R >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode()
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    path.write_bytes(bytes(data))
+    return path
+
+
+def read_blocks(path: Path, block_size: int = 64 * 1024):
+    """Stream a text file in fixed-size blocks"""
+    with open(path, 'r', encoding='utf-8') as file:
+        for block in iter(lambda: file.read(block_size), ''):
+            yield block
+
+
+def legacy_store_upload(file_manager: FileManager, payload: dict):
+    """The per-file connection and commit used before the index writer"""
+    payload['chunks'] = list(payload['chunks'])
+    conn = sqlite3.connect(file_manager.db_path)
+    try:
+        file_manager.write_upload(conn.cursor(), payload)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def upload_concurrently(args: tuple) -> int:
+    """Upload files from several threads of one server process; returns the error count"""
+    mode, directory, files, threads = args
+    file_manager = FileManager(storage_dir=f"{directory}/docs", db_path=f"{directory}/index.db",
+                               sandbox=False, cache_dir='', deduplicate=False)
+    errors = []
+
+    def upload(number: int):
+        text = f"Sənəd {os.getpid()}-{number}. " + "Nazirlik qaydaları və prosedurlar. " * 400
+        try:
+            payload = file_manager.prepare_upload_stream(io.BytesIO(text.encode()), f"sened_{number}.txt")
+            if mode == 'legacy':
+                legacy_store_upload(file_manager, payload)
+            else:
+                file_manager.store_upload(payload)
+        except Exception as e:
+            errors.append(e)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(upload, range(files)))
+    return len(errors)
+
+
+def benchmark_concurrent_writes(processes: int = 4, threads: int = 8, files: int = 150):
+    """Per-file commits from every thread vs. the group-committing index writer"""
+    print(f"\n🗄️  Concurrent index writes ({processes} processes x {threads} threads)")
+
+    for mode, label in (('legacy', 'per-file commit'), ('writer', 'index writer')):
+        directory = tempfile.mkdtemp()
+        try:
+            FileManager(storage_dir=f"{directory}/docs", db_path=f"{directory}/index.db", sandbox=False,
+                        cache_dir='')
+            if mode == 'legacy':
+                conn = sqlite3.connect(f"{directory}/index.db")
+                conn.execute('PRAGMA journal_mode=DELETE')
+                conn.close()
+
+            start = time.perf_counter()
+            with Pool(processes) as pool:
+                errors = sum(pool.map(upload_concurrently, [(mode, directory, files, threads)] * processes))
+            elapsed = time.perf_counter() - start
+
+            conn = sqlite3.connect(f"{directory}/index.db")
+            written = conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+            conn.close()
+            print(f"   - {label}: {written} files in {elapsed:.2f}s ({written / elapsed:.0f} files/s), "
+                  f"{errors} errors")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def benchmark_chunking(test_dir: Path):
+    """Legacy word-list chunking vs. streaming offset-based chunking"""
+    print("\n🔧 Chunking (whole document in memory vs. streamed blocks)")
+    chunker = DocumentChunker(max_chunk_size=4000, overlap_size=200)
+
+    for name in LARGE_DOCUMENTS:
+        path = test_dir / name
+
+        def run_legacy():
+            # Each chunk is consumed and dropped, as the writer does
+            for _ in legacy_chunk_text(path.read_text(encoding='utf-8'), name):
+                pass
+
+        def run_streaming():
+            for _ in chunker.iter_chunks(read_blocks(path), name):
+                pass
+
+        print_comparison(f"{name} ({path.stat().st_size / 1024:.0f} KB)",
+                         measure(run_legacy), measure(run_streaming))
+
+
+def benchmark_docx(test_dir: Path):
+    """python-docx object model vs. streaming document.xml parse"""
+    print("\n📄 DOCX extraction (python-docx vs. streamed XML)")
+    path = create_large_docx(test_dir)
+
+    def run_streaming():
+        for _ in DocumentProcessor.iter_text_from_docx(str(path)):
+            pass
+
+    print_comparison(f"{path.name} ({path.stat().st_size / 1024:.0f} KB)",
+                     measure(lambda: legacy_extract_docx(str(path))), measure(run_streaming))
+
+    legacy_words = len(legacy_extract_docx(str(path)).split())
+    streamed_words = len(DocumentProcessor.extract_text_from_docx(str(path)).split())
+    print(f"      - words indexed: {legacy_words} previous, {streamed_words} current (tables included)")
+
+
+def benchmark_markup(test_dir: Path):
+    """Markdown and HTML extraction against the BeautifulSoup-based versions"""
+    print("\n📝 Markdown / HTML extraction (BeautifulSoup vs. single pass)")
+
+    for name in LARGE_DOCUMENTS:
+        md_path = test_dir / name
+        html_path = md_path.with_suffix('.html')
+        html_path.write_text(markdown.markdown(md_path.read_text(encoding='utf-8')), encoding='utf-8')
+
+        for path, legacy, current in (
+                (md_path, legacy_extract_md, DocumentProcessor.iter_text_from_md),
+                (html_path, legacy_extract_html, DocumentProcessor.iter_text_from_html)):
+
+            def run_current():
+                for _ in current(str(path)):
+                    pass
+
+            print_comparison(f"{path.name} ({path.stat().st_size / 1024:.0f} KB)",
+                             measure(lambda: legacy(str(path))), measure(run_current))
+
+            same = legacy(str(path)).split() == "".join(current(str(path))).split()
+            print(f"      - word sequence identical: {'yes' if same else 'NO'}")
+
+
+def create_large_json(test_dir: Path, records: int = 60000, malformed: bool = False) -> Path:
+    """Write a data dump of employee records, optionally with an invalid token near the start"""
+    path = test_dir / ("large_dump_malformed.json" if malformed else "large_dump.json")
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('{"mənbə": "Nazirlik", "status": %s, "records": [' % ('undefined' if malformed else '"aktiv"'))
+        for i in range(records):
+            if i:
+                file.write(',')
+            json.dump({'id': i, 'ad': f"İşçi {i}", 'şöbə': f"Şöbə {i % 40}", 'maaş': 1000 + i % 700 * 1.5,
+                       'aktiv': i % 3 != 0, 'ünvan': {'şəhər': 'Bakı', 'küçə': f"Küçə {i % 300}"},
+                       'qeydlər': ["Bu işçi haqqında qeyd mətni burada yer alır."] * 2}, file, ensure_ascii=False)
+        file.write(']}')
+    return path
+
+
+def benchmark_json(test_dir: Path):
+    """Tokenizing every value vs. decoding containers that fit in the buffer"""
+    print("\n🧾 JSON extraction (tokenizer only vs. buffered json decode)")
+    path = create_large_json(test_dir)
+    buffered = DocumentProcessor.JSON_MAX_BUFFERED
+
+    def run(max_buffered):
+        DocumentProcessor.JSON_MAX_BUFFERED = max_buffered
+        try:
+            return sum(len(piece) for piece in DocumentProcessor.iter_text_from_json(str(path)))
+        finally:
+            DocumentProcessor.JSON_MAX_BUFFERED = buffered
+
+    # With a 64 byte buffer every record is tokenized; the strings still fit
+    print_comparison(f"{path.name} ({path.stat().st_size / 1024 / 1024:.1f} MB)",
+                     measure(lambda: run(64)), measure(lambda: run(buffered)))
+
+    malformed = create_large_json(test_dir, malformed=True)
+    tracemalloc.start()
+    characters = sum(len(piece) for piece in DocumentProcessor.iter_text_from_json(str(malformed)))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"   {malformed.name}: {characters} characters indexed, peak {peak / 1024 / 1024:.2f} MB")
+
+
+def benchmark_pdf(test_dir: Path):
+    """Page-by-page PDF extraction vs. page ranges spread over processes"""
+    workers = max(2, os.cpu_count() or 1)
+    print(f"\n📕 PDF extraction (one process vs. page ranges on {workers} processes)")
+    path = create_large_pdf(test_dir)
+
+    def run(pdf_workers):
+        return "".join(DocumentProcessor.iter_text_from_pdf(str(path), workers=pdf_workers))
+
+    sequential, _ = measure(lambda: run(1), repeat=2)
+    parallel, _ = measure(lambda: run(workers), repeat=2)
+    print(f"   {path.name} ({path.stat().st_size / 1024:.0f} KB):")
+    print(f"      - one process: {sequential * 1000:8.1f}ms")
+    print(f"      - {workers} processes: {parallel * 1000:8.1f}ms ({os.cpu_count()} cores available)")
+    print(f"      - speedup: {sequential / parallel:.2f}x, same text: {'yes' if run(1) == run(workers) else 'NO'}")
+    if (os.cpu_count() or 1) < 2:
+        print("      - only one core: this measures the pool overhead, not how extraction scales")
+
+
+def main():
+    """Run all ingestion benchmarks"""
+    print("🚀 INGESTION BENCHMARK")
+    print("=" * 50)
+
+    test_dir = create_test_documents()
+    benchmark_chunking(test_dir)
+    benchmark_docx(test_dir)
+    benchmark_markup(test_dir)
+    benchmark_json(test_dir)
+    benchmark_pdf(test_dir)
+    benchmark_concurrent_writes()
+
+    print("\n" + "=" * 50)
+
+
+if __name__ == "__main__":
+    main()
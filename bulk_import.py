@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Bulk Import Command Line Tool
+Starts, resumes, pauses and cancels checkpointed bulk import jobs. Jobs
+share the database with the web application, so a job can be started
+here and followed or paused from the admin endpoints, and the other way
+round.
+"""
+
+import argparse
+import sys
+
+from file_manager import FileManager
+from jobs import BulkImportJobs
+
+
+def print_job(job: dict):
+    """Print the progress of one job"""
+    print(f"📦 {job['job_id']} [{job['status']}] {job['directory']}")
+    print(f"   - files: {job['total']} total, {job['done']} done, {job['failed']} failed, "
+          f"{job['pending']} pending, {job['cancelled']} cancelled")
+    if job['error']:
+        print(f"   - error: {job['error']}")
+    for failure in job['failures'][:10]:
+        print(f"   ❌ {failure['file']}: {failure['error']}")
+
+
+def run(jobs: BulkImportJobs, job_id: str):
+    """Run a queued job in the foreground; Ctrl+C pauses it"""
+    try:
+        job = jobs.run_job(job_id)
+    except KeyboardInterrupt:
+        jobs.pause(job_id)
+        print("\n⏸️  Paused, continue with: python bulk_import.py resume " + job_id)
+        job = jobs.get_job(job_id)
+    print_job(job)
+    return 0 if job['status'] in ('done', 'paused') else 1
+
+
+def main(argv=None):
+    """Parse the command line and run the requested action"""
+    parser = argparse.ArgumentParser(description="Checkpointed bulk import of document directories")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    start = commands.add_parser('start', help="create a job for a directory and run it")
+    start.add_argument('directory')
+    start.add_argument('--category', default='Bulk Upload')
+    start.add_argument('--workers', type=int)
+    start.add_argument('--batch-size', type=int)
+
+    for name, help_text in (('resume', "continue a paused, failed or interrupted job"),
+                            ('pause', "pause a running job after the files in flight"),
+                            ('cancel', "cancel a job, keeping the files already imported")):
+        commands.add_parser(name, help=help_text).add_argument('job_id')
+
+    status = commands.add_parser('status', help="show one job, or the most recent jobs")
+    status.add_argument('job_id', nargs='?')
+
+    args = parser.parse_args(argv)
+    jobs = BulkImportJobs(FileManager())
+
+    if args.command == 'start':
+        job = jobs.create_job(args.directory, category=args.category, workers=args.workers,
+                              batch_size=args.batch_size)
+        if not job['success']:
+            print(f"❌ {job['error']}")
+            return 1
+        print(f"🚀 Job {job['job_id']}: {job['total']} files")
+        return run(jobs, job['job_id'])
+
+    if args.command == 'status':
+        found = [jobs.get_job(args.job_id)] if args.job_id else jobs.list_jobs(limit=10)
+        found = [job for job in found if job]
+        if not found:
+            print("❌ No bulk import jobs found")
+            return 1
+        for job in found:
+            print_job(job)
+        return 0
+
+    if jobs.get_job(args.job_id) is None:
+        print(f"❌ Job {args.job_id} not found")
+        return 1
+
+    if args.command == 'resume':
+        if not jobs.resume(args.job_id, background=False):
+            print(f"❌ Job {args.job_id} is {jobs.get_job(args.job_id)['status']} and cannot be resumed")
+            return 1
+        return run(jobs, args.job_id)
+
+    action = jobs.pause if args.command == 'pause' else jobs.cancel
+    if not action(args.job_id):
+        print(f"❌ Job {args.job_id} is {jobs.get_job(args.job_id)['status']}")
+        return 1
+    print_job(jobs.get_job(args.job_id))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
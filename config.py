@@ -23,5 +23,14 @@ class Config:
     HOST = os.environ.get('FLASK_HOST', '0.0.0.0')
     PORT = int(os.environ.get('FLASK_PORT', 5000))
 
+    # Upload processing: files of a multi-file upload are processed
+    # concurrently on a pool of this many threads shared by all requests
+    UPLOAD_WORKERS = int(os.environ.get('UPLOAD_WORKERS', 4))
+    MAX_FILES_PER_UPLOAD = int(os.environ.get('MAX_FILES_PER_UPLOAD', 200))
+
+    # Uploads return once stored; extraction and indexing run as background
+    # jobs whose status is polled at /jobs/<job_id>
+    ASYNC_UPLOADS = os.environ.get('ASYNC_UPLOADS', 'True').lower() == 'true'
+
     # Templates directory
     TEMPLATES_DIR = 'templates'
\ No newline at end of file
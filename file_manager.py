@@ -1,115 +1,886 @@
 import os
+import re
+import gzip
 import json
+import pickle
+import tempfile
+import time
 import hashlib
+import math
+import multiprocessing
+import signal
+import html
+import codecs
+import difflib
+import io
+import threading
+import queue
 import sqlite3
+import subprocess
+import sys
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from xml.parsers import expat
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from collections import deque
+from multiprocessing.connection import Connection
 from datetime import datetime
 from pathlib import Path
 import mimetypes
 import logging
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Iterable, Iterator, Callable
 
 # For document processing
 try:
     import PyPDF2
-    import docx
     import openpyxl
-    from bs4 import BeautifulSoup
-    import markdown
 except ImportError:
     print("Warning: Some document processing libraries are not installed.")
-    print("Install with: pip install PyPDF2 python-docx openpyxl beautifulsoup4 markdown")
+    print("Install with: pip install PyPDF2 openpyxl")
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    import numpy as np
+except ImportError:  # summaries then fall back to leading sentences
+    np = None
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Marker extractors put between independent sections (e.g. spreadsheet
+# sheets). It is not part of the text and no chunk spans across it.
+SECTION_BREAK = '\x1e'
+# Marker extractors put before the text of a heading line, repeated once per
+# heading level. It is not part of the text either.
+HEADING_MARK = '\x1d'
+
+
+class HTMLTextParser(HTMLParser):
+    """Collects the text of an HTML document as it is fed, without building a tree"""
+
+    SKIPPED_TAGS = {'script', 'style', 'template'}
+    BLOCK_TAGS = {'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt',
+                  'figcaption', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header',
+                  'hr', 'li', 'main', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'td', 'th',
+                  'title', 'tr', 'ul'}
+
+    HEADING_TAGS = {'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skipping = 0
+        self.heading = 0  # level of the open heading element
+        self.heading_marked = False
+        self.heading_space = False  # whitespace seen after the heading's last word
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+            if tag in self.HEADING_TAGS:
+                self.heading = self.HEADING_TAGS[tag]
+                self.heading_marked = False
+                self.heading_space = False
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+            if tag in self.HEADING_TAGS:
+                self.heading = 0
+
+    def handle_data(self, data):
+        if self.skipping:
+            return
+        if self.heading:
+            # Headings stay on one line, marked before their first word; a
+            # space is only written before a following word, so none trails
+            text = " ".join(data.split())
+            if not text:
+                self.heading_space = self.heading_space or (self.heading_marked and bool(data))
+                return
+            if not self.heading_marked:
+                text = HEADING_MARK * self.heading + text
+                self.heading_marked = True
+            elif self.heading_space or data[0].isspace():
+                text = " " + text
+            self.heading_space = data[-1].isspace()
+            data = text
+        self.parts.append(data)
+
+    def take_text(self) -> str:
+        """Return the text collected since the previous call"""
+        text = "".join(self.parts)
+        self.parts = []
+        return text
+
+
+class XMLTextCollector:
+    """Flattens an XML document into ``path: value`` lines as it is fed.
+
+    Built on expat callbacks, so only the stack of open elements is kept:
+    finished elements are never stored. Text longer than ``max_value_chars``
+    is emitted in parts instead of being buffered whole.
+    """
+
+    def __init__(self, max_value_chars: int = 64 * 1024):
+        self.parser = expat.ParserCreate(namespace_separator=' ')
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+        self.parser.CharacterDataHandler = self.character_data
+        self.max_value_chars = max_value_chars
+        self.path = []
+        self.texts = []  # text buffered for each open element
+        self.sizes = []
+        self.lines = []
+
+    @staticmethod
+    def local_name(name: str) -> str:
+        return name.rsplit(' ', 1)[-1]
+
+    def start_element(self, name, attributes):
+        self.path.append(self.local_name(name))
+        self.texts.append([])
+        self.sizes.append(0)
+        if attributes:
+            path = "/".join(self.path)
+            for attribute, value in attributes.items():
+                if value.strip():
+                    self.lines.append(f"{path}/@{self.local_name(attribute)}: {value.strip()}")
+
+    def end_element(self, name):
+        self.flush_text()
+        self.path.pop()
+        self.texts.pop()
+        self.sizes.pop()
+
+    def character_data(self, data):
+        if not self.texts:
+            return
+        self.texts[-1].append(data)
+        self.sizes[-1] += len(data)
+        if self.sizes[-1] > self.max_value_chars:
+            self.flush_text()
+
+    def flush_text(self):
+        text = " ".join("".join(self.texts[-1]).split())
+        self.texts[-1] = []
+        self.sizes[-1] = 0
+        if text:
+            self.lines.append(f"{'/'.join(self.path)}: {text}")
+
+    def feed(self, data: bytes, final: bool = False):
+        self.parser.Parse(data, final)
+
+    def take_text(self) -> str:
+        """Return the lines collected since the previous call"""
+        if not self.lines:
+            return ""
+        text = "\n".join(self.lines) + "\n"
+        self.lines = []
+        return text
+
 
 class DocumentProcessor:
     """Handles different document types and extracts text content"""
 
+    # Bump an entry whenever its extractor's output changes; cached
+    # extractions made by older versions are then ignored
+    EXTRACTOR_VERSIONS = {
+        'pdf': 1,
+        'docx': 3,
+        'excel': 3,
+        'excel_rows': 1,
+        'text': 2,
+        'html': 4,
+        'markdown': 3,
+        'json': 1,
+        'xml': 1
+    }
+
+    # PDFs with at least this many pages are split into page ranges that a
+    # pool of ``pdf_workers`` processes extracts concurrently. Sandbox
+    # workers set ``pdf_workers`` and ``pdf_memory_limit``, the address space
+    # budget the pool shares; elsewhere extraction stays in-process.
+    PDF_PARALLEL_MIN_PAGES = int(os.environ.get('PDF_PARALLEL_MIN_PAGES', 100))
+    PDF_RANGES_PER_WORKER = 4
+    # Smallest share of the budget worth starting a range process for
+    PDF_RANGE_MIN_MEMORY = 128 * 1024 * 1024
+    pdf_workers = 1
+    pdf_memory_limit = None
+
+    @staticmethod
+    def until_error(pieces: Iterable[str], file_path: str) -> Iterator[str]:
+        """Pass extracted text through, ending it where the extractor failed.
+
+        The ``iter_text_from_*`` extractors raise on damaged files, so the
+        extraction cache drops their partial output; the text read up to the
+        error is still indexed. A MemoryError is not swallowed.
+        """
+        try:
+            yield from pieces
+        except MemoryError:
+            raise
+        except Exception as e:
+            logger.error(f"Error processing {file_path}: {e}")
+
+    @staticmethod
+    def iter_text_from_pdf(file_path: str, workers: int = None) -> Iterator[str]:
+        """Yield the text of a PDF one page (or page range) at a time"""
+        if workers is None:
+            workers = DocumentProcessor.pdf_workers
+        with open(file_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            page_count = len(pdf_reader.pages)
+            if workers > 1 and page_count >= DocumentProcessor.PDF_PARALLEL_MIN_PAGES:
+                workers, share = DocumentProcessor.pdf_range_budget(workers)
+                if workers > 1:
+                    yield from DocumentProcessor.iter_pdf_page_ranges(file_path, page_count, workers, share)
+                    return
+            for page in pdf_reader.pages:
+                yield (page.extract_text() or "") + "\n"
+
+    @staticmethod
+    def pdf_range_budget(workers: int) -> Tuple[int, Optional[int]]:
+        """Number of range processes and the address space each may grow by.
+
+        Range processes are forked copies of this one and would each inherit
+        the whole ``pdf_memory_limit``, so what is left of it is split between
+        this process and the pool, with fewer processes if the shares would
+        drop below ``PDF_RANGE_MIN_MEMORY``.
+        """
+        limit = DocumentProcessor.pdf_memory_limit
+        if not limit or resource is None:
+            return workers, None
+        spare = limit - _address_space_size()
+        workers = min(workers, spare // DocumentProcessor.PDF_RANGE_MIN_MEMORY - 1)
+        return workers, spare // (workers + 1) if workers > 1 else None
+
+    @staticmethod
+    def iter_pdf_page_ranges(file_path: str, page_count: int, workers: int,
+                             share: int = None) -> Iterator[str]:
+        """Extract page ranges in a process pool, yielding their text in page order.
+
+        With a ``share``, this process and every range process may each grow
+        by that many bytes of address space while the pool runs.
+        """
+        range_size = max(1, math.ceil(page_count / (workers * DocumentProcessor.PDF_RANGES_PER_WORKER)))
+        ranges = [(start, min(start + range_size, page_count)) for start in range(0, page_count, range_size)]
+        # Sandbox workers are single-threaded, so forking them is safe and cheap
+        start_method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+        context = multiprocessing.get_context(start_method)
+
+        limits = resource.getrlimit(resource.RLIMIT_AS) if share else None
+        try:
+            if share:
+                resource.setrlimit(resource.RLIMIT_AS, (_address_space_size() + share, limits[1]))
+            # A failing range stops the pool and fails the whole file
+            with context.Pool(min(workers, len(ranges)), initializer=_init_pdf_range_worker,
+                              initargs=(file_path, share)) as pool:
+                for text in pool.imap(_extract_pdf_page_range, ranges):
+                    yield text
+        finally:
+            if share:
+                resource.setrlimit(resource.RLIMIT_AS, limits)
+
     @staticmethod
     def extract_text_from_pdf(file_path: str) -> str:
         """Extract text from PDF files"""
+        pieces = DocumentProcessor.iter_text_from_pdf(file_path)
+        return "".join(DocumentProcessor.until_error(pieces, file_path))
+
+    WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+    DOCX_LINE_BATCH = 200
+
+    @staticmethod
+    def iter_text_from_docx(file_path: str) -> Iterator[str]:
+        """Yield the paragraphs and table rows of a DOCX file in document order.
+
+        ``word/document.xml`` is read straight from the archive with an
+        incremental parser and every finished body element is discarded, so
+        memory stays flat however long the document is. Table rows are
+        written as cells joined by `` | ``, like spreadsheet rows, and
+        heading paragraphs start with ``HEADING_MARK``.
+        """
+        w = DocumentProcessor.WORD_NAMESPACE
+        body_tag, paragraph_tag, text_tag = w + 'body', w + 'p', w + 't'
+        row_tag, cell_tag = w + 'tr', w + 'tc'
+        style_tag, outline_tag = w + 'pStyle', w + 'outlineLvl'
+        breaks = {w + 'tab': '\t', w + 'br': '\n', w + 'cr': '\n'}
+
+        with zipfile.ZipFile(file_path) as archive, archive.open('word/document.xml') as xml_file:
+            heading_styles = DocumentProcessor.docx_heading_styles(archive)
+            body = None
+            depth = 0  # element depth below <w:body>
+            runs = []  # text of the current paragraph
+            level = 0  # heading level of the current paragraph
+            cells = []  # stack of open table cells, each a list of paragraphs
+            rows = []  # stack of open table rows, each a list of cell texts
+            lines = []
+
+            for event, elem in ET.iterparse(xml_file, events=('start', 'end')):
+                tag = elem.tag
+                if event == 'start':
+                    if body is not None:
+                        depth += 1
+                    elif tag == body_tag:
+                        body = elem
+                    if tag == row_tag:
+                        rows.append([])
+                    elif tag == cell_tag:
+                        cells.append([])
+                    continue
+
+                if tag == text_tag:
+                    if elem.text:
+                        runs.append(elem.text)
+                elif tag in breaks:
+                    runs.append(breaks[tag])
+                elif tag == style_tag:
+                    level = heading_styles.get(elem.get(w + 'val'), level)
+                elif tag == outline_tag:
+                    level = DocumentProcessor.docx_outline_level(elem.get(w + 'val'))
+                elif tag == paragraph_tag:
+                    paragraph = "".join(runs)
+                    runs = []
+                    if cells:
+                        cells[-1].append(paragraph)
+                    elif level and paragraph.strip():
+                        lines.append(HEADING_MARK * level + " ".join(paragraph.split()))
+                    else:
+                        lines.append(paragraph)
+                    level = 0
+                elif tag == cell_tag:
+                    cell = cells.pop()
+                    rows[-1].append(" ".join(part for part in cell if part.strip()))
+                elif tag == row_tag:
+                    row_text = " | ".join(rows.pop())
+                    if cells:
+                        # Nested table: the row belongs to the enclosing cell
+                        cells[-1].append(row_text)
+                    elif row_text.strip(" |"):
+                        lines.append(row_text)
+
+                if body is not None and tag != body_tag:
+                    depth -= 1
+                    if depth == 0:
+                        body.clear()
+                        if len(lines) >= DocumentProcessor.DOCX_LINE_BATCH:
+                            yield "\n".join(lines) + "\n"
+                            lines = []
+
+            if lines:
+                yield "\n".join(lines) + "\n"
+
+    @staticmethod
+    def docx_outline_level(value: Optional[str]) -> int:
+        """Heading level of a ``w:outlineLvl`` value; 9 and up is body text"""
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
-        except Exception as e:
-            logger.error(f"Error processing PDF {file_path}: {e}")
-            return ""
+            level = int(value) + 1
+        except (TypeError, ValueError):
+            return 0
+        return level if 1 <= level <= 9 else 0
+
+    DOCX_HEADING_NAME = re.compile(r'heading\s*([1-9])$', re.IGNORECASE)
+
+    @staticmethod
+    def docx_heading_styles(archive: zipfile.ZipFile) -> Dict[str, int]:
+        """Map the paragraph style ids of a DOCX file to their heading levels.
+
+        A style is a heading when it has an outline level or is one of the
+        built-in "heading N" styles, whose ids are localized by Word.
+        """
+        w = DocumentProcessor.WORD_NAMESPACE
+        levels = {}
+        try:
+            with archive.open('word/styles.xml') as xml_file:
+                styles = ET.parse(xml_file).getroot()
+        except (KeyError, ET.ParseError):
+            return levels
+
+        for style in styles.iter(w + 'style'):
+            if style.get(w + 'type') != 'paragraph':
+                continue
+            outline = style.find(f'{w}pPr/{w}outlineLvl')
+            level = DocumentProcessor.docx_outline_level(outline.get(w + 'val')) if outline is not None else 0
+            name = style.find(w + 'name')
+            match = DocumentProcessor.DOCX_HEADING_NAME.match(name.get(w + 'val', '')) if name is not None else None
+            if not level and match:
+                level = int(match.group(1))
+            if level:
+                levels[style.get(w + 'styleId')] = level
+        return levels
 
     @staticmethod
     def extract_text_from_docx(file_path: str) -> str:
         """Extract text from DOCX files"""
-        try:
-            doc = docx.Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
-        except Exception as e:
-            logger.error(f"Error processing DOCX {file_path}: {e}")
-            return ""
+        pieces = DocumentProcessor.iter_text_from_docx(file_path)
+        return "".join(DocumentProcessor.until_error(pieces, file_path)).replace(HEADING_MARK, "")
+
+    # Limits per sheet; rows beyond them are not indexed
+    EXCEL_MAX_ROWS_PER_SHEET = int(os.environ.get('EXCEL_MAX_ROWS_PER_SHEET', 200000))
+    EXCEL_MAX_CELLS_PER_SHEET = int(os.environ.get('EXCEL_MAX_CELLS_PER_SHEET', 5000000))
+    EXCEL_ROW_BATCH = 500
 
     @staticmethod
-    def extract_text_from_excel(file_path: str) -> str:
-        """Extract text from Excel files"""
+    def iter_text_from_excel(file_path: str, max_rows: int = None, max_cells: int = None) -> Iterator[str]:
+        """Yield the rows of an Excel workbook in batches, sheet by sheet.
+
+        The workbook is opened in read-only mode so rows are streamed from
+        the file instead of building the whole cell graph. Sheets are
+        separated by ``SECTION_BREAK`` and start with their title as a
+        heading.
+        """
+        if max_rows is None:
+            max_rows = DocumentProcessor.EXCEL_MAX_ROWS_PER_SHEET
+        if max_cells is None:
+            max_cells = DocumentProcessor.EXCEL_MAX_CELLS_PER_SHEET
+
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+
         try:
-            workbook = openpyxl.load_workbook(file_path, data_only=True)
-            text = ""
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                text += f"Sheet: {sheet_name}\n"
+            for sheet_number, sheet in enumerate(workbook.worksheets):
+                if sheet_number:
+                    yield SECTION_BREAK
+                yield f"{HEADING_MARK}Sheet: {sheet.title}\n"
+
+                lines = []
+                row_count = 0
+                cell_count = 0
                 for row in sheet.iter_rows(values_only=True):
+                    row_count += 1
+                    cell_count += len(row)
+                    if row_count > max_rows or cell_count > max_cells:
+                        logger.warning(f"Excel sheet {sheet.title} in {file_path} truncated at row {row_count - 1}")
+                        break
                     row_text = " | ".join([str(cell) if cell is not None else "" for cell in row])
                     if row_text.strip():
-                        text += row_text + "\n"
-                text += "\n"
-            return text
-        except Exception as e:
-            logger.error(f"Error processing Excel {file_path}: {e}")
-            return ""
+                        lines.append(row_text)
+                    if len(lines) >= DocumentProcessor.EXCEL_ROW_BATCH:
+                        yield "\n".join(lines) + "\n"
+                        lines = []
+                if lines:
+                    yield "\n".join(lines) + "\n"
+                yield "\n"
+        finally:
+            workbook.close()
 
     @staticmethod
-    def extract_text_from_txt(file_path: str) -> str:
-        """Extract text from plain text files"""
+    def extract_text_from_excel(file_path: str) -> str:
+        """Extract text from Excel files"""
+        pieces = DocumentProcessor.iter_text_from_excel(file_path)
+        text = "".join(DocumentProcessor.until_error(pieces, file_path))
+        return text.replace(SECTION_BREAK, "").replace(HEADING_MARK, "")
+
+    @staticmethod
+    def excel_headers(row: tuple) -> Optional[List[str]]:
+        """Column names from a sheet's first non-empty row, or None if it holds data.
+
+        A row counts as the header when every filled cell is text. Unnamed
+        columns get their column letter and repeated names a number.
+        """
+        if not all(isinstance(cell, str) for cell in row if cell is not None):
+            return None
+        headers = []
+        for column, cell in enumerate(row, 1):
+            name = ' '.join(cell.split()) if cell is not None else ''
+            name = name or openpyxl.utils.get_column_letter(column)
+            unique, number = name, 1
+            while unique in headers:
+                number += 1
+                unique = f"{name} {number}"
+            headers.append(unique)
+        return headers
+
+    @staticmethod
+    def iter_rows_from_excel(file_path: str, max_rows: int = None, max_cells: int = None) -> Iterator[Dict]:
+        """Yield the data rows of an Excel workbook with their typed cell values.
+
+        Each row is a dict with the sheet title, the row number in the sheet
+        and ``cells`` mapping column names to values as openpyxl reads them
+        (str, int, float, bool, datetime, ...). Columns are named after the
+        sheet's header row, or after their letters when the sheet has none.
+        Empty rows and cells are left out; the sheet limits of
+        ``iter_text_from_excel`` apply.
+        """
+        if max_rows is None:
+            max_rows = DocumentProcessor.EXCEL_MAX_ROWS_PER_SHEET
+        if max_cells is None:
+            max_cells = DocumentProcessor.EXCEL_MAX_CELLS_PER_SHEET
+
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                return file.read()
+            for sheet in workbook.worksheets:
+                headers = None
+                cell_count = 0
+                for row_number, row in enumerate(sheet.iter_rows(values_only=True), 1):
+                    cell_count += len(row)
+                    if row_number > max_rows or cell_count > max_cells:
+                        break
+                    if all(cell is None or cell == '' for cell in row):
+                        continue
+                    if headers is None:
+                        headers = DocumentProcessor.excel_headers(row)
+                        if headers is not None:
+                            continue
+                        headers = []
+                    while len(headers) < len(row):
+                        headers.append(openpyxl.utils.get_column_letter(len(headers) + 1))
+                    yield {
+                        'sheet': sheet.title,
+                        'row_number': row_number,
+                        'cells': {header: cell for header, cell in zip(headers, row)
+                                  if cell is not None and cell != ''}
+                    }
+        finally:
+            workbook.close()
+
+    READ_BLOCK_SIZE = 64 * 1024
+    ENCODING_SAMPLE_SIZE = 64 * 1024
+    # Letters of the Turkish/Azerbaijani Latin alphabet in cp1254 (ç, ğ, ı,
+    # ö, ş, ü and capitals); in cp1251 the same bytes are mostly rare Cyrillic
+    CP1254_LETTERS = frozenset(b'\xc7\xd0\xd6\xdc\xdd\xde\xe7\xf0\xf6\xfc\xfd\xfe')
+
+    @staticmethod
+    def detect_encoding(sample: bytes, complete: bool = False) -> str:
+        """Guess the encoding of a text file from its first bytes.
+
+        ``complete`` tells whether the sample is the whole file, in which
+        case a multi-byte character cut at the end is an error.
+        """
+        if sample.startswith(codecs.BOM_UTF8):
+            return 'utf-8-sig'
+        if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return 'utf-16'
+
+        # UTF-16 without a BOM: ASCII-range text leaves every other byte zero
+        if len(sample) >= 4:
+            even_zeros = sample[0::2].count(0)
+            odd_zeros = sample[1::2].count(0)
+            half = len(sample) // 2
+            if odd_zeros > half * 0.3 and even_zeros < half * 0.05:
+                return 'utf-16-le'
+            if even_zeros > half * 0.3 and odd_zeros < half * 0.05:
+                return 'utf-16-be'
+
+        try:
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=complete)
+            return 'utf-8'
         except UnicodeDecodeError:
-            try:
-                with open(file_path, 'r', encoding='cp1251') as file:
-                    return file.read()
-            except Exception as e:
-                logger.error(f"Error processing TXT {file_path}: {e}")
-                return ""
+            pass
+
+        high = [byte for byte in sample if byte >= 0xc0]
+        if high and sum(byte in DocumentProcessor.CP1254_LETTERS for byte in high) > len(high) * 0.5:
+            return 'cp1254'
+        return 'cp1251'
+
+    @staticmethod
+    def open_text(file_path: str):
+        """Open a text file with its encoding detected from a bounded sample.
+
+        The sample is peeked from the read buffer, so every byte of the file
+        is read from disk once; decoding then happens incrementally as the
+        returned text stream is read. Newlines are normalized to ``\\n``.
+        """
+        raw = open(file_path, 'rb', buffering=DocumentProcessor.ENCODING_SAMPLE_SIZE)
+        try:
+            sample = raw.peek(DocumentProcessor.ENCODING_SAMPLE_SIZE)[:DocumentProcessor.ENCODING_SAMPLE_SIZE]
+            complete = len(sample) < DocumentProcessor.ENCODING_SAMPLE_SIZE
+            encoding = DocumentProcessor.detect_encoding(sample, complete)
+            # A misdetection past the sample replaces characters instead of failing
+            return io.TextIOWrapper(raw, encoding=encoding, errors='replace')
+        except Exception:
+            raw.close()
+            raise
+
+    @staticmethod
+    def iter_text_from_txt(file_path: str) -> Iterator[str]:
+        """Yield the text of a plain text file block by block"""
+        with DocumentProcessor.open_text(file_path) as file:
+            for block in iter(lambda: file.read(DocumentProcessor.READ_BLOCK_SIZE), ''):
+                yield block
+
+    @staticmethod
+    def extract_text_from_txt(file_path: str) -> str:
+        """Extract text from plain text files"""
+        pieces = DocumentProcessor.iter_text_from_txt(file_path)
+        return "".join(DocumentProcessor.until_error(pieces, file_path))
+
+    @staticmethod
+    def iter_text_from_html(file_path: str) -> Iterator[str]:
+        """Yield the text of an HTML file, parsing it block by block.
+
+        Script and style contents are skipped and block-level tags become
+        line breaks so words from neighbouring elements are not glued.
+        ``h1``-``h6`` headings are put on lines starting with ``HEADING_MARK``.
+        """
+        parser = HTMLTextParser()
+        with DocumentProcessor.open_text(file_path) as file:
+            for block in iter(lambda: file.read(DocumentProcessor.READ_BLOCK_SIZE), ''):
+                parser.feed(block)
+                text = parser.take_text()
+                if text:
+                    yield text
+        parser.close()
+        text = parser.take_text()
+        if text:
+            yield text
 
     @staticmethod
     def extract_text_from_html(file_path: str) -> str:
         """Extract text from HTML files"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                soup = BeautifulSoup(file.read(), 'html.parser')
-                return soup.get_text()
-        except Exception as e:
-            logger.error(f"Error processing HTML {file_path}: {e}")
-            return ""
+        pieces = DocumentProcessor.iter_text_from_html(file_path)
+        return "".join(DocumentProcessor.until_error(pieces, file_path)).replace(HEADING_MARK, "")
+
+    # Markdown syntax stripped line by line, without rendering to HTML
+    MD_FENCE = re.compile(r'^\s{0,3}(`{3,}|~{3,})')
+    MD_RULE = re.compile(r'^\s{0,3}([-*_=])(?:\s*\1){2,}\s*$')
+    MD_LINK_DEFINITION = re.compile(r'^\s{0,3}\[[^\]]+\]:\s*\S')
+    MD_BLOCK_PREFIX = re.compile(r'^\s*(?:>\s?)*\s*(?:#{1,6}(?=\s|$)|(?:(?:[-*+]|\d{1,9}[.)])\s+)+)?\s*')
+    MD_HEADING = re.compile(r'^\s{0,3}(#{1,6})(?=\s|$)')
+    MD_HEADING_CLOSE = re.compile(r'\s+#+\s*$')
+    MD_INLINE = re.compile(
+        r'(?=[!\[<\\`*_])(?:'                                 # cheap first-character filter
+        r'!\[[^\]]*\](?:\([^)]*\)|\[[^\]]*\])'                # images
+        r'|\[([^\]]*)\](?:\([^)]*\)|\[[^\]]*\])'              # links -> their text
+        r'|<((?:https?|ftp|mailto):[^>\s]+)>'                 # autolinks -> the address
+        r'|</?[A-Za-z][^>]*>'                                 # inline HTML tags
+        r'|\\([\\`*_{}\[\]()#+\-.!])'                         # backslash escapes
+        r'|`+|\*{1,3}(?=\S)|(?<=\S)\*{1,3}'                   # code spans and emphasis
+        r'|(?<!\w)_{1,3}(?=\S)|(?<=\S)_{1,3}(?!\w))'
+    )
+    MD_LINE_BATCH = 500
+
+    @staticmethod
+    def markdown_inline_text(match) -> str:
+        return match.group(1) or match.group(2) or match.group(3) or ""
+
+    @staticmethod
+    def iter_text_from_md(file_path: str) -> Iterator[str]:
+        """Yield the plain text of a Markdown file in one pass over its lines.
+
+        Block markers (headings, quotes, list bullets, rules, fences) and
+        inline markup are stripped directly instead of rendering the
+        document to HTML and parsing it again. Code is kept verbatim.
+        Heading lines start with ``HEADING_MARK``.
+        """
+        processor = DocumentProcessor
+        with processor.open_text(file_path) as file:
+            lines = []
+            fence = None
+            title = None  # index of a one-line plain paragraph a setext underline can turn into a heading
+            for line in file:
+                line = line.rstrip('\r\n')
+                fence_match = processor.MD_FENCE.match(line)
+                follows_blank = not lines or not lines[-1].strip()
+                underlined, title = title, None
+                if fence:
+                    if fence_match and fence_match.group(1).startswith(fence):
+                        fence = None
+                    else:
+                        lines.append(line)
+                elif fence_match:
+                    fence = fence_match.group(1)
+                elif processor.MD_RULE.match(line) or processor.MD_LINK_DEFINITION.match(line):
+                    rule = line.strip()[:1]
+                    if rule in '=-' and underlined is not None and underlined == len(lines) - 1:
+                        lines[-1] = HEADING_MARK * (1 if rule == '=' else 2) + lines[-1].strip()
+                    lines.append("")
+                else:
+                    heading = processor.MD_HEADING.match(line)
+                    prefix = processor.MD_BLOCK_PREFIX.match(line).group()
+                    plain = not prefix.strip() and len(prefix) < 4
+                    line = line[len(prefix):]
+                    line = processor.MD_HEADING_CLOSE.sub("", line)
+                    line = html.unescape(processor.MD_INLINE.sub(processor.markdown_inline_text, line))
+                    if heading and line.strip():
+                        line = HEADING_MARK * len(heading.group(1)) + line.strip()
+                    elif plain and follows_blank and line.strip():
+                        title = len(lines)
+                    lines.append(line)
+
+                if len(lines) >= processor.MD_LINE_BATCH:
+                    yield "\n".join(lines) + "\n"
+                    lines = []
+            if lines:
+                yield "\n".join(lines) + "\n"
 
     @staticmethod
     def extract_text_from_md(file_path: str) -> str:
         """Extract text from Markdown files"""
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                md_content = file.read()
-                html = markdown.markdown(md_content)
-                soup = BeautifulSoup(html, 'html.parser')
-                return soup.get_text()
-        except Exception as e:
-            logger.error(f"Error processing Markdown {file_path}: {e}")
-            return ""
+        pieces = DocumentProcessor.iter_text_from_md(file_path)
+        return "".join(DocumentProcessor.until_error(pieces, file_path)).replace(HEADING_MARK, "")
+
+    @staticmethod
+    def iter_text_from_xml(file_path: str) -> Iterator[str]:
+        """Yield ``element/path: text`` lines for an XML file, parsing it block by block"""
+        collector = XMLTextCollector()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(DocumentProcessor.READ_BLOCK_SIZE), b''):
+                collector.feed(block)
+                text = collector.take_text()
+                if text:
+                    yield text
+            collector.feed(b'', final=True)
+            text = collector.take_text()
+            if text:
+                yield text
+
+    @staticmethod
+    def extract_text_from_xml(file_path: str) -> str:
+        """Extract text from XML files"""
+        pieces = DocumentProcessor.iter_text_from_xml(file_path)
+        return "".join(DocumentProcessor.until_error(pieces, file_path))
+
+    JSON_TOKEN = re.compile(r'\s*(?:("(?:[^"\\]|\\.)*")|(-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null)|([{}\[\]:,]))')
+    # What may still be the start of a token when a block ends
+    JSON_PARTIAL_TOKEN = re.compile(r'\s*(?:"(?:[^"\\]|\\.)*\\?|-|t|tr|tru|f|fa|fal|fals|n|nu|nul)?\Z')
+    JSON_NUMBER_TAIL = re.compile(r'[\d.eE+-]*\Z')
+    # Malformed input is skipped up to the next of these
+    JSON_STRUCTURE = re.compile(r'[{}\[\]:,"]')
+    JSON_LINE_BATCH = 500
+    # Objects and arrays up to this size are decoded whole by the json module;
+    # larger ones are walked token by token
+    JSON_MAX_BUFFERED = 1024 * 1024
+
+    @staticmethod
+    def iter_text_from_json(file_path: str) -> Iterator[str]:
+        """Yield ``key.path: value`` lines for a JSON file, reading it block by block.
+
+        Objects and arrays that fit in the buffer are decoded by the json
+        module; enclosing ones are tokenized, keeping only the stack of open
+        containers, so files far larger than memory can be indexed. Array
+        positions are left out of the paths; every value is on its own line.
+        Malformed input, and tokens longer than ``JSON_MAX_BUFFERED``, are
+        skipped up to the next structural character, so the buffer stays
+        bounded.
+        """
+        processor = DocumentProcessor
+        token = processor.JSON_TOKEN
+        # Numbers keep their source text, as the tokenizer emits them
+        decoder = json.JSONDecoder(parse_float=str, parse_int=str)
+        stack = []  # [key, expecting_key] for objects, None for arrays
+        lines = []
+        buffer = ''
+        eof = False
+        skipped = 0
+        retry_size = 0
+
+        def current_path() -> str:
+            return ".".join(frame[0] for frame in stack if frame and frame[0])
+
+        def emit(path: str, value: str):
+            lines.append(f"{path}: {value}" if path else value)
+
+        def flatten(path: str, value):
+            # Dispatch on the exact type: json only produces these, and text is by far the most common
+            kind = type(value)
+            if kind is str:
+                if value.strip():
+                    lines.append(f"{path}: {value}" if path else value)
+            elif kind is dict:
+                prefix = f"{path}." if path else ''
+                for key, item in value.items():
+                    if type(item) is str:
+                        if item.strip():
+                            lines.append(f"{prefix}{key}: {item}")
+                    else:
+                        flatten(prefix + key, item)
+            elif kind is list:
+                for item in value:
+                    flatten(path, item)
+            elif kind is bool:
+                emit(path, 'true' if value else 'false')
+            elif value is not None:
+                emit(path, str(value))
+
+        with processor.open_text(file_path) as file:
+            while not eof:
+                block = file.read(processor.READ_BLOCK_SIZE)
+                eof = not block
+                buffer += block
+                position = 0
+                while True:
+                    match = token.match(buffer, position)
+                    if match is None:
+                        if not eof and len(buffer) - position < processor.JSON_MAX_BUFFERED \
+                                and processor.JSON_PARTIAL_TOKEN.match(buffer, position):
+                            break  # the token continues in the next block
+                        if not buffer[position:].strip():
+                            break
+                        resync = processor.JSON_STRUCTURE.search(buffer, position + 1)
+                        end = resync.start() if resync else len(buffer)
+                        skipped += end - position
+                        position = end
+                        continue
+                    # A token touching the end of the buffer may continue in the next block
+                    if not eof and not match.group(3) and (
+                            match.end() == len(buffer)
+                            or (match.group(2) and processor.JSON_NUMBER_TAIL.match(buffer, match.end()))):
+                        break
+                    string, scalar, punctuation = match.groups()
+                    top = stack[-1] if stack else None
+
+                    if punctuation in ('{', '['):
+                        start = match.end() - 1
+                        size = len(buffer) - start
+                        # An incomplete container is decoded again once the buffer has doubled
+                        if eof or size >= retry_size:
+                            try:
+                                value, position = decoder.raw_decode(buffer, start)
+                                flatten(current_path(), value)
+                                retry_size = 0
+                                continue
+                            except ValueError:
+                                retry_size = min(2 * size, processor.JSON_MAX_BUFFERED)
+                        if not eof and size < processor.JSON_MAX_BUFFERED:
+                            position = start
+                            break  # wait for the rest of the container
+                        retry_size = 0
+                        stack.append(['', True] if punctuation == '{' else None)
+                    elif punctuation:
+                        if punctuation in '}]':
+                            if stack:
+                                stack.pop()
+                        elif punctuation == ',' and top:
+                            top[1] = True
+                        elif punctuation == ':' and top:
+                            top[1] = False
+                    elif string is not None:
+                        value = json.loads(string) if '\\' in string else string[1:-1]
+                        if top and top[1]:
+                            top[0] = value
+                        elif value.strip():
+                            emit(current_path(), value)
+                    elif scalar != 'null':
+                        emit(current_path(), scalar)
+                    position = match.end()
+
+                buffer = buffer[position:]
+                if len(lines) >= processor.JSON_LINE_BATCH or (eof and lines):
+                    yield "\n".join(lines) + "\n"
+                    lines = []
+
+            if skipped:
+                logger.warning(f"Skipped {skipped} characters of malformed JSON in {file_path}")
+
+    @staticmethod
+    def extract_text_from_json(file_path: str) -> str:
+        """Extract text from JSON files"""
+        pieces = DocumentProcessor.iter_text_from_json(file_path)
+        return "".join(DocumentProcessor.until_error(pieces, file_path))
 
 
 class DocumentChunker:
@@ -121,40 +892,1079 @@ class DocumentChunker:
 
     def chunk_text(self, text: str, document_id: str) -> List[Dict]:
         """Split text into overlapping chunks"""
-        chunks = []
-        words = text.split()
+        chunks = list(self.iter_chunks([text], document_id))
+        for chunk in chunks:
+            chunk['total_chunks'] = len(chunks)
+        return chunks
+
+    def iter_chunks(self, pieces: Iterable[str], document_id: str) -> Iterator[Dict]:
+        """Split a stream of text pieces into overlapping chunks.
+
+        Chunks hold ``max_chunk_size`` words and consecutive chunks share
+        ``overlap_size`` words. Each chunk carries ``start_offset`` and
+        ``end_offset`` character positions into the concatenated source and
+        its content is the verbatim slice between them. Only the text of the
+        current window is held in memory; a document that fits in one chunk
+        is returned whole. ``SECTION_BREAK`` markers end the current chunk;
+        neither they nor ``HEADING_MARK`` are counted in the offsets.
+        """
+        max_words = self.max_chunk_size
+        step = max(1, max_words - self.overlap_size)
+        overlap = max_words - step
+        # Counted repeats let the regex engine skip whole runs of words: one
+        # pass reaches the next window start, a second covers the overlap
+        next_start = re.compile(r'(?:\S+\s+){%d}' % step)
+        chunk_end = re.compile(r'(?:\S+\s+){%d}\S+' % (overlap - 1 if overlap else max_words - 1))
+        buffer = ''
+        base = 0  # source offset of buffer[0]
+        start = None  # source offset of the first word of the current window
+        words = 0  # number of words from ``start`` to the end of the buffer
+        chunk_index = 0
+        sectioned = False
+
+        def make_chunk(end: int) -> Dict:
+            return {
+                'chunk_id': f"{document_id}_chunk_{chunk_index}",
+                'content': buffer[start - base:end - base],
+                'chunk_index': chunk_index,
+                'start_offset': start,
+                'end_offset': end
+            }
+
+        def emit_full_windows():
+            nonlocal buffer, base, start, words, chunk_index
+            if start is None:
+                start = base + re.search(r'\S', buffer).start()
+            while words > max_words:
+                following = next_start.match(buffer, start - base).end()
+                end = chunk_end.match(buffer, following if overlap else start - base).end()
+                yield make_chunk(base + end)
+                chunk_index += 1
+                start = base + following
+                words -= step
+            # Drop text that no later chunk can reach
+            buffer = buffer[start - base:]
+            base = start
+
+        def add(piece: str):
+            nonlocal buffer, words
+            count = len(piece.split())
+            if count and buffer and not buffer[-1].isspace() and not piece[0].isspace():
+                count -= 1  # a word continued from the previous piece
+            buffer += piece
+            words += count
+            if words > max_words:
+                yield from emit_full_windows()
 
-        if len(words) <= self.max_chunk_size:
-            return [{
+        def end_section():
+            nonlocal buffer, base, start, words, chunk_index
+            if words:
+                yield from emit_full_windows()
+                yield make_chunk(base + len(buffer.rstrip()))
+                chunk_index += 1
+            base += len(buffer)
+            buffer = ''
+            start = None
+            words = 0
+
+        for piece in pieces:
+            piece = piece.replace(HEADING_MARK, '')
+            if not piece:
+                continue
+            if SECTION_BREAK in piece:
+                sectioned = True
+                for number, part in enumerate(piece.split(SECTION_BREAK)):
+                    if number:
+                        yield from end_section()
+                    if part:
+                        yield from add(part)
+            else:
+                yield from add(piece)
+
+        if not sectioned and chunk_index == 0 and words <= max_words:
+            yield {
                 'chunk_id': f"{document_id}_chunk_0",
-                'content': text,
+                'content': buffer,
                 'chunk_index': 0,
-                'total_chunks': 1
-            }]
+                'start_offset': 0,
+                'end_offset': len(buffer)
+            }
+            return
 
-        total_chunks = (len(words) + self.max_chunk_size - 1) // self.max_chunk_size
+        yield from end_section()
+        if chunk_index == 0:
+            yield {
+                'chunk_id': f"{document_id}_chunk_0",
+                'content': '',
+                'chunk_index': 0,
+                'start_offset': base,
+                'end_offset': base
+            }
 
-        for i in range(0, len(words), self.max_chunk_size - self.overlap_size):
-            chunk_words = words[i:i + self.max_chunk_size]
-            chunk_text = ' '.join(chunk_words)
 
-            chunks.append({
-                'chunk_id': f"{document_id}_chunk_{len(chunks)}",
-                'content': chunk_text,
-                'chunk_index': len(chunks),
-                'total_chunks': total_chunks
-            })
+class ContentDefinedChunker:
+    """Splits documents at boundaries chosen by the text itself.
 
-            if i + self.max_chunk_size >= len(words):
-                break
+    A rolling hash runs over the words and a chunk ends after a word where
+    the low bits of the hash are zero, within ``min_chunk_words`` and
+    ``max_chunk_words``. The hash only depends on the last few words, so an
+    edit moves the boundaries next to it and every other chunk of a new
+    version comes out byte-identical to the previous one. Chunks do not
+    overlap; like ``DocumentChunker`` they carry ``start_offset`` and
+    ``end_offset`` and ``SECTION_BREAK`` markers end the current chunk.
+    """
+
+    WORD = re.compile(r'\S+')
+
+    def __init__(self, avg_chunk_words: int = 1024, min_chunk_words: int = 256, max_chunk_words: int = 4000):
+        self.avg_chunk_words = avg_chunk_words
+        self.min_chunk_words = min_chunk_words
+        self.max_chunk_words = max_chunk_words
+        # Past the minimum size a boundary follows after about ``avg - min``
+        # words, rounded down to a power of two
+        self.mask = (1 << max(0, (avg_chunk_words - min_chunk_words).bit_length() - 1)) - 1
+
+    def chunk_text(self, text: str, document_id: str) -> List[Dict]:
+        """Split text into content-defined chunks"""
+        chunks = list(self.iter_chunks([text], document_id))
+        for chunk in chunks:
+            chunk['total_chunks'] = len(chunks)
+        return chunks
+
+    def iter_chunks(self, pieces: Iterable[str], document_id: str) -> Iterator[Dict]:
+        """Split a stream of text pieces into content-defined chunks"""
+        buffer = ''
+        pending = []  # pieces not yet appended to the buffer
+        pending_size = 0
+        base = 0  # source offset of buffer[0]
+        start = None  # buffer offset of the first word of the current chunk
+        scanned = 0  # buffer offset up to which words were hashed
+        words = 0
+        rolling = 0
+        chunk_index = 0
+
+        def make_chunk(end: int) -> Dict:
+            return {
+                'chunk_id': f"{document_id}_chunk_{chunk_index}",
+                'content': buffer[start:end],
+                'chunk_index': chunk_index,
+                'start_offset': base + start,
+                'end_offset': base + end
+            }
+
+        def scan(final: bool):
+            nonlocal buffer, pending_size, base, start, scanned, words, rolling, chunk_index
+            buffer += ''.join(pending)
+            pending.clear()
+            pending_size = 0
+            for match in self.WORD.finditer(buffer, scanned):
+                if match.end() == len(buffer) and not final:
+                    break  # the word may continue in the next piece
+                if start is None:
+                    start = match.start()
+                scanned = match.end()
+                words += 1
+                rolling = ((rolling << 1) + zlib.crc32(match.group().encode())) & 0xFFFFFFFFFFFFFFFF
+                if words >= self.max_chunk_words or (words >= self.min_chunk_words and not rolling & self.mask):
+                    yield make_chunk(scanned)
+                    chunk_index += 1
+                    start = None
+                    words = 0
+            # Drop text that belongs to emitted chunks
+            keep = scanned if start is None else start
+            buffer = buffer[keep:]
+            base += keep
+            scanned -= keep
+            if start is not None:
+                start = 0
+
+        def end_section():
+            nonlocal buffer, base, start, scanned, words, chunk_index
+            yield from scan(True)
+            if words:
+                yield make_chunk(scanned)
+                chunk_index += 1
+            base += len(buffer)
+            buffer = ''
+            start = None
+            scanned = 0
+            words = 0
 
+        for piece in pieces:
+            piece = piece.replace(HEADING_MARK, '')
+            if not piece:
+                continue
+            for number, part in enumerate(piece.split(SECTION_BREAK)):
+                if number:
+                    yield from end_section()
+                pending.append(part)
+                pending_size += len(part)
+            if pending_size > 64 * 1024:
+                yield from scan(False)
+
+        yield from end_section()
+        if chunk_index == 0:
+            yield {
+                'chunk_id': f"{document_id}_chunk_0",
+                'content': '',
+                'chunk_index': 0,
+                'start_offset': base,
+                'end_offset': base
+            }
+
+
+class SectionChunker:
+    """Splits documents along their headings, paragraphs and sentences.
+
+    Extractors start heading lines with ``HEADING_MARK``. A heading ends the
+    current chunk and every chunk records the titles of the headings it falls
+    under as ``section_path``, e.g. ``3. Bölmə > 3.2 Əsas Qaydalar``. Within a
+    section, sentences are packed into chunks of at most ``max_tokens``
+    tokens; a full chunk is cut at the strongest boundary in its second half
+    (a paragraph end, then a sentence end, a line break or a word), so
+    retrieval gets small, self-contained passages. Like the other chunkers,
+    chunks carry ``start_offset`` and ``end_offset`` and ``SECTION_BREAK``
+    markers end the current chunk, and the section path with it.
+    """
+
+    # Words and punctuation, a rough stand-in for model tokens
+    TOKEN = re.compile(r'\w+|[^\w\s]')
+    WORD = re.compile(r'\S+')
+    SENTENCE_END = re.compile(r'[.!?…]+["\'»”)\]]*(?=\s|$)')
+    # Boundary strengths, weakest first
+    WORD_BREAK, LINE_BREAK, SENTENCE_BREAK, PARAGRAPH_BREAK = range(4)
+    PATH_SEPARATOR = ' > '
+    MAX_TITLE_CHARS = 200
+    # Text without line breaks is cut at a space once it grows this long
+    MAX_LINE_CHARS = 64 * 1024
+
+    def __init__(self, max_tokens: int = 512):
+        self.max_tokens = max_tokens
+
+    def chunk_text(self, text: str, document_id: str) -> List[Dict]:
+        """Split text into section-aligned chunks"""
+        chunks = list(self.iter_chunks([text], document_id))
+        for chunk in chunks:
+            chunk['total_chunks'] = len(chunks)
         return chunks
 
+    def split_line(self, text: str, offset: int, line_end: bool) -> List[List[int]]:
+        """Split one line into sentence units of at most ``max_tokens`` tokens.
+
+        Units are ``[start, end, tokens, boundary]`` lists, with offsets
+        relative to ``offset`` and ``boundary`` the strength of the boundary
+        after the unit.
+        """
+        units = []
+        start = 0
+        ends = [(match.end(), self.SENTENCE_BREAK) for match in self.SENTENCE_END.finditer(text)]
+        if not ends or ends[-1][0] < len(text):
+            ends.append((len(text), self.WORD_BREAK))
+        for end, boundary in ends:
+            segment = text[start:end]
+            stripped = segment.strip()
+            if stripped:
+                first = start + len(segment) - len(segment.lstrip())
+                last = first + len(stripped)
+                tokens = len(self.TOKEN.findall(text, first, last))
+                if tokens > self.max_tokens:
+                    units.extend(self.split_words(text, first, last))
+                    units[-1][3] = boundary
+                else:
+                    units.append([first, last, tokens, boundary])
+            start = end
+
+        if units and line_end:
+            units[-1][3] = max(units[-1][3], self.LINE_BREAK)
+        for unit in units:
+            unit[0] += offset
+            unit[1] += offset
+        return units
+
+    def split_words(self, text: str, start: int, end: int) -> List[List[int]]:
+        """Cut a sentence longer than the token budget between words"""
+        units = []
+        first = start
+        last = start
+        tokens = 0
+        for word in self.WORD.finditer(text, start, end):
+            count = len(self.TOKEN.findall(word.group()))
+            if tokens and tokens + count > self.max_tokens:
+                units.append([first, last, tokens, self.WORD_BREAK])
+                first = word.start()
+                tokens = 0
+            tokens += count
+            last = word.end()
+        units.append([first, last, tokens, self.WORD_BREAK])
+        return units
+
+    def cut_point(self, units: List[List[int]]) -> int:
+        """Number of leading units to emit from a chunk over the token budget"""
+        best = None
+        best_key = None
+        tokens = 0
+        for index, unit in enumerate(units[:-1]):
+            tokens += unit[2]
+            if tokens > self.max_tokens:
+                break
+            # Past half the budget the strongest boundary wins, else the latest
+            past_half = tokens * 2 >= self.max_tokens
+            key = (past_half, unit[3] if past_half else 0, index)
+            if best_key is None or key > best_key:
+                best, best_key = index, key
+        return 1 if best is None else best + 1
+
+    def iter_chunks(self, pieces: Iterable[str], document_id: str) -> Iterator[Dict]:
+        """Split a stream of text pieces into section-aligned chunks"""
+        buffer = ''  # text from ``base`` that pending units point into
+        base = 0
+        raw = ''  # the incomplete last line of the pieces read so far
+        line_start = True
+        units = []  # sentence units of the current chunk, as source offsets
+        tokens = 0
+        path = []  # (level, title) of the headings above the current text
+        chunk_index = 0
+
+        def emit(count: int):
+            nonlocal tokens, chunk_index
+            start, end = units[0][0], units[count - 1][1]
+            yield {
+                'chunk_id': f"{document_id}_chunk_{chunk_index}",
+                'content': buffer[start - base:end - base],
+                'chunk_index': chunk_index,
+                'start_offset': start,
+                'end_offset': end,
+                'section_path': self.PATH_SEPARATOR.join(title for _, title in path) or None
+            }
+            chunk_index += 1
+            tokens -= sum(unit[2] for unit in units[:count])
+            del units[:count]
+
+        def flush():
+            if units:
+                yield from emit(len(units))
+
+        def add_line(text: str, line_end: bool):
+            nonlocal buffer, base, tokens, line_start
+            # Drop text that no pending unit needs, in large steps
+            keep = units[0][0] - base if units else len(buffer)
+            if keep > self.MAX_LINE_CHARS:
+                buffer = buffer[keep:]
+                base += keep
+
+            level = 0
+            if line_start:
+                level = len(text) - len(text.lstrip(HEADING_MARK))
+            if HEADING_MARK in text:
+                text = text.replace(HEADING_MARK, '')
+            line_start = line_end
+            offset = base + len(buffer)
+            buffer += text + '\n' if line_end else text
+
+            if not text.strip():
+                if line_end and units:
+                    units[-1][3] = self.PARAGRAPH_BREAK
+                return
+            if level:
+                yield from flush()
+                while path and path[-1][0] >= level:
+                    path.pop()
+                path.append((level, " ".join(text.split())[:self.MAX_TITLE_CHARS]))
+
+            for unit in self.split_line(text, offset, line_end):
+                units.append(unit)
+                tokens += unit[2]
+                while tokens > self.max_tokens and len(units) > 1:
+                    yield from emit(self.cut_point(units))
+
+        def end_section():
+            nonlocal raw, line_start
+            if raw:
+                yield from add_line(raw, False)
+            raw = ''
+            yield from flush()
+            path.clear()
+            line_start = True
+
+        for piece in pieces:
+            if not piece:
+                continue
+            for number, part in enumerate(piece.split(SECTION_BREAK)):
+                if number:
+                    yield from end_section()
+                lines = (raw + part).split('\n')
+                raw = lines.pop()
+                for line in lines:
+                    yield from add_line(line, True)
+                if len(raw) > self.MAX_LINE_CHARS:
+                    cut = max(raw.rfind(' '), raw.rfind('\t')) + 1 or len(raw)
+                    yield from add_line(raw[:cut], False)
+                    raw = raw[cut:]
+
+        yield from end_section()
+        if chunk_index == 0:
+            yield {
+                'chunk_id': f"{document_id}_chunk_0",
+                'content': '',
+                'chunk_index': 0,
+                'start_offset': base + len(buffer),
+                'end_offset': base + len(buffer),
+                'section_path': None
+            }
+
+
+class SimHash:
+    """64-bit SimHash fingerprints for finding near-duplicate chunks.
+
+    A fingerprint is built from the word 3-shingles of a text, so texts that
+    share most of their shingles get fingerprints that differ in few bits.
+    Splitting fingerprints into ``max_distance + 1`` bands guarantees that
+    two fingerprints within ``max_distance`` bits agree on at least one band,
+    which lets candidates be looked up by exact band values.
+    """
+
+    BITS = 64
+    SHINGLE_WORDS = 3
+
+    @staticmethod
+    def fingerprint(text: str) -> int:
+        """Fingerprint of a text; 0 for text without words"""
+        words = re.findall(r'\w+', text.lower())
+        size = SimHash.SHINGLE_WORDS
+        shingles = {' '.join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+        shingles.discard('')
+        if not shingles:
+            return 0
+
+        hashes = [format(int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'big'), '064b')
+                  for shingle in shingles]
+        # A bit is set when most shingle hashes have it set
+        fingerprint = 0
+        for column in zip(*hashes):
+            fingerprint = (fingerprint << 1) | (column.count('1') * 2 > len(hashes))
+        return fingerprint
+
+    @staticmethod
+    def distance(first: int, second: int) -> int:
+        """Number of differing bits"""
+        return bin(first ^ second).count('1')
+
+    @staticmethod
+    def bands(fingerprint: int, count: int) -> List[int]:
+        """Split a fingerprint into ``count`` bands of about equal width"""
+        bounds = [SimHash.BITS * i // count for i in range(count + 1)]
+        return [(fingerprint >> low) & ((1 << (high - low)) - 1) for low, high in zip(bounds, bounds[1:])]
+
+    @staticmethod
+    def to_signed(fingerprint: int) -> int:
+        """Fingerprint as a signed integer that fits an SQLite INTEGER"""
+        return fingerprint - (1 << SimHash.BITS) if fingerprint >= 1 << (SimHash.BITS - 1) else fingerprint
+
+    @staticmethod
+    def from_signed(value: int) -> int:
+        """Inverse of ``to_signed``"""
+        return value + (1 << SimHash.BITS) if value < 0 else value
+
+
+class ExtractiveSummarizer:
+    """Extractive summaries of documents and their sections, ranked locally with NumPy.
+
+    Sentences become term-frequency vectors weighted by inverse sentence
+    frequency. A power iteration over their cosine similarity graph
+    (LexRank) scores how central each sentence is, and the best sentences are
+    returned in document order, skipping ones that repeat a sentence already
+    chosen. Without NumPy the leading sentences are used.
+    """
+
+    SENTENCE_SPLIT = re.compile(r'(?<=[.!?…])["\'»”)\]]*\s+')
+    LINE_BREAK = re.compile(r'\s*\n\s*(?!\s*[a-zəğıöüşç])')
+    TERM = re.compile(r'\w+')
+    # Fragments (headings, table cells) and blobs (tables, lists) are not sentences
+    MIN_SENTENCE_WORDS = 4
+    MAX_SENTENCE_CHARS = 600
+    # Longer inputs are ranked on an evenly spaced sample of this many sentences
+    MAX_RANKED_SENTENCES = 500
+    # Columns of the sentence-term matrix
+    MAX_TERMS = 2048
+    DAMPING = 0.85
+    MAX_ITERATIONS = 50
+    REDUNDANT_SIMILARITY = 0.7
+
+    def __init__(self, document_sentences: int = 5, section_sentences: int = 2):
+        self.document_sentences = document_sentences
+        self.section_sentences = section_sentences
+
+    def split_sentences(self, text: str) -> List[str]:
+        """Split text into whitespace-normalized sentences worth ranking.
+
+        A line break ends a sentence unless the next line carries on in
+        lower case, which keeps headings apart from the text under them
+        while rejoining wrapped lines.
+        """
+        sentences = []
+        for block in self.LINE_BREAK.split(text):
+            for part in self.SENTENCE_SPLIT.split(block):
+                sentence = " ".join(part.split())
+                if len(sentence) <= self.MAX_SENTENCE_CHARS and len(sentence.split()) >= self.MIN_SENTENCE_WORDS:
+                    sentences.append(sentence)
+        return sentences
+
+    def term_vectors(self, sentences: List[str]):
+        """Unit-length TF-IDF vectors of the sentences over their most shared terms.
+
+        Only the ``MAX_TERMS`` terms found in the most sentences get a column,
+        which bounds the matrix for sentences with large vocabularies. The
+        other terms still count towards each vector's length.
+        """
+        vocabulary = {}
+        rows, columns = [], []
+        for index, sentence in enumerate(sentences):
+            for term in self.TERM.findall(sentence.lower()):
+                rows.append(index)
+                columns.append(vocabulary.setdefault(term, len(vocabulary)))
+
+        # Distinct (sentence, term) pairs with their counts
+        size = max(1, len(vocabulary))
+        pairs, counts = np.unique(np.array(rows, dtype=np.int64) * size + np.array(columns, dtype=np.int64),
+                                  return_counts=True)
+        rows, columns = pairs // size, pairs % size
+        frequency = np.bincount(columns, minlength=size)
+        idf = np.log((1 + len(sentences)) / (1 + frequency)) + 1
+        weights = (np.log1p(counts) * idf[columns]).astype(np.float32)
+        norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=len(sentences)))
+        norms[norms == 0] = 1
+
+        kept = np.argsort(-frequency, kind='stable')[:self.MAX_TERMS]
+        column_of = np.full(size, -1, dtype=np.int64)
+        column_of[kept] = np.arange(len(kept))
+        present = column_of[columns] >= 0
+        vectors = np.zeros((len(sentences), len(kept)), dtype=np.float32)
+        vectors[rows[present], column_of[columns[present]]] = weights[present] / norms[rows[present]]
+        return vectors
+
+    def rank(self, sentences: List[str]) -> List[int]:
+        """Indexes of the sentences, most central first"""
+        vectors = self.term_vectors(sentences)
+        similarity = vectors @ vectors.T
+        np.fill_diagonal(similarity, 0)
+        totals = similarity.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1
+        transition = (similarity / totals).T
+
+        count = len(sentences)
+        scores = np.full(count, 1 / count, dtype=np.float32)
+        for _ in range(self.MAX_ITERATIONS):
+            updated = (1 - self.DAMPING) / count + self.DAMPING * (transition @ scores)
+            converged = np.abs(updated - scores).sum() < 1e-6
+            scores = updated
+            if converged:
+                break
+
+        chosen = []
+        for index in np.argsort(-scores, kind='stable'):
+            if not chosen or similarity[index, chosen].max() < self.REDUNDANT_SIMILARITY:
+                chosen.append(int(index))
+        return chosen
+
+    def select(self, sentences: List[str], count: int) -> List[str]:
+        """The ``count`` most representative sentences, in their original order"""
+        if count <= 0:
+            return []
+        if len(sentences) > self.MAX_RANKED_SENTENCES:
+            sentences = sentences[::math.ceil(len(sentences) / self.MAX_RANKED_SENTENCES)]
+        if len(sentences) > count and np is not None:
+            chosen = sorted(self.rank(sentences)[:count])
+        else:
+            chosen = range(min(count, len(sentences)))
+        return [sentences[index] for index in chosen]
+
+    def annotate(self, chunks: Iterable[Dict]) -> Iterator[Dict]:
+        """Pass chunks through, adding summaries as each section ends.
+
+        The last chunk of every section with a ``section_path`` gets a
+        ``section_summary`` and the last chunk of the document a
+        ``document_summary``. The document summary is ranked over the
+        section summaries, or over the whole text when it has no sections.
+        Chunks are held back by one and sentences are kept as an evenly
+        spaced sample, so memory stays bounded.
+        """
+        limit = self.MAX_RANKED_SENTENCES
+        section = []  # sentence sample of the current section
+        section_stride = 1
+        section_seen = 0
+        first = []  # sentences of the first section, enough for a text without sections
+        candidates = []  # sentences of the section summaries so far
+        sections = 0
+        held = None
+
+        def close_section(chunk: Dict):
+            nonlocal section, section_stride, section_seen, sections
+            sections += 1
+            if sections == 1:
+                first[:] = section
+            chosen = self.select(section, self.section_sentences)
+            candidates.extend(chosen)
+            if len(candidates) > 2 * limit:
+                del candidates[::2]
+            if chosen and chunk.get('section_path'):
+                chunk['section_summary'] = " ".join(chosen)
+            section = []
+            section_stride = 1
+            section_seen = 0
+
+        for chunk in chunks:
+            if held is not None:
+                if chunk.get('section_path') != held.get('section_path'):
+                    close_section(held)
+                yield held
+            title = (chunk.get('section_path') or '').rsplit(SectionChunker.PATH_SEPARATOR, 1)[-1]
+            for sentence in self.split_sentences(chunk['content']):
+                if sentence == title:
+                    continue
+                if section_seen % section_stride == 0:
+                    section.append(sentence)
+                    if len(section) > 2 * limit:
+                        section = section[::2]
+                        section_stride *= 2
+                section_seen += 1
+            held = chunk
+
+        if held is None:
+            return
+        close_section(held)
+        chosen = self.select(first if sections == 1 else candidates, self.document_sentences)
+        if chosen:
+            held['document_summary'] = " ".join(chosen)
+        yield held
+
+
+class ExtractionCache:
+    """On-disk cache of extracted text keyed by content hash and extractor version.
+
+    Entries are gzip-compressed text files. Reading a hit refreshes its
+    mtime and the least recently used entries are evicted once the cache
+    grows past ``max_bytes``. The directory is scanned on the first store
+    and whenever the running total of stored bytes passes ``max_bytes``;
+    entries other processes store are counted at the next scan.
+    """
+
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.total_bytes = None
+        self.lock = threading.Lock()
+
+    def entry_path(self, content_hash: str, extractor: str, version: int) -> Path:
+        """Location of the cache entry for one extraction"""
+        key = hashlib.sha1(f"{content_hash}:{extractor}:{version}".encode()).hexdigest()
+        return self.cache_dir / key[:2] / f"{key}.txt.gz"
+
+    def get(self, content_hash: str, extractor: str, version: int) -> Optional[Iterator[str]]:
+        """Stream a cached extraction, or return None on a miss"""
+        path = self.entry_path(content_hash, extractor, version)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return self._read(path)
+
+    def _read(self, path: Path) -> Iterator[str]:
+        with gzip.open(path, 'rt', encoding='utf-8', errors='surrogatepass') as file:
+            for block in iter(lambda: file.read(self.READ_SIZE), ''):
+                yield block
+
+    def store(self, content_hash: str, extractor: str, version: int, pieces: Iterable[str]) -> Iterator[str]:
+        """Pass text pieces through while writing them to the cache.
+
+        The entry only becomes visible once the stream has been consumed
+        completely; an abandoned or failing stream leaves nothing behind.
+        """
+        path = self.entry_path(content_hash, extractor, version)
+        path.parent.mkdir(exist_ok=True)
+        partial_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        complete = False
+        try:
+            with gzip.open(partial_path, 'wt', encoding='utf-8', errors='surrogatepass') as file:
+                for piece in pieces:
+                    file.write(piece)
+                    yield piece
+            size = partial_path.stat().st_size
+            os.replace(partial_path, path)
+            complete = True
+        finally:
+            if not complete:
+                partial_path.unlink(missing_ok=True)
+        self.added(size)
+
+    def added(self, size: int):
+        """Count a stored entry, evicting once the running total passes ``max_bytes``"""
+        with self.lock:
+            if self.total_bytes is not None:
+                self.total_bytes += size
+                if self.total_bytes <= self.max_bytes:
+                    return
+            self.total_bytes = self.evict()
+
+    def evict(self) -> int:
+        """Remove least recently used entries until the cache fits ``max_bytes``, returning its size"""
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob('*/*.txt.gz'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        if total <= self.max_bytes:
+            return total
+        for _, size, path in sorted(entries):
+            path.unlink(missing_ok=True)
+            total -= size
+            if total <= self.max_bytes:
+                break
+        return total
+
+
+class ExtractionError(Exception):
+    """Extraction of a file failed in a sandbox worker, timed out or was killed"""
+
+
+class SandboxWorker:
+    """One extraction worker process and its request/reply channels"""
+
+    def __init__(self, process: subprocess.Popen, requests: Connection, replies: Connection):
+        self.process = process
+        self.requests = requests
+        self.replies = replies
+
+    def kill(self) -> Optional[int]:
+        """Stop the process and any children it started, returning its exit code"""
+        if hasattr(os, 'killpg'):
+            # Workers lead their own process group, which includes PDF page range pools
+            try:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        if self.process.poll() is None:
+            self.process.kill()
+        try:
+            code = self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            code = None
+        self.requests.close()
+        self.replies.close()
+        return code
+
+
+# Started with ``python -c`` so workers import this module only, not the
+# application's __main__. The original stdout becomes the reply channel and
+# fd 1 is pointed at stderr so stray prints cannot corrupt it. Arguments are
+# the sys.path entry and name to import this module by, and the name it runs
+# under in the parent: run as a script, the parent pickles its classes and
+# functions as ``__main__`` ones.
+_SANDBOX_BOOTSTRAP = """
+import importlib, os, sys
+from multiprocessing.connection import Connection
+replies = Connection(os.dup(1), readable=False)
+os.dup2(2, 1)
+sys.path.insert(0, sys.argv[1])
+module = importlib.import_module(sys.argv[2])
+if sys.argv[3] == '__main__':
+    sys.modules['__main__'] = module
+module._run_sandbox_worker(Connection(0, writable=False), replies)
+"""
+
+
+def _sandbox_module() -> Tuple[str, str]:
+    """The sys.path entry and module name a sandbox worker imports this module by"""
+    # __spec__ names the module inside its package, and under ``python -m``; a script has none
+    name = __spec__.name if __spec__ is not None else Path(__file__).stem
+    return str(Path(os.path.abspath(__file__)).parents[name.count('.')]), name
+
+
+class ExtractionSandbox:
+    """Pool of isolated processes that run document extraction.
+
+    Each task gets a wall-clock ``timeout`` (time spent waiting for the
+    worker, not for the consumer) and every worker runs under an address
+    space limit of ``memory_limit`` bytes. A worker that times out, exceeds
+    its memory or crashes is killed and replaced on the next task, so a
+    pathological file costs one process instead of a server thread.
+    """
+
+    BATCH_SIZE = 16
+
+    def __init__(self, config: Dict, workers: int, timeout: float = None, memory_limit: int = None):
+        self.config = config
+        self.workers = max(1, workers)
+        self.timeout = timeout or None
+        self.memory_limit = memory_limit or None
+        self.idle = []
+        self.started = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def start_worker(self) -> SandboxWorker:
+        process = subprocess.Popen([sys.executable, '-c', _SANDBOX_BOOTSTRAP, *_sandbox_module(), __name__],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   start_new_session=hasattr(os, 'killpg'))
+        requests = Connection(os.dup(process.stdin.fileno()), readable=False)
+        replies = Connection(os.dup(process.stdout.fileno()), writable=False)
+        process.stdin.close()
+        process.stdout.close()
+        worker = SandboxWorker(process, requests, replies)
+        try:
+            requests.send((self.config, self.memory_limit))
+        except OSError:
+            worker.kill()
+            raise
+        return worker
+
+    def acquire(self) -> SandboxWorker:
+        """Take an idle worker, starting one if the pool is not full"""
+        with self.condition:
+            while not self.idle and self.started >= self.workers:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.started += 1
+        try:
+            return self.start_worker()
+        except Exception:
+            with self.condition:
+                self.started -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, worker: SandboxWorker):
+        with self.condition:
+            if self.closed:
+                worker.kill()
+                self.started -= 1
+            else:
+                self.idle.append(worker)
+            self.condition.notify()
+
+    def discard(self, worker: SandboxWorker) -> Optional[int]:
+        """Kill a worker whose state is unknown and free its slot"""
+        code = worker.kill()
+        with self.condition:
+            self.started -= 1
+            self.condition.notify()
+        return code
+
+    def stream(self, func, *args) -> Iterator:
+        """Run ``func(*args)`` in a worker and iterate over what it yields.
+
+        ``func`` must be a module-level function returning an iterable.
+        Raises ``ExtractionError`` when the task fails, times out or the
+        worker dies; ``OSError`` when no worker process can be started.
+        """
+        worker = self.acquire()
+        try:
+            worker.requests.send((func, args))
+        except OSError:
+            raise ExtractionError(f"Extraction worker exited unexpectedly (exit code {self.discard(worker)})")
+        return self._receive(worker)
+
+    def _receive(self, worker: SandboxWorker) -> Iterator:
+        remaining = self.timeout
+        finished = False
+        try:
+            while True:
+                waited_since = time.monotonic()
+                if not worker.replies.poll(remaining):
+                    raise ExtractionError(f"Extraction timed out after {self.timeout:g}s")
+                kind, value = worker.replies.recv()
+                if remaining is not None:
+                    remaining = max(0.0, remaining - (time.monotonic() - waited_since))
+
+                if kind == 'items':
+                    yield from value
+                elif kind == 'done':
+                    finished = True
+                    return
+                else:
+                    finished = kind == 'error'
+                    raise ExtractionError(value)
+        except (EOFError, OSError):
+            code = worker.kill()
+            finished = False
+            raise ExtractionError(f"Extraction worker exited unexpectedly (exit code {code})")
+        finally:
+            if finished and worker.process.poll() is None:
+                self.release(worker)
+            else:
+                self.discard(worker)
+
+    def close(self):
+        """Stop idle workers; busy ones are stopped when their task ends"""
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.started -= len(idle)
+        for worker in idle:
+            worker.kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordSpool:
+    """Records written once and read back in order.
+
+    Holds the chunks and spreadsheet rows of an upload between extraction
+    and the index write: up to ``MAX_MEMORY`` bytes of pickled records stay
+    in memory, larger documents go to a temporary file, so a waiting upload
+    does not hold its whole document. Can be iterated more than once.
+    """
+
+    MAX_MEMORY = 1024 * 1024
+
+    def __init__(self, records: Iterable = ()):
+        self.file = tempfile.SpooledTemporaryFile(max_size=self.MAX_MEMORY)
+        self.count = 0
+        try:
+            for record in records:
+                pickle.dump(record, self.file, pickle.HIGHEST_PROTOCOL)
+                self.count += 1
+        except BaseException:
+            self.file.close()
+            raise
+
+    def __iter__(self) -> Iterator:
+        self.file.seek(0)
+        for _ in range(self.count):
+            yield pickle.load(self.file)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self):
+        self.file.close()
+
+
+class IndexWriter:
+    """Single database writer that group-commits index writes.
+
+    Writes are functions of a cursor, queued from any thread and applied
+    in order by one thread on one connection. Writes that arrive within
+    ``flush_interval`` seconds of the first one, up to ``batch_size``,
+    share a transaction. Each runs in its own savepoint, so a failing write
+    is rolled back alone and reported to its caller. A write's future
+    resolves only after its transaction has committed.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], batch_size: int = 64,
+                 flush_interval: float = 0.02):
+        self.connect = connect
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval)
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='index-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, write: Callable[[sqlite3.Cursor], object]) -> Future:
+        """Queue ``write(cursor)``; the future holds its return value"""
+        future = Future()
+        self.requests.put((future, write))
+        return future
+
+    def write(self, write: Callable[[sqlite3.Cursor], object]):
+        """Apply ``write(cursor)`` and wait until it is committed"""
+        return self.submit(write).result()
+
+    def _collect(self, first) -> Tuple[List, bool]:
+        """Gather the writes of one group; True when the writer should stop"""
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                request = self.requests.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def _apply(self, conn: sqlite3.Connection, batch: List):
+        cursor = conn.cursor()
+        outcomes = {}
+        started = [future for future, _ in batch if future.set_running_or_notify_cancel()]
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for future, write in batch:
+                if future not in started:
+                    continue
+                cursor.execute('SAVEPOINT index_write')
+                try:
+                    outcomes[future] = (write(cursor), None)
+                except BaseException as e:
+                    cursor.execute('ROLLBACK TO index_write')
+                    outcomes[future] = (None, e)
+                cursor.execute('RELEASE index_write')
+            cursor.execute('COMMIT')
+        except BaseException as e:
+            if conn.in_transaction:
+                conn.rollback()
+            logger.error(f"Index write transaction failed: {e}")
+            outcomes = {future: (None, e) for future in started}
+
+        for future in started:
+            result, error = outcomes[future]
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def _run(self):
+        # Autocommit mode: transactions and savepoints are issued explicitly
+        conn = self.connect()
+        conn.isolation_level = None
+        try:
+            stopping = False
+            while not stopping:
+                first = self.requests.get()
+                if first is None:
+                    break
+                batch, stopping = self._collect(first)
+                self._apply(conn, batch)
+        finally:
+            conn.close()
+
+    def close(self):
+        """Apply the queued writes and stop the writer thread"""
+        self.requests.put(None)
+        self.thread.join()
+
 
 class FileManager:
     """Enhanced file management system for handling dozens of files"""
 
-    def __init__(self, storage_dir: str = None, db_path: str = None):
+    SUPPORTED_EXTENSIONS = {'.pdf', '.docx', '.xlsx', '.txt', '.md', '.html', '.json', '.xml'}
+    # Plain text is as cheap to read as a cache entry, so it is not cached
+    CACHED_FILE_TYPES = {'pdf', 'docx', 'excel', 'html', 'markdown', 'json', 'xml'}
+    COPY_BUFFER_SIZE = 1024 * 1024
+    # Near-duplicate chunk deltas copy runs of these tokens from the original
+    DELTA_TOKEN = re.compile(r'\s+|\S+\s*')
+    # Bumped when the search rows of existing databases must be rebuilt
+    SEARCH_INDEX_VERSION = 1
+    # Seconds to extract in-process after a sandbox worker failed to start, doubling per failure
+    SANDBOX_RETRY_MIN = 1.0
+    SANDBOX_RETRY_MAX = 300.0
+
+    def __init__(self, storage_dir: str = None, db_path: str = None, deduplicate: bool = None,
+                 cache_dir: str = None, cache_max_bytes: int = None, sandbox: bool = None,
+                 init_database: bool = True):
         # For serverless environments like Vercel, use /tmp directory
         import os
         if storage_dir is None:
@@ -162,18 +1972,85 @@ class FileManager:
         if db_path is None:
             db_path = os.environ.get('DB_PATH', '/tmp/file_index.db' if os.path.exists('/tmp') else 'file_index.db')
         
+        if deduplicate is None:
+            deduplicate = os.environ.get('DEDUPLICATE_UPLOADS', 'False').lower() == 'true'
+        if cache_dir is None:
+            cache_dir = os.environ.get('EXTRACTION_CACHE_DIR',
+                                       '/tmp/extraction_cache' if os.path.exists('/tmp') else 'extraction_cache')
+        if cache_max_bytes is None:
+            cache_max_bytes = int(os.environ.get('EXTRACTION_CACHE_MAX_MB', 512)) * 1024 * 1024
+        if sandbox is None:
+            sandbox = os.environ.get('EXTRACTION_SANDBOX', 'True').lower() == 'true'
+
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(exist_ok=True)
         self.db_path = db_path
+        self.deduplicate = deduplicate
+        # An empty cache_dir disables the extraction cache
+        self.extraction_cache = ExtractionCache(cache_dir, cache_max_bytes) if cache_dir else None
+        # Extraction runs in sandboxed worker processes unless disabled
+        self.sandbox_enabled = sandbox
+        # When no worker can be started, extraction runs in-process until the retry time
+        self._sandbox_retry_at = 0.0
+        self._sandbox_retry_delay = 0.0
+        self.extraction_timeout = float(os.environ.get('EXTRACTION_TIMEOUT', 120))
+        self.extraction_memory_limit = int(os.environ.get('EXTRACTION_MEMORY_LIMIT_MB', 1024)) * 1024 * 1024
+        self.extraction_workers = int(os.environ.get('EXTRACTION_WORKERS', min(4, os.cpu_count() or 1)))
+        self.pdf_workers = int(os.environ.get('PDF_EXTRACTION_WORKERS', os.cpu_count() or 1))
+        self._sandbox = None
+        self._sandbox_lock = threading.Lock()
+        # Index writes go through one writer thread that group-commits them
+        self.busy_timeout = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 30))
+        self.writer_batch_size = int(os.environ.get('INDEX_WRITER_BATCH_SIZE', 64))
+        self.writer_flush_interval = float(os.environ.get('INDEX_WRITER_FLUSH_MS', 20)) / 1000
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        # Near-duplicate chunks are stored once and reference the first copy
+        self.deduplicate_chunks = os.environ.get('DEDUPLICATE_CHUNKS', 'True').lower() == 'true'
+        chunk_similarity = float(os.environ.get('CHUNK_SIMILARITY_THRESHOLD', 0.95))
+        self.chunk_max_distance = max(0, int((1 - chunk_similarity) * SimHash.BITS + 1e-9))
+        # Any two fingerprints within the distance share one of this many bands;
+        # at least two keep band values within an SQLite INTEGER
+        self.chunk_bands = max(2, self.chunk_max_distance + 1)
         self.processor = DocumentProcessor()
-        self.chunker = DocumentChunker()
-        self.init_database()
+        # Chunks follow the document's sections by default; section and
+        # content-defined boundaries both let a new version reuse unchanged chunks
+        chunker = os.environ.get('CHUNKER', 'sections').lower()
+        if chunker == 'words':
+            self.chunker = DocumentChunker()
+        elif chunker == 'content':
+            self.chunker = ContentDefinedChunker()
+        else:
+            self.chunker = SectionChunker(int(os.environ.get('CHUNK_TOKEN_BUDGET', 512)))
+        # Extractive summaries of every document and section are computed at ingest
+        if os.environ.get('SUMMARIES', 'True').lower() == 'true':
+            self.summarizer = ExtractiveSummarizer(int(os.environ.get('DOCUMENT_SUMMARY_SENTENCES', 5)),
+                                                   int(os.environ.get('SECTION_SUMMARY_SENTENCES', 2)))
+        else:
+            self.summarizer = None
+        # Extraction workers only read files; the main process owns the schema
+        if init_database:
+            self.init_database()
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a connection to the index that waits for the write lock instead of failing"""
+        return sqlite3.connect(self.db_path, timeout=self.busy_timeout)
+
+    def get_writer(self) -> IndexWriter:
+        """The index writer of this manager, started on first use"""
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = IndexWriter(self.connect, self.writer_batch_size, self.writer_flush_interval)
+            return self._writer
 
     def init_database(self):
         """Initialize the file index database"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
 
+        # Write-ahead logging lets searches read while the writer commits
+        cursor.execute('PRAGMA journal_mode=WAL')
+
         # Files table
         cursor.execute('''
                        CREATE TABLE IF NOT EXISTS files
@@ -264,20 +2141,208 @@ class FileManager:
                            )
                        ''')
 
-        # Full-text search table
+        # Full-text search table; chunk_id links each row to the chunk it was made from
+        cursor.execute('PRAGMA table_info(file_search)')
+        search_columns = {row[1] for row in cursor.fetchall()}
+        rebuild_search = bool(search_columns) and 'chunk_id' not in search_columns
+        if rebuild_search:
+            cursor.execute('DROP TABLE file_search')
         cursor.execute('''
             CREATE VIRTUAL TABLE IF NOT EXISTS file_search USING fts5(
                 file_id,
                 filename,
                 content,
                 category,
-                tags
+                tags,
+                chunk_id UNINDEXED
             )
         ''')
 
+        # Source files seen by directory sync
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS sync_manifest
+                       (
+                           source_path TEXT PRIMARY KEY,
+                           root TEXT NOT NULL,
+                           file_id TEXT NOT NULL,
+                           file_size INTEGER NOT NULL,
+                           mtime REAL NOT NULL,
+                           content_hash TEXT NOT NULL,
+                           synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                       )
+                       ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sync_manifest_root ON sync_manifest (root)')
+
+        # Columns added after the first release
+        self.ensure_columns(cursor, 'files', {
+            'duplicate_of': 'TEXT',
+            'version': 'INTEGER DEFAULT 1',
+            'version_of': 'TEXT',
+            'summary': 'TEXT'
+        })
+        self.ensure_columns(cursor, 'chunks', {
+            'start_offset': 'INTEGER',
+            'end_offset': 'INTEGER',
+            'simhash': 'INTEGER',
+            'duplicate_of': 'TEXT',
+            'delta': 'TEXT',
+            'section_path': 'TEXT',
+            'section_summary': 'TEXT'
+        })
+        # Databases written before reference chunks had search rows are rebuilt once
+        cursor.execute('PRAGMA user_version')
+        if rebuild_search or cursor.fetchone()[0] < self.SEARCH_INDEX_VERSION:
+            self.rebuild_search_index(cursor)
+            cursor.execute(f'PRAGMA user_version = {self.SEARCH_INDEX_VERSION}')
+
+        # SimHash bands of the stored (non-duplicate) chunks
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS chunk_bands
+                       (
+                           band INTEGER NOT NULL,
+                           value INTEGER NOT NULL,
+                           chunk_id TEXT NOT NULL
+                       )
+                       ''')
+        cursor.execute('SELECT MAX(band) FROM chunk_bands')
+        stored_bands = cursor.fetchone()[0]
+        if stored_bands is not None and stored_bands + 1 != self.chunk_bands:
+            # The similarity threshold changed; band the fingerprints again
+            self.rebuild_chunk_bands(cursor)
+
+        # Spreadsheet rows with their cells, typed and keyed by column name
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS spreadsheet_rows
+                       (
+                           id INTEGER PRIMARY KEY,
+                           file_id TEXT NOT NULL,
+                           sheet TEXT NOT NULL,
+                           row_number INTEGER NOT NULL,
+                           cells TEXT NOT NULL,
+                           FOREIGN KEY (file_id) REFERENCES files (id)
+                       )
+                       ''')
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS spreadsheet_cells
+                       (
+                           row_id INTEGER NOT NULL,
+                           header TEXT NOT NULL,
+                           value_type TEXT NOT NULL,
+                           text_value TEXT,
+                           number_value REAL,
+                           FOREIGN KEY (row_id) REFERENCES spreadsheet_rows (id)
+                       )
+                       ''')
+
+        # Lookup indexes
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files (content_hash)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_duplicate_of ON files (duplicate_of)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_version_of ON files (version_of)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chunks_file_id ON chunks (file_id, chunk_index)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chunks_duplicate_of ON chunks (duplicate_of)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chunk_bands_value ON chunk_bands (band, value)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chunk_bands_chunk_id ON chunk_bands (chunk_id)')
+        cursor.execute('''
+                       CREATE INDEX IF NOT EXISTS idx_spreadsheet_rows_file_id
+                           ON spreadsheet_rows (file_id, sheet, row_number)
+                       ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_spreadsheet_cells_text ON spreadsheet_cells (header, text_value)')
+        cursor.execute('''
+                       CREATE INDEX IF NOT EXISTS idx_spreadsheet_cells_number
+                           ON spreadsheet_cells (header, number_value)
+                       ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_spreadsheet_cells_row_id ON spreadsheet_cells (row_id)')
+
         conn.commit()
         conn.close()
 
+    def rebuild_search_index(self, cursor: sqlite3.Cursor):
+        """Recreate the search rows of the chunks of current files"""
+        cursor.execute('DELETE FROM file_search')
+        chunks = cursor.connection.execute('''
+                                           SELECT c.id, c.file_id, f.filename, c.content, o.content, c.delta,
+                                                  f.category, f.tags
+                                           FROM chunks c
+                                                    JOIN files f ON f.id = c.file_id
+                                                    LEFT JOIN chunks o ON o.id = c.duplicate_of
+                                           WHERE f.version_of IS NULL
+                                           ORDER BY c.rowid
+                                           ''')
+        for chunk_id, file_id, filename, content, original, delta, category, tags in chunks:
+            self.add_search_entry(cursor, chunk_id, file_id, filename, self.chunk_content(content, original, delta),
+                                  category, tags or '[]')
+
+    def rebuild_chunk_bands(self, cursor: sqlite3.Cursor):
+        """Recompute the band table for the current similarity threshold"""
+        cursor.execute('DELETE FROM chunk_bands')
+        cursor.execute('SELECT id, simhash FROM chunks WHERE duplicate_of IS NULL AND simhash IS NOT NULL')
+        for chunk_id, fingerprint in cursor.fetchall():
+            self.add_chunk_bands(cursor, chunk_id, SimHash.from_signed(fingerprint))
+
+    def add_chunk_bands(self, cursor: sqlite3.Cursor, chunk_id: str, fingerprint: int):
+        """Make a stored chunk findable as the original of near-duplicates"""
+        cursor.executemany('INSERT INTO chunk_bands (band, value, chunk_id) VALUES (?, ?, ?)',
+                           [(band, value, chunk_id) for band, value in
+                            enumerate(SimHash.bands(fingerprint, self.chunk_bands))])
+
+    def find_similar_chunk(self, cursor: sqlite3.Cursor, fingerprint: int) -> Optional[str]:
+        """Closest stored chunk within the similarity threshold of a fingerprint"""
+        bands = list(enumerate(SimHash.bands(fingerprint, self.chunk_bands)))
+        cursor.execute(f'''
+                       SELECT DISTINCT c.id, c.simhash
+                       FROM chunk_bands b
+                                JOIN chunks c ON c.id = b.chunk_id
+                       WHERE {' OR '.join('(b.band = ? AND b.value = ?)' for _ in bands)}
+                       ''', [number for band in bands for number in band])
+
+        best, best_distance = None, self.chunk_max_distance + 1
+        for chunk_id, candidate in cursor.fetchall():
+            distance = SimHash.distance(fingerprint, SimHash.from_signed(candidate))
+            if distance < best_distance:
+                best, best_distance = chunk_id, distance
+        return best
+
+    @staticmethod
+    def encode_chunk_delta(original: str, text: str) -> Optional[str]:
+        """Describe ``text`` as word runs copied from ``original`` and inserted text; None if equal"""
+        if original == text:
+            return None
+        original_tokens = FileManager.DELTA_TOKEN.findall(original)
+        tokens = FileManager.DELTA_TOKEN.findall(text)
+        operations = []
+        matcher = difflib.SequenceMatcher(None, original_tokens, tokens)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                operations.append([i1, i2])
+            elif j2 > j1:
+                operations.append(''.join(tokens[j1:j2]))
+        return json.dumps(operations, ensure_ascii=False)
+
+    @staticmethod
+    def apply_chunk_delta(original: str, delta: Optional[str]) -> str:
+        """Rebuild a near-duplicate chunk's text from the chunk it references"""
+        if delta is None:
+            return original
+        original_tokens = FileManager.DELTA_TOKEN.findall(original)
+        return ''.join(
+            ''.join(original_tokens[operation[0]:operation[1]]) if isinstance(operation, list) else operation
+            for operation in json.loads(delta)
+        )
+
+    @staticmethod
+    def chunk_content(content: str, original: Optional[str], delta: Optional[str]) -> str:
+        """Text of a chunk row given the content of the chunk it references, if any"""
+        return content if original is None else FileManager.apply_chunk_delta(original, delta)
+
+    @staticmethod
+    def ensure_columns(cursor: sqlite3.Cursor, table: str, columns: Dict[str, str]):
+        """Add missing columns to an existing table"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, definition in columns.items():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+
     def generate_file_id(self, filename: str) -> str:
         """Generate unique file ID"""
         timestamp = datetime.now().isoformat()
@@ -286,125 +2351,951 @@ class FileManager:
     def calculate_file_hash(self, file_path: str) -> str:
         """Calculate file hash for duplicate detection"""
         hash_md5 = hashlib.md5()
+        buffer = bytearray(self.COPY_BUFFER_SIZE)
+        view = memoryview(buffer)
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
+            for size in iter(lambda: f.readinto(buffer), 0):
+                hash_md5.update(view[:size])
         return hash_md5.hexdigest()
 
-    def detect_file_type(self, file_path: str) -> str:
-        """Detect file type based on extension and content"""
-        mime_type, _ = mimetypes.guess_type(file_path)
-        extension = Path(file_path).suffix.lower()
+    def copy_and_hash(self, source, destination: Path) -> Tuple[int, str]:
+        """Stream a binary file object into ``destination`` while hashing it.
+
+        The data passes through one reusable buffer, so the file is read
+        once and never held in memory as a whole. The copy is written to a
+        temporary name and moved into place with ``os.replace``.
+        Returns ``(size, md5 hex digest)``.
+        """
+        hash_md5 = hashlib.md5()
+        buffer = bytearray(self.COPY_BUFFER_SIZE)
+        view = memoryview(buffer)
+        readinto = getattr(source, 'readinto', None)
+        partial_path = destination.with_name(destination.name + '.part')
+        total = 0
+
+        try:
+            with open(partial_path, 'wb') as target:
+                while True:
+                    if readinto is not None:
+                        size = readinto(buffer)
+                        block = view[:size]
+                    else:
+                        block = source.read(self.COPY_BUFFER_SIZE)
+                        size = len(block)
+                    if not size:
+                        break
+                    hash_md5.update(block)
+                    target.write(block)
+                    total += size
+            os.replace(partial_path, destination)
+        except BaseException:
+            partial_path.unlink(missing_ok=True)
+            raise
+
+        return total, hash_md5.hexdigest()
+
+    def store_file(self, file_path: Path, storage_path: Path, move: bool = False) -> Tuple[int, str]:
+        """Place a file in storage and return ``(size, md5 hex digest)``.
+
+        ``move`` is for files the caller owns (e.g. temporary uploads): they
+        are renamed into storage with ``os.replace`` and only read once for
+        the hash. Everything else is copied and hashed in a single pass.
+        """
+        if move:
+            try:
+                os.replace(file_path, storage_path)
+                return storage_path.stat().st_size, self.calculate_file_hash(str(storage_path))
+            except OSError as e:
+                # Different filesystem: fall back to copying
+                logger.debug(f"Cannot move {file_path} into storage ({e}), copying instead")
+
+        with open(file_path, 'rb') as source:
+            result = self.copy_and_hash(source, storage_path)
+        if move:
+            file_path.unlink(missing_ok=True)
+        return result
+
+    def detect_file_type(self, file_path: str) -> str:
+        """Detect file type based on extension and content"""
+        mime_type, _ = mimetypes.guess_type(file_path)
+        extension = Path(file_path).suffix.lower()
+
+        type_mapping = {
+            '.pdf': 'pdf',
+            '.docx': 'docx',
+            '.doc': 'doc',
+            '.xlsx': 'excel',
+            '.xls': 'excel',
+            '.txt': 'text',
+            '.md': 'markdown',
+            '.html': 'html',
+            '.htm': 'html',
+            '.json': 'json',
+            '.xml': 'xml'
+        }
+
+        return type_mapping.get(extension, 'unknown')
+
+    def extract_text_content(self, file_path: str, file_type: str) -> str:
+        """Extract text content based on file type"""
+        extractors = {
+            'pdf': self.processor.extract_text_from_pdf,
+            'docx': self.processor.extract_text_from_docx,
+            'excel': self.processor.extract_text_from_excel,
+            'text': self.processor.extract_text_from_txt,
+            'html': self.processor.extract_text_from_html,
+            'markdown': self.processor.extract_text_from_md,
+            'json': self.processor.extract_text_from_json,
+            'xml': self.processor.extract_text_from_xml
+        }
+
+        extractor = extractors.get(file_type, self.processor.extract_text_from_txt)
+        return extractor(file_path)
+
+    def iter_text_content(self, file_path: str, file_type: str, content_hash: str = None) -> Iterator[str]:
+        """Stream text content in pieces for formats that support it.
+
+        When the content hash is known, extractions are served from and
+        saved to the extraction cache.
+        """
+        cache = self.extraction_cache
+        extractor_name = file_type if file_type in self.processor.EXTRACTOR_VERSIONS else 'text'
+        version = self.processor.EXTRACTOR_VERSIONS[extractor_name]
+        use_cache = cache is not None and content_hash and file_type in self.CACHED_FILE_TYPES
+
+        if use_cache:
+            cached = cache.get(content_hash, extractor_name, version)
+            if cached is not None:
+                return cached
+
+        streaming_extractors = {
+            'pdf': self.processor.iter_text_from_pdf,
+            'docx': self.processor.iter_text_from_docx,
+            'excel': self.processor.iter_text_from_excel,
+            'text': self.processor.iter_text_from_txt,
+            'html': self.processor.iter_text_from_html,
+            'markdown': self.processor.iter_text_from_md,
+            'json': self.processor.iter_text_from_json,
+            'xml': self.processor.iter_text_from_xml
+        }
+
+        # Unknown types are read as plain text, like extract_text_content does
+        pieces = streaming_extractors.get(file_type, self.processor.iter_text_from_txt)(file_path)
+
+        if use_cache:
+            # Outside the error handling, so a failed extraction is not cached
+            pieces = cache.store(content_hash, extractor_name, version, pieces)
+        return self.processor.until_error(pieces, file_path)
+
+    def iter_spreadsheet_rows(self, file_path: str, content_hash: str = None) -> Iterator[Dict]:
+        """Stream the rows of a spreadsheet with typed cells for the row index.
+
+        Cells are ``spreadsheet_cell`` tuples, so rows are plain JSON: when
+        the content hash is known they are cached as JSON lines next to the
+        workbook's text, and a cached workbook is not opened again.
+        """
+        cache = self.extraction_cache if content_hash else None
+        version = self.processor.EXTRACTOR_VERSIONS['excel_rows']
+        lines = cache.get(content_hash, 'excel_rows', version) if cache is not None else None
+        if lines is None:
+            lines = (json.dumps({**row, 'cells': {header: self.spreadsheet_cell(value)
+                                                  for header, value in row['cells'].items()}},
+                                ensure_ascii=False) + "\n"
+                     for row in self.processor.iter_rows_from_excel(file_path))
+            if cache is not None:
+                lines = cache.store(content_hash, 'excel_rows', version, lines)
+
+        # Cache hits come back in blocks rather than lines
+        pending = ''
+        for piece in self.processor.until_error(lines, file_path):
+            *complete, pending = (pending + piece).split("\n")
+            for line in complete:
+                yield json.loads(line)
+
+    def prepare_upload(self, file_path: str, category: str = None, tags: List[str] = None,
+                       description: str = None, move: bool = False) -> Dict:
+        """Copy a file to storage and set up its extraction without touching the database.
+
+        Returns a payload that ``write_upload`` can persist. ``chunks`` is a
+        lazy iterator: extraction and chunking run while the chunks are being
+        written. Never writes to the database, so it can run inside bulk
+        ingestion worker processes. With ``move`` the source file is moved
+        into storage instead of copied.
+        """
+        file_path = Path(file_path)
+        if not file_path.exists():
+            raise FileNotFoundError(f"File not found: {file_path}")
+
+        file_id = self.generate_file_id(str(file_path))
+        storage_path = self.storage_dir / f"{file_id}_{file_path.name}"
+        file_size, content_hash = self.store_file(file_path, storage_path, move=move)
+
+        return self.build_payload(file_id, file_path.name, str(file_path), storage_path,
+                                  file_size, content_hash, category, tags, description)
+
+    def prepare_upload_stream(self, source, filename: str, category: str = None, tags: List[str] = None,
+                              description: str = None, original_name: str = None) -> Dict:
+        """Like ``prepare_upload`` but reads from an open binary file object"""
+        original_name = original_name or filename
+        file_id = self.generate_file_id(original_name)
+        storage_path = self.storage_dir / f"{file_id}_{filename}"
+        file_size, content_hash = self.copy_and_hash(source, storage_path)
+
+        return self.build_payload(file_id, filename, original_name, storage_path,
+                                  file_size, content_hash, category, tags, description)
+
+    def prepare_received_upload(self, file_path: Path, filename: str, file_size: int, content_hash: str,
+                                category: str = None, tags: List[str] = None, description: str = None) -> Dict:
+        """Move a fully received, already hashed upload into storage and prepare it"""
+        file_id = self.generate_file_id(filename)
+        storage_path = self.storage_dir / f"{file_id}_{filename}"
+        try:
+            os.replace(file_path, storage_path)
+        except OSError:
+            # Different filesystem: copy, which hashes the file again
+            file_size, content_hash = self.store_file(Path(file_path), storage_path, move=True)
+
+        return self.build_payload(file_id, filename, filename, storage_path,
+                                  file_size, content_hash, category, tags, description)
+
+    def build_payload(self, file_id: str, filename: str, original_name: str, storage_path: Path,
+                      file_size: int, content_hash: str, category: str = None, tags: List[str] = None,
+                      description: str = None) -> Dict:
+        """Describe a stored file for ``write_upload``"""
+        file_type = self.detect_file_type(filename)
+
+        # Extract and chunk lazily so large documents are streamed
+        chunks = self.chunker.iter_chunks(
+            self.iter_text_content(str(storage_path), file_type, content_hash), file_id
+        )
+        if self.summarizer is not None:
+            chunks = self.summarizer.annotate(chunks)
+
+        return {
+            'file_id': file_id,
+            'filename': filename,
+            'original_name': original_name,
+            'file_path': str(storage_path),
+            'file_type': file_type,
+            'file_size': file_size,
+            'content_hash': content_hash,
+            'category': category,
+            'tags': tags or [],
+            'description': description,
+            'chunks': chunks
+        }
+
+    def find_indexed_duplicate(self, cursor: sqlite3.Cursor, content_hash: str) -> Optional[Dict]:
+        """Find an already indexed file with the same content hash"""
+        cursor.execute('''
+                       SELECT id, file_path, chunk_count
+                       FROM files
+                       WHERE content_hash = ?
+                         AND duplicate_of IS NULL
+                         AND version_of IS NULL
+                         AND processed
+                       ORDER BY upload_date
+                       LIMIT 1
+                       ''', (content_hash,))
+        row = cursor.fetchone()
+        if row:
+            return {'file_id': row[0], 'file_path': row[1], 'chunk_count': row[2]}
+        return None
+
+    @staticmethod
+    def use_duplicate(payload: Dict, canonical: Dict):
+        """Point a prepared upload at an indexed file with identical content.
+
+        The staged copy is removed and extraction is skipped: the new file
+        shares the canonical file's stored bytes, chunks and search entries.
+        """
+        if payload['file_path'] != canonical['file_path']:
+            Path(payload['file_path']).unlink(missing_ok=True)
+        chunks = payload.get('chunks')
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        payload.update({
+            'file_path': canonical['file_path'],
+            'duplicate_of': canonical['file_id'],
+            'chunks': [],
+            'chunk_count': canonical['chunk_count']
+        })
+
+    def lookup_duplicate(self, payload: Dict):
+        """Point a payload at an indexed copy of its content, if there is one.
+
+        A read-only check made before extraction so duplicates are never
+        extracted; ``write_upload`` checks again for files indexed meanwhile.
+        """
+        conn = self.connect()
+        try:
+            canonical = self.find_indexed_duplicate(conn.cursor(), payload['content_hash'])
+        finally:
+            conn.close()
+        if canonical:
+            self.use_duplicate(payload, canonical)
+
+    def new_sandbox(self, workers: int) -> Optional[ExtractionSandbox]:
+        """Create an extraction sandbox with this manager's limits, or None if disabled"""
+        if not self.sandbox_enabled:
+            return None
+        config = self.worker_config()
+        # Every sandbox worker may run a page range pool: keep workers x range processes within the cores
+        config['pdf_workers'] = max(1, min(self.pdf_workers, (os.cpu_count() or 1) // max(1, workers)))
+        return ExtractionSandbox(config, workers, self.extraction_timeout, self.extraction_memory_limit)
+
+    def get_sandbox(self) -> Optional[ExtractionSandbox]:
+        """The sandbox shared by single uploads, started on first use"""
+        with self._sandbox_lock:
+            if self._sandbox is None:
+                self._sandbox = self.new_sandbox(self.extraction_workers)
+            return self._sandbox
+
+    def sandbox_available(self) -> bool:
+        """Whether to try the sandbox, i.e. it is enabled and not backing off after a failed start"""
+        return self.sandbox_enabled and time.monotonic() >= self._sandbox_retry_at
+
+    def sandbox_failed(self, error: OSError):
+        """Extract in-process for a while after a worker could not be started.
+
+        Some serverless runtimes cannot start processes at all, while a
+        full process table or a short file descriptor limit passes; each
+        failure doubles the wait before the next try, up to
+        ``SANDBOX_RETRY_MAX`` seconds.
+        """
+        delay = min(max(2 * self._sandbox_retry_delay, self.SANDBOX_RETRY_MIN), self.SANDBOX_RETRY_MAX)
+        self._sandbox_retry_delay = delay
+        self._sandbox_retry_at = time.monotonic() + delay
+        logger.warning(f"Extraction sandbox unavailable ({error}), extracting in-process for {delay:g}s")
+
+    def extract_chunks(self, payload: Dict, sandbox: ExtractionSandbox = None) -> Iterator[Dict]:
+        """Run a payload's extraction and chunking in a sandboxed worker.
+
+        Chunks are streamed back as the worker produces them. Falls back to
+        in-process extraction when sandboxing is disabled or worker
+        processes cannot be started.
+        """
+        sandbox = sandbox or self.get_sandbox()
+        if sandbox is None or not self.sandbox_available():
+            return payload['chunks']
+
+        try:
+            chunks = sandbox.stream(_extract_chunks_in_worker, payload['file_path'], payload['file_type'],
+                                    payload['content_hash'], payload['file_id'])
+        except OSError as e:
+            self.sandbox_failed(e)
+            return payload['chunks']
+        self._sandbox_retry_delay = 0.0
+
+        # The in-process generator was never started; drop it
+        payload['chunks'].close()
+        return chunks
+
+    def extract_rows(self, file_path: str, file_type: str, content_hash: str = None,
+                     sandbox: ExtractionSandbox = None) -> Iterable[Dict]:
+        """Read the rows of a spreadsheet for the row index in a sandboxed worker.
+
+        Like ``extract_chunks``, falls back to in-process extraction; files
+        that are not spreadsheets have no rows.
+        """
+        if file_type != 'excel':
+            return []
+        sandbox = sandbox or self.get_sandbox()
+        if sandbox is not None and self.sandbox_available():
+            try:
+                rows = sandbox.stream(_extract_rows_in_worker, file_path, content_hash)
+                self._sandbox_retry_delay = 0.0
+                return rows
+            except OSError as e:
+                self.sandbox_failed(e)
+        return self.iter_spreadsheet_rows(file_path, content_hash)
+
+    @staticmethod
+    def release_extracted(payload: Dict):
+        """Free the spooled (or still running) chunks and rows of a payload"""
+        for key in ('chunks', 'rows'):
+            extracted = payload.get(key)
+            if hasattr(extracted, 'close'):
+                extracted.close()
+
+    def write_upload(self, cursor: sqlite3.Cursor, payload: Dict):
+        """Insert a prepared upload into the files, chunks and search tables.
+
+        Chunks are consumed one at a time, so a streaming payload is written
+        while later parts of the document are still being extracted. When
+        deduplication is on and the content is already indexed, only a files
+        row referencing the existing entry is written.
+        """
+        if payload.get('document_id'):
+            return self.write_version(cursor, payload)
+        file_id = payload['file_id']
+
+        if payload.get('deduplicate', self.deduplicate) and not payload.get('duplicate_of'):
+            canonical = self.find_indexed_duplicate(cursor, payload['content_hash'])
+            if canonical:
+                self.use_duplicate(payload, canonical)
+        duplicate_of = payload.get('duplicate_of')
+
+        if payload.get('registered'):
+            # The row was written by register_upload; complete it in place
+            cursor.execute('''
+                           UPDATE files
+                           SET file_path = ?, processed = ?, chunk_count = ?, duplicate_of = ?
+                           WHERE id = ?
+                           ''', (payload['file_path'], bool(duplicate_of),
+                                 payload['chunk_count'] if duplicate_of else 0, duplicate_of, file_id))
+            if cursor.rowcount == 0:
+                raise ValueError(f"File {file_id} was deleted while it was being processed")
+        else:
+            self.insert_file_row(cursor, payload, bool(duplicate_of))
+        if duplicate_of:
+            return
+
+        chunk_count = self.write_chunks(cursor, file_id, payload['filename'], payload['category'],
+                                        payload['tags'], payload['chunks'])
+        self.write_spreadsheet_rows(cursor, file_id, payload.get('rows'))
+
+        cursor.execute('UPDATE files SET processed = ?, chunk_count = ? WHERE id = ?',
+                       (True, chunk_count, file_id))
+        payload['chunk_count'] = chunk_count
+
+    def write_version(self, cursor: sqlite3.Cursor, payload: Dict):
+        """Write a prepared upload as the next version of the document ``payload['document_id']``.
+
+        The document keeps its file id, category and tags. Its previous state
+        moves to a new files row whose ``version_of`` is the document, and
+        only chunks that did not exist in the previous version are stored and
+        indexed: unchanged chunks stay in place and the previous version
+        references them, chunks that are gone move to the previous version
+        without search entries. A document that no longer exists is written
+        as a new upload.
+        """
+        document_id = payload['document_id']
+        cursor.execute('''
+                       SELECT file_path, content_hash, duplicate_of, version, chunk_count, category, tags
+                       FROM files
+                       WHERE id = ?
+                         AND version_of IS NULL
+                       ''', (document_id,))
+        row = cursor.fetchone()
+        if row is None:
+            payload.pop('document_id')
+            return self.write_upload(cursor, payload)
+        file_path, content_hash, duplicate_of, version, chunk_count, category, tags = row
+
+        if content_hash == payload['content_hash']:
+            # Nothing changed; keep the current version
+            if payload['file_path'] != file_path:
+                Path(payload['file_path']).unlink(missing_ok=True)
+            payload.update({'file_id': document_id, 'file_path': file_path, 'duplicate_of': duplicate_of,
+                            'chunks': [], 'chunk_count': chunk_count, 'version': version,
+                            'reused_chunks': chunk_count})
+            return
+
+        cursor.execute('SELECT id FROM files WHERE duplicate_of = ? ORDER BY upload_date LIMIT 1', (document_id,))
+        dependent = cursor.fetchone()
+        if duplicate_of is None and dependent:
+            # Uploads of the previous content keep it: the oldest takes over the index
+            self.hand_over(cursor, document_id, dependent[0])
+            duplicate_of = dependent[0]
+
+        archive_id = self.generate_file_id(f"{document_id}_v{version}")
+        cursor.execute('''
+                       INSERT INTO files (id, filename, original_name, file_path, file_type, file_size,
+                                          content_hash, upload_date, last_modified, category, tags,
+                                          description, processed, chunk_count, duplicate_of, version,
+                                          version_of, summary)
+                       SELECT ?, filename, original_name, file_path, file_type, file_size,
+                              content_hash, upload_date, last_modified, category, tags,
+                              description, processed, chunk_count, ?, version,
+                              id, summary
+                       FROM files
+                       WHERE id = ?
+                       ''', (archive_id, duplicate_of, document_id))
+
+        chunks = payload['chunks']
+        reused = 0
+        if duplicate_of is None:
+            cursor.execute('''
+                           SELECT c.id, c.chunk_index, c.start_offset, c.end_offset, c.duplicate_of, c.delta,
+                                  c.section_path, c.section_summary, c.content, o.content
+                           FROM chunks c
+                                    LEFT JOIN chunks o ON o.id = c.duplicate_of
+                           WHERE c.file_id = ?
+                           ORDER BY c.chunk_index
+                           ''', (document_id,))
+            previous = {}
+            for chunk_row in cursor.fetchall():
+                content = self.chunk_content(chunk_row[8], chunk_row[9], chunk_row[5])
+                previous.setdefault(hashlib.md5(content.encode()).hexdigest(), []).append((*chunk_row[:8], content))
+
+            fresh = []
+            for chunk in chunks:
+                matches = previous.get(hashlib.md5(chunk['content'].encode()).hexdigest())
+                if not matches:
+                    fresh.append(chunk)
+                    continue
+                chunk_id, old_index, old_start, old_end, reference, delta, old_path, old_summary, _ = matches.pop(0)
+                # The chunk stays in place; the previous version references it
+                cursor.execute('''
+                               INSERT INTO chunks (id, file_id, chunk_index, content, start_offset, end_offset,
+                                                   duplicate_of, delta, section_path, section_summary)
+                               VALUES (?, ?, ?, '', ?, ?, ?, ?, ?, ?)
+                               ''', (f"{archive_id}_chunk_{old_index}", archive_id, old_index,
+                                     old_start, old_end, reference or chunk_id, delta, old_path, old_summary))
+                cursor.execute('''
+                               UPDATE chunks
+                               SET chunk_index = ?, start_offset = ?, end_offset = ?, section_path = ?,
+                                   section_summary = ?
+                               WHERE id = ?
+                               ''', (chunk['chunk_index'], chunk.get('start_offset'), chunk.get('end_offset'),
+                                     chunk.get('section_path'), chunk.get('section_summary'), chunk_id))
+                if chunk.get('document_summary'):
+                    cursor.execute('UPDATE files SET summary = ? WHERE id = ?',
+                                   (chunk['document_summary'], document_id))
+                reused += 1
 
-        type_mapping = {
-            '.pdf': 'pdf',
-            '.docx': 'docx',
-            '.doc': 'doc',
-            '.xlsx': 'excel',
-            '.xls': 'excel',
-            '.txt': 'text',
-            '.md': 'markdown',
-            '.html': 'html',
-            '.htm': 'html',
-            '.json': 'json',
-            '.xml': 'xml'
-        }
+            for chunk_rows in previous.values():
+                for chunk_id, _, _, _, reference, _, _, _, content in chunk_rows:
+                    self.retire_chunk(cursor, chunk_id, document_id, archive_id, reference, content)
+            chunks = fresh
 
-        return type_mapping.get(extension, 'unknown')
+        # Only the current version of a spreadsheet has its rows indexed
+        self.remove_spreadsheet_rows(cursor, document_id)
+        new_duplicate_of = payload.get('duplicate_of')
+        if new_duplicate_of:
+            new_chunk_count = payload['chunk_count']
+        else:
+            # The new chunks are edits of the previous version, never near-duplicates of it
+            new_chunk_count = reused + self.write_chunks(cursor, document_id, payload['filename'], category,
+                                                         json.loads(tags or '[]'), chunks, near_duplicates=False)
+            self.write_spreadsheet_rows(cursor, document_id, payload.get('rows'))
 
-    def extract_text_content(self, file_path: str, file_type: str) -> str:
-        """Extract text content based on file type"""
-        extractors = {
-            'pdf': self.processor.extract_text_from_pdf,
-            'docx': self.processor.extract_text_from_docx,
-            'excel': self.processor.extract_text_from_excel,
-            'text': self.processor.extract_text_from_txt,
-            'html': self.processor.extract_text_from_html,
-            'markdown': self.processor.extract_text_from_md
-        }
+        cursor.execute('''
+                       UPDATE files
+                       SET filename = ?, original_name = ?, file_path = ?, file_type = ?, file_size = ?,
+                           content_hash = ?, description = COALESCE(?, description), processed = ?,
+                           chunk_count = ?, duplicate_of = ?, version = ?, last_modified = CURRENT_TIMESTAMP
+                       WHERE id = ?
+                       ''', (payload['filename'], payload['original_name'], payload['file_path'],
+                             payload['file_type'], payload['file_size'], payload['content_hash'],
+                             payload['description'] or None, True, new_chunk_count, new_duplicate_of,
+                             version + 1, document_id))
+        payload.update({'file_id': document_id, 'chunk_count': new_chunk_count, 'version': version + 1,
+                        'reused_chunks': reused})
 
-        extractor = extractors.get(file_type, self.processor.extract_text_from_txt)
-        return extractor(file_path)
+    def retire_chunk(self, cursor: sqlite3.Cursor, chunk_id: str, file_id: str, archive_id: str,
+                     reference: Optional[str], content: str):
+        """Move a chunk that is gone from a document to its previous version.
 
-    def upload_file(self, file_path: str, category: str = None, tags: List[str] = None,
-                    description: str = None) -> Dict:
-        """Upload and process a file"""
-        try:
-            file_path = Path(file_path)
-            if not file_path.exists():
-                raise FileNotFoundError(f"File not found: {file_path}")
+        The chunk loses its search entry and bands; if chunks elsewhere
+        reference it, the first of them takes over and the chunk references it.
+        """
+        cursor.execute('UPDATE chunks SET file_id = ? WHERE id = ?', (archive_id, chunk_id))
+        cursor.execute('''
+                       DELETE FROM file_search
+                       WHERE rowid IN (SELECT rowid FROM file_search WHERE file_search MATCH ? AND chunk_id = ?)
+                       ''', (self.search_rows_query(file_id), chunk_id))
+        if reference is not None:
+            return
+
+        promoted = self.promote_duplicate(cursor, chunk_id, archive_id, content)
+        if promoted:
+            heir, heir_content = promoted
+            cursor.execute('''
+                           UPDATE chunks
+                           SET content = ?, content_preview = NULL, duplicate_of = ?, delta = ?
+                           WHERE id = ?
+                           ''', ('', heir, self.encode_chunk_delta(heir_content, content), chunk_id))
+        else:
+            cursor.execute('DELETE FROM chunk_bands WHERE chunk_id = ?', (chunk_id,))
 
-            # Generate file info
-            file_id = self.generate_file_id(file_path.name)
-            file_type = self.detect_file_type(str(file_path))
-            file_size = file_path.stat().st_size
-            content_hash = self.calculate_file_hash(str(file_path))
+    def register_upload(self, cursor: sqlite3.Cursor, payload: Dict):
+        """Record a stored upload as not yet processed.
 
-            # Copy file to storage
-            storage_path = self.storage_dir / f"{file_id}_{file_path.name}"
-            storage_path.write_bytes(file_path.read_bytes())
+        Used when extraction runs later in the background: the file is listed
+        right away and ``write_upload`` completes the row once it is indexed.
+        """
+        self.insert_file_row(cursor, payload, False)
+        payload['registered'] = True
 
-            # Extract text content
-            text_content = self.extract_text_content(str(storage_path), file_type)
+    @staticmethod
+    def insert_file_row(cursor: sqlite3.Cursor, payload: Dict, processed: bool):
+        """Insert the files row of a prepared upload"""
+        duplicate_of = payload.get('duplicate_of')
+        cursor.execute('''
+                       INSERT INTO files (id, filename, original_name, file_path, file_type,
+                                          file_size, content_hash, category, tags, description,
+                                          processed, chunk_count, duplicate_of)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                       ''', (
+                           payload['file_id'], payload['filename'], payload['original_name'], payload['file_path'],
+                           payload['file_type'], payload['file_size'], payload['content_hash'],
+                           payload['category'], json.dumps(payload['tags']), payload['description'],
+                           processed, payload['chunk_count'] if duplicate_of else 0, duplicate_of
+                       ))
 
-            # Chunk large documents
-            chunks = self.chunker.chunk_text(text_content, file_id)
+    def write_chunks(self, cursor: sqlite3.Cursor, file_id: str, filename: str, category: Optional[str],
+                     tags: List[str], chunks: Iterable[Dict], near_duplicates: bool = True) -> int:
+        """Insert chunks and their search entries, returning how many were written.
 
-            # Store in database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+        With chunk deduplication on, a chunk whose SimHash fingerprint is
+        within the similarity threshold of a stored chunk is written as a
+        reference to it plus a delta of the words that differ. Its search
+        entry still holds its full text, so the words it does not share
+        with the referenced chunk can be found. Pass
+        ``near_duplicates=False`` for edited chunks, which would otherwise
+        collapse into the text they replace.
+        """
+        chunk_count = 0
+        duplicates = 0
+        for chunk in chunks:
+            content = chunk['content']
+            fingerprint = chunk.get('simhash')
+            if fingerprint is None and self.deduplicate_chunks and content.strip():
+                fingerprint = SimHash.fingerprint(content)
+            duplicate_of = delta = None
+            if self.deduplicate_chunks and near_duplicates and fingerprint:
+                duplicate_of = self.find_similar_chunk(cursor, fingerprint)
+            if duplicate_of:
+                cursor.execute('SELECT content FROM chunks WHERE id = ?', (duplicate_of,))
+                delta = self.encode_chunk_delta(cursor.fetchone()[0], content)
+                if delta is not None and len(delta) > len(content) // 2:
+                    duplicate_of = delta = None  # too different to be worth referencing
 
-            # Insert file record
             cursor.execute('''
-                           INSERT INTO files (id, filename, original_name, file_path, file_type,
-                                              file_size, content_hash, category, tags, description,
-                                              processed, chunk_count)
+                           INSERT INTO chunks (id, file_id, chunk_index, content, content_preview,
+                                               start_offset, end_offset, simhash, duplicate_of, delta,
+                                               section_path, section_summary)
                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                            ''', (
-                               file_id, file_path.name, str(file_path), str(storage_path),
-                               file_type, file_size, content_hash, category,
-                               json.dumps(tags or []), description, True, len(chunks)
+                               chunk['chunk_id'], file_id, chunk['chunk_index'],
+                               '' if duplicate_of else content, None if duplicate_of else content[:200] + "...",
+                               chunk.get('start_offset'), chunk.get('end_offset'),
+                               None if fingerprint is None else SimHash.to_signed(fingerprint), duplicate_of, delta,
+                               chunk.get('section_path'), chunk.get('section_summary')
                            ))
+            chunk_count += 1
+            if chunk.get('document_summary'):
+                cursor.execute('UPDATE files SET summary = ? WHERE id = ?', (chunk['document_summary'], file_id))
+            if duplicate_of:
+                duplicates += 1
+            elif fingerprint:
+                self.add_chunk_bands(cursor, chunk['chunk_id'], fingerprint)
+            self.add_search_entry(cursor, chunk['chunk_id'], file_id, filename, content, category, json.dumps(tags))
 
-            # Insert chunks
-            for chunk in chunks:
-                cursor.execute('''
-                               INSERT INTO chunks (id, file_id, chunk_index, content, content_preview)
+        if duplicates:
+            logger.info(f"{duplicates} of {chunk_count} chunks of {filename} stored as near-duplicates")
+        return chunk_count
+
+    @staticmethod
+    def add_search_entry(cursor: sqlite3.Cursor, chunk_id: str, file_id: str, filename: str, content: str,
+                         category: Optional[str], tags: str):
+        """Add the full-text search row of one chunk"""
+        # Add to search index - only for non-problematic content
+        try:
+            cursor.execute('''
+                           INSERT INTO file_search (file_id, filename, content, category, tags, chunk_id)
+                           VALUES (?, ?, ?, ?, ?, ?)
+                           ''', (
+                               file_id, filename, content,
+                               category or '', tags, chunk_id
+                           ))
+        except Exception as search_error:
+            logger.warning(f"FTS5 index error for chunk {chunk_id}: {search_error}")
+            # Continue without FTS5 indexing for this chunk
+
+    @staticmethod
+    def spreadsheet_key(text: str) -> str:
+        """Case- and whitespace-insensitive form of a column name or text cell, used for lookups"""
+        return ' '.join(str(text).split()).casefold()
+
+    @staticmethod
+    def spreadsheet_cell(value) -> Tuple[str, Optional[str], Optional[float], object]:
+        """Type, lookup text, numeric value and JSON value of a spreadsheet cell.
+
+        Numbers and booleans are compared numerically and by their text;
+        dates and times by their ISO form, which sorts chronologically.
+        """
+        if isinstance(value, bool):
+            return 'boolean', str(value).lower(), float(value), value
+        if isinstance(value, (int, float)):
+            text = str(int(value)) if isinstance(value, float) and value.is_integer() else str(value)
+            return 'number', text, float(value), value
+        if isinstance(value, datetime) and value.time() == datetime.min.time():
+            value = value.date()
+        if hasattr(value, 'isoformat'):
+            return 'date', value.isoformat(), None, value.isoformat()
+        return 'text', FileManager.spreadsheet_key(value), None, str(value)
+
+    def write_spreadsheet_rows(self, cursor: sqlite3.Cursor, file_id: str, rows: Optional[Iterable[Dict]]) -> int:
+        """Insert spreadsheet rows, whose cells are ``spreadsheet_cell`` tuples, returning how many were written"""
+        row_count = 0
+        for row in rows or []:
+            values = row['cells']
+            cursor.execute('''
+                           INSERT INTO spreadsheet_rows (file_id, sheet, row_number, cells)
+                           VALUES (?, ?, ?, ?)
+                           ''', (file_id, row['sheet'], row['row_number'],
+                                 json.dumps({header: value[3] for header, value in values.items()},
+                                            ensure_ascii=False)))
+            row_id = cursor.lastrowid
+            cursor.executemany('''
+                               INSERT INTO spreadsheet_cells (row_id, header, value_type, text_value, number_value)
                                VALUES (?, ?, ?, ?, ?)
-                               ''', (
-                                   chunk['chunk_id'], file_id, chunk['chunk_index'],
-                                   chunk['content'], chunk['content'][:200] + "..."
-                               ))
+                               ''', [(row_id, self.spreadsheet_key(header), *value[:3])
+                                     for header, value in values.items()])
+            row_count += 1
+        return row_count
 
-                # Add to search index - only for non-problematic content
-                try:
-                    cursor.execute('''
-                                   INSERT INTO file_search (file_id, filename, content, category, tags)
-                                   VALUES (?, ?, ?, ?, ?)
-                                   ''', (
-                                       file_id, file_path.name, chunk['content'],
-                                       category or '', json.dumps(tags or [])
-                                   ))
-                except Exception as search_error:
-                    logger.warning(f"FTS5 index error for chunk {chunk['chunk_id']}: {search_error}")
-                    # Continue without FTS5 indexing for this chunk
-
-            conn.commit()
+    @staticmethod
+    def remove_spreadsheet_rows(cursor: sqlite3.Cursor, file_id: str):
+        """Delete the spreadsheet rows and cells of a file"""
+        cursor.execute('''
+                       DELETE FROM spreadsheet_cells
+                       WHERE row_id IN (SELECT id FROM spreadsheet_rows WHERE file_id = ?)
+                       ''', (file_id,))
+        cursor.execute('DELETE FROM spreadsheet_rows WHERE file_id = ?', (file_id,))
+
+    def promote_duplicate(self, cursor: sqlite3.Cursor, chunk_id: str, file_id: str,
+                          content: str) -> Optional[Tuple[str, str]]:
+        """Hand a stored chunk to the first chunk of another file that references it.
+
+        The heir stores its own text, takes over the other references and gets
+        bands unless it belongs to an earlier version of a document. Its
+        search entry already holds its full text. Returns the heir's id and
+        text, or None when no other file references the chunk.
+        """
+        cursor.execute('''
+                       SELECT d.id, d.delta, d.simhash, f.version_of
+                       FROM chunks d
+                                JOIN files f ON f.id = d.file_id
+                       WHERE d.duplicate_of = ?
+                         AND d.file_id != ?
+                       ORDER BY f.version_of IS NOT NULL, d.rowid
+                       LIMIT 1
+                       ''', (chunk_id, file_id))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+
+        heir, delta, fingerprint, version_of = row
+        heir_content = self.apply_chunk_delta(content, delta)
+        fingerprint = SimHash.from_signed(fingerprint) if fingerprint is not None \
+            else SimHash.fingerprint(heir_content)
+        cursor.execute('''
+                       UPDATE chunks
+                       SET content = ?, content_preview = ?, duplicate_of = NULL, delta = NULL, simhash = ?
+                       WHERE id = ?
+                       ''', (heir_content, heir_content[:200] + "...", SimHash.to_signed(fingerprint), heir))
+
+        # The other references now describe their text against the heir
+        cursor.execute('SELECT id, delta FROM chunks WHERE duplicate_of = ? AND id != ?', (chunk_id, heir))
+        for reference, reference_delta in cursor.fetchall():
+            cursor.execute('UPDATE chunks SET duplicate_of = ?, delta = ? WHERE id = ?',
+                           (heir, self.encode_chunk_delta(heir_content,
+                                                          self.apply_chunk_delta(content, reference_delta)),
+                            reference))
+
+        cursor.execute('DELETE FROM chunk_bands WHERE chunk_id = ?', (chunk_id,))
+        if version_of is None and fingerprint:
+            self.add_chunk_bands(cursor, heir, fingerprint)
+        return heir, heir_content
+
+    def remove_chunks(self, cursor: sqlite3.Cursor, file_id: str):
+        """Delete the chunks, search entries and spreadsheet rows of a file.
+
+        A chunk that near-duplicates in other files refer to is handed to the
+        first of them, see ``promote_duplicate``.
+        """
+        cursor.execute('''
+                       SELECT c.id, c.content
+                       FROM chunks c
+                       WHERE c.file_id = ?
+                         AND c.duplicate_of IS NULL
+                         AND EXISTS (SELECT 1 FROM chunks d WHERE d.duplicate_of = c.id AND d.file_id != c.file_id)
+                       ''', (file_id,))
+        for chunk_id, content in cursor.fetchall():
+            self.promote_duplicate(cursor, chunk_id, file_id, content)
+
+        cursor.execute('DELETE FROM chunk_bands WHERE chunk_id IN (SELECT id FROM chunks WHERE file_id = ?)',
+                       (file_id,))
+        cursor.execute('DELETE FROM chunks WHERE file_id = ?', (file_id,))
+        cursor.execute('''
+                       DELETE FROM file_search
+                       WHERE rowid IN (SELECT rowid FROM file_search WHERE file_search MATCH ?)
+                       ''', (self.search_rows_query(file_id),))
+        self.remove_spreadsheet_rows(cursor, file_id)
+
+    def reindex_files(self, file_ids: List[str] = None) -> Dict:
+        """Re-chunk and re-index stored files with the current chunker settings.
+
+        Extraction is served from the extraction cache where possible, so a
+        rebuild after changing ``DocumentChunker`` parameters skips parsing.
+        """
+        results = {'successful': [], 'failed': []}
+        sandbox = self.get_sandbox()
+        conn = self.connect()
+        try:
+            query = '''
+                    SELECT id, filename, file_path, file_type, content_hash, category, tags
+                    FROM files
+                    WHERE duplicate_of IS NULL
+                      AND version_of IS NULL
+                      AND processed
+                    '''
+            params = []
+            if file_ids is not None:
+                query += f" AND id IN ({','.join('?' * len(file_ids))})"
+                params = list(file_ids)
+            rows = conn.execute(query, params).fetchall()
+        finally:
             conn.close()
 
-            logger.info(f"Successfully uploaded and processed: {file_path.name}")
-            return {
-                'file_id': file_id,
-                'filename': file_path.name,
-                'file_type': file_type,
-                'chunks': len(chunks),
-                'success': True
-            }
+        def replace_chunks(cursor: sqlite3.Cursor, file_id: str, filename: str, category: Optional[str],
+                           tags: Optional[str], chunks: Iterable[Dict], rows: Iterable[Dict]) -> int:
+            self.remove_chunks(cursor, file_id)
+            chunk_count = self.write_chunks(cursor, file_id, filename, category, json.loads(tags or '[]'), chunks)
+            self.write_spreadsheet_rows(cursor, file_id, rows)
+            cursor.execute('''
+                           UPDATE files
+                           SET chunk_count = ?, processed = ?
+                           WHERE id = ? OR duplicate_of = ?
+                           ''', (chunk_count, True, file_id, file_id))
+            return chunk_count
+
+        for file_id, filename, file_path, file_type, content_hash, category, tags in rows:
+            extracted = {}
+            try:
+                # Earlier versions keep chunks named after the file, so new chunks get fresh ids
+                chunk_prefix = self.generate_file_id(file_id)
+                if sandbox is not None:
+                    chunks = sandbox.stream(_extract_chunks_in_worker, file_path, file_type,
+                                            content_hash, chunk_prefix)
+                else:
+                    chunks = self.chunker.iter_chunks(
+                        self.iter_text_content(file_path, file_type, content_hash), chunk_prefix
+                    )
+                    if self.summarizer is not None:
+                        chunks = self.summarizer.annotate(chunks)
+                extracted['chunks'] = RecordSpool(chunks)
+                extracted['rows'] = RecordSpool(self.extract_rows(file_path, file_type, content_hash, sandbox))
+                chunk_count = self.get_writer().write(
+                    lambda cursor: replace_chunks(cursor, file_id, filename, category, tags,
+                                                  extracted['chunks'], extracted['rows'])
+                )
+                results['successful'].append({'file_id': file_id, 'chunks': chunk_count})
+            except Exception as e:
+                logger.error(f"Error re-indexing file {file_id}: {e}")
+                results['failed'].append({'file_id': file_id, 'error': str(e)})
+            finally:
+                self.release_extracted(extracted)
+
+        return {
+            'total_processed': len(results['successful']) + len(results['failed']),
+            'successful': len(results['successful']),
+            'failed': len(results['failed']),
+            'details': results
+        }
 
+    @staticmethod
+    def upload_result(payload: Dict) -> Dict:
+        """Build the public result dict for a stored upload"""
+        return {
+            'file_id': payload['file_id'],
+            'filename': payload['filename'],
+            'file_type': payload['file_type'],
+            'chunks': payload['chunk_count'],
+            'deduplicated': bool(payload.get('duplicate_of')),
+            'duplicate_of': payload.get('duplicate_of'),
+            'version': payload.get('version', 1),
+            'reused_chunks': payload.get('reused_chunks', 0),
+            'success': True
+        }
+
+    def upload_file(self, file_path: str, category: str = None, tags: List[str] = None,
+                    description: str = None, deduplicate: bool = None, move: bool = False,
+                    document_id: str = None) -> Dict:
+        """Upload and process a file.
+
+        With deduplication on (``DEDUPLICATE_UPLOADS`` or ``deduplicate``) a file
+        whose content is already indexed is recorded without being extracted
+        again and the result reports ``deduplicated``. Pass ``move=True`` for
+        temporary files that can be moved into storage instead of copied.
+        With ``document_id`` the file becomes the next version of that
+        document, see ``write_version``.
+        """
+        try:
+            payload = self.prepare_upload(file_path, category=category, tags=tags,
+                                          description=description, move=move)
+            payload['document_id'] = document_id
+            return self.store_upload(payload, deduplicate)
         except Exception as e:
             logger.error(f"Error uploading file {file_path}: {e}")
             return {'success': False, 'error': str(e)}
 
+    def upload_stream(self, source, filename: str, category: str = None, tags: List[str] = None,
+                      description: str = None, deduplicate: bool = None, document_id: str = None) -> Dict:
+        """Upload and process a file read from an open binary file object.
+
+        The data is hashed while it is copied into storage, so request
+        uploads never go through a temporary file or a full in-memory copy.
+        """
+        try:
+            payload = self.prepare_upload_stream(source, filename, category=category, tags=tags,
+                                                 description=description)
+            payload['document_id'] = document_id
+            return self.store_upload(payload, deduplicate)
+        except Exception as e:
+            logger.error(f"Error uploading file {filename}: {e}")
+            return {'success': False, 'error': str(e)}
+
+    def store_upload(self, payload: Dict, deduplicate: bool = None) -> Dict:
+        """Extract a prepared upload in the sandbox, write it to the index and build its result.
+
+        When extraction fails or times out the stored copy is removed and a
+        failed result carrying the reason is returned; so is the copy of an
+        upload whose write fails. The chunks and spreadsheet rows are
+        extracted into spools before the write is queued, so the index writer
+        never waits on extraction.
+        """
+        if deduplicate is not None:
+            payload['deduplicate'] = deduplicate
+        if payload.get('deduplicate', self.deduplicate):
+            self.lookup_duplicate(payload)
+        stored_path = payload['file_path']
+        try:
+            if not payload.get('duplicate_of'):
+                try:
+                    payload['chunks'] = RecordSpool(self.extract_chunks(payload))
+                    payload['rows'] = RecordSpool(self.extract_rows(payload['file_path'], payload['file_type'],
+                                                                    payload['content_hash']))
+                except ExtractionError as e:
+                    Path(stored_path).unlink(missing_ok=True)
+                    logger.warning(f"Extraction failed for {payload['filename']}: {e}")
+                    return {
+                        'file_id': payload['file_id'],
+                        'filename': payload['filename'],
+                        'success': False,
+                        'extraction_failed': True,
+                        'error': str(e)
+                    }
+
+            # Store in database
+            try:
+                self.get_writer().write(lambda cursor: self.write_upload(cursor, payload))
+            except Exception:
+                Path(stored_path).unlink(missing_ok=True)
+                raise
+        finally:
+            self.release_extracted(payload)
+
+        if payload.get('duplicate_of'):
+            logger.info(f"Duplicate of {payload['duplicate_of']}, reused index: {payload['filename']}")
+        else:
+            logger.info(f"Successfully uploaded and processed: {payload['filename']}")
+        return self.upload_result(payload)
+
     def clean_search_query(self, query: str) -> str:
         """Clean search query to avoid FTS5 syntax errors"""
         import re
@@ -433,9 +3324,49 @@ class FileManager:
 
         return ' '.join(cleaned_words) if cleaned_words else query
 
+    SEARCH_LIMIT = 20
+
+    def collapse_search_hits(self, rows: Iterable) -> List[Dict]:
+        """Turn ranked search rows into results, one per group of duplicate chunks.
+
+        Boilerplate shared by many files is stored once and referenced by the
+        other copies, so a hit on it is reported once: under the first file
+        in rank order, with the other files listed in ``duplicate_files``.
+        Rows are read only until ``SEARCH_LIMIT`` results are collected.
+        """
+        search_results = []
+        groups = {}
+        for row in rows:
+            group = row[9]
+            hit = groups.get(group) if group is not None else None
+            if hit is not None:
+                if row[0] != hit['file_id'] and row[0] not in hit['duplicate_files']:
+                    hit['duplicate_files'].append(row[0])
+                continue
+            if len(search_results) == self.SEARCH_LIMIT:
+                break
+            hit = {
+                'file_id': row[0],
+                'filename': row[1],
+                'file_type': row[2],
+                'category': row[3],
+                'description': row[4],
+                'chunk_count': row[5],
+                'snippet': row[6] if row[6] else "",
+                'chunk_index': row[7],
+                'section_path': row[8],
+                'duplicate_files': []
+            }
+            search_results.append(hit)
+            if group is not None:
+                groups[group] = hit
+        return search_results
+
     def fallback_search(self, query: str, category: str = None, file_type: str = None) -> List[Dict]:
         """Fallback search using simple LIKE queries"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
+        # Near-duplicate chunks are matched on their text rebuilt from the chunk they reference
+        conn.create_function('chunk_text', 3, self.chunk_content, deterministic=True)
         cursor = conn.cursor()
 
         try:
@@ -446,10 +3377,16 @@ class FileManager:
                                            f.category, \
                                            f.description,
                                            f.chunk_count, \
-                                           SUBSTR(c.content, 1, 300) as snippet
+                                           SUBSTR(chunk_text(c.content, o.content, c.delta), 1, 300) as snippet, \
+                                           c.chunk_index, \
+                                           c.section_path, \
+                                           COALESCE(c.duplicate_of, c.id) as chunk_group
                            FROM files f
-                                    JOIN chunks c ON f.id = c.file_id
-                           WHERE (c.content LIKE ? OR f.filename LIKE ? OR f.description LIKE ?) \
+                                    JOIN chunks c ON c.file_id = COALESCE(f.duplicate_of, f.id)
+                                    LEFT JOIN chunks o ON o.id = c.duplicate_of
+                           WHERE (chunk_text(c.content, o.content, c.delta) LIKE ? OR f.filename LIKE ?
+                               OR f.description LIKE ?) \
+                             AND f.version_of IS NULL \
                            """
             params = [f"%{query}%", f"%{query}%", f"%{query}%"]
 
@@ -461,22 +3398,10 @@ class FileManager:
                 search_query += " AND f.file_type = ?"
                 params.append(file_type)
 
-            search_query += " ORDER BY f.upload_date DESC LIMIT 20"
+            search_query += " ORDER BY f.upload_date DESC"
 
             cursor.execute(search_query, params)
-            results = cursor.fetchall()
-
-            search_results = []
-            for row in results:
-                search_results.append({
-                    'file_id': row[0],
-                    'filename': row[1],
-                    'file_type': row[2],
-                    'category': row[3],
-                    'description': row[4],
-                    'chunk_count': row[5],
-                    'snippet': row[6] if row[6] else ""
-                })
+            search_results = self.collapse_search_hits(cursor)
 
             conn.close()
             return search_results
@@ -488,7 +3413,7 @@ class FileManager:
 
     def search_files(self, query: str, category: str = None, file_type: str = None) -> List[Dict]:
         """Search through all files and their content - FIXED VERSION"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
 
         try:
@@ -515,10 +3440,16 @@ class FileManager:
                                                f.category, \
                                                f.description,
                                                f.chunk_count, \
-                                               snippet(file_search, 2, '<mark>', '</mark>', '...', 32) as snippet
+                                               snippet(file_search, 2, '<mark>', '</mark>', '...', 32) as snippet, \
+                                               c.chunk_index, \
+                                               c.section_path, \
+                                               COALESCE(c.duplicate_of, c.id) as chunk_group
                                FROM files f
-                                        JOIN file_search fs ON f.id = fs.file_id
+                                        JOIN file_search fs
+                                             ON (f.id = fs.file_id OR f.duplicate_of = fs.file_id)
+                                        LEFT JOIN chunks c ON c.id = fs.chunk_id
                                WHERE file_search MATCH ? \
+                                 AND f.version_of IS NULL \
                                """
                 params = [cleaned_query]
 
@@ -532,22 +3463,10 @@ class FileManager:
                     search_query += " AND f.file_type = ?"
                     params.append(file_type)
 
-                search_query += " ORDER BY f.upload_date DESC LIMIT 20"
+                search_query += " ORDER BY f.upload_date DESC"
 
                 cursor.execute(search_query, params)
-                results = cursor.fetchall()
-
-                search_results = []
-                for row in results:
-                    search_results.append({
-                        'file_id': row[0],
-                        'filename': row[1],
-                        'file_type': row[2],
-                        'category': row[3],
-                        'description': row[4],
-                        'chunk_count': row[5],
-                        'snippet': row[6] if row[6] else ""
-                    })
+                search_results = self.collapse_search_hits(cursor)
 
                 conn.close()
                 return search_results
@@ -562,54 +3481,141 @@ class FileManager:
             conn.close()
             return self.fallback_search(query, category, file_type)
 
+    SPREADSHEET_OPERATORS = {'eq': '=', 'ne': '!=', 'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>='}
+
+    def query_spreadsheet_rows(self, filters: Dict = None, file_id: str = None, sheet: str = None,
+                               limit: int = 50) -> Dict:
+        """Find spreadsheet rows by the values in their columns.
+
+        ``filters`` maps column names to the value a row's cell must equal,
+        or to a dict of operators (``eq``, ``ne``, ``lt``, ``lte``, ``gt``,
+        ``gte``, ``contains``), e.g. ``{'Project': 'X', 'Budget': {'gte': 1000}}``.
+        Column names and text are compared case-insensitively, numbers
+        numerically and dates by their ISO form. Every filter must match.
+        Only the current version of each spreadsheet is searched.
+        """
+        conditions = []
+        params = []
+        for header, condition in (filters or {}).items():
+            if not isinstance(condition, dict):
+                condition = {'eq': condition}
+            for name, value in condition.items():
+                if name == 'contains':
+                    test, value = 'instr(text_value, ?) > 0', self.spreadsheet_key(value)
+                elif name not in self.SPREADSHEET_OPERATORS:
+                    return {'success': False, 'error': f"Unknown operator: {name}"}
+                elif isinstance(value, (int, float)):
+                    test = f"number_value {self.SPREADSHEET_OPERATORS[name]} ?"
+                else:
+                    test, value = f"text_value {self.SPREADSHEET_OPERATORS[name]} ?", self.spreadsheet_cell(value)[1]
+                conditions.append(f"r.id IN (SELECT row_id FROM spreadsheet_cells WHERE header = ? AND {test})")
+                params += [self.spreadsheet_key(header), value]
+        if file_id:
+            # Deduplicated uploads share the rows of their canonical file
+            conditions.append('r.file_id = (SELECT COALESCE(duplicate_of, id) FROM files WHERE id = ?)')
+            params.append(file_id)
+        if sheet:
+            conditions.append('r.sheet = ?')
+            params.append(sheet)
+
+        conn = self.connect()
+        try:
+            rows = conn.execute(f'''
+                                SELECT r.file_id, f.filename, r.sheet, r.row_number, r.cells
+                                FROM spreadsheet_rows r
+                                         JOIN files f ON f.id = r.file_id
+                                WHERE {' AND '.join(conditions) or '1'}
+                                ORDER BY r.id
+                                LIMIT ?
+                                ''', (*params, limit)).fetchall()
+        finally:
+            conn.close()
+
+        return {
+            'success': True,
+            'rows': [{
+                'file_id': row[0],
+                'filename': row[1],
+                'sheet': row[2],
+                'row_number': row[3],
+                'cells': json.loads(row[4])
+            } for row in rows]
+        }
+
     def get_file_content(self, file_id: str, chunk_index: int = None) -> Dict:
         """Get file content, optionally specific chunk"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
 
+        # Near-duplicate chunks read the content of the chunk they reference
+        section_path = section_summary = None
         if chunk_index is not None:
             cursor.execute('''
-                           SELECT content
-                           FROM chunks
-                           WHERE file_id = ?
-                             AND chunk_index = ?
+                           SELECT c.content, o.content, c.delta, c.section_path
+                           FROM chunks c
+                                    LEFT JOIN chunks o ON o.id = c.duplicate_of
+                           WHERE c.file_id = (SELECT COALESCE(duplicate_of, id) FROM files WHERE id = ?)
+                             AND c.chunk_index = ?
                            ''', (file_id, chunk_index))
             result = cursor.fetchone()
-            content = result[0] if result else ""
+            content = self.chunk_content(*result[:3]) if result else ""
+            section_path = result[3] if result else None
+            if section_path:
+                # The summary of a section is kept on its last chunk
+                cursor.execute('''
+                               SELECT section_summary
+                               FROM chunks
+                               WHERE file_id = (SELECT COALESCE(duplicate_of, id) FROM files WHERE id = ?)
+                                 AND chunk_index >= ?
+                                 AND section_path = ?
+                                 AND section_summary IS NOT NULL
+                               ORDER BY chunk_index
+                               LIMIT 1
+                               ''', (file_id, chunk_index, section_path))
+                row = cursor.fetchone()
+                section_summary = row[0] if row else None
         else:
             cursor.execute('''
-                           SELECT content
-                           FROM chunks
-                           WHERE file_id = ?
-                           ORDER BY chunk_index
+                           SELECT c.content, o.content, c.delta
+                           FROM chunks c
+                                    LEFT JOIN chunks o ON o.id = c.duplicate_of
+                           WHERE c.file_id = (SELECT COALESCE(duplicate_of, id) FROM files WHERE id = ?)
+                           ORDER BY c.chunk_index
                            ''', (file_id,))
             chunks = cursor.fetchall()
-            content = "\n\n".join([chunk[0] for chunk in chunks])
+            content = "\n\n".join([self.chunk_content(*chunk) for chunk in chunks])
 
         # Get file info
         cursor.execute('''
-                       SELECT filename, file_type, category, description, chunk_count
-                       FROM files
-                       WHERE id = ?
+                       SELECT f.filename, f.file_type, f.category, f.description, f.chunk_count,
+                              COALESCE(o.summary, f.summary)
+                       FROM files f
+                                LEFT JOIN files o ON o.id = f.duplicate_of
+                       WHERE f.id = ?
                        ''', (file_id,))
         file_info = cursor.fetchone()
 
         conn.close()
 
         if file_info:
-            return {
+            file_content = {
                 'content': content,
                 'filename': file_info[0],
                 'file_type': file_info[1],
                 'category': file_info[2],
                 'description': file_info[3],
-                'chunk_count': file_info[4]
+                'chunk_count': file_info[4],
+                'summary': file_info[5]
             }
+            if chunk_index is not None:
+                file_content['section_path'] = section_path
+                file_content['section_summary'] = section_summary
+            return file_content
         return {'error': 'File not found'}
 
     def list_files(self, category: str = None) -> List[Dict]:
         """List all uploaded files"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self.connect()
         cursor = conn.cursor()
 
         if category:
@@ -621,9 +3627,12 @@ class FileManager:
                                   category,
                                   description,
                                   upload_date,
-                                  chunk_count
+                                  chunk_count,
+                                  processed,
+                                  version
                            FROM files
                            WHERE category = ?
+                             AND version_of IS NULL
                            ORDER BY upload_date DESC
                            ''', (category,))
         else:
@@ -635,8 +3644,11 @@ class FileManager:
                                   category,
                                   description,
                                   upload_date,
-                                  chunk_count
+                                  chunk_count,
+                                  processed,
+                                  version
                            FROM files
+                           WHERE version_of IS NULL
                            ORDER BY upload_date DESC
                            ''')
 
@@ -650,32 +3662,604 @@ class FileManager:
                 'category': row[4],
                 'description': row[5],
                 'upload_date': row[6],
-                'chunk_count': row[7]
+                'chunk_count': row[7],
+                'processed': bool(row[8]),
+                'version': row[9] or 1
             })
 
         conn.close()
         return files
 
-    def bulk_upload(self, directory_path: str, category: str = None) -> Dict:
-        """Upload all files from a directory"""
+    def chunk_dedup_stats(self) -> Dict:
+        """Report how many chunks are stored as references and the index bytes saved.
+
+        A reference (a near-duplicate, or a chunk an earlier version shares
+        with the current one) would otherwise hold a full copy of its text in
+        the chunks table; the saving is counted from the size of the chunk it
+        references, less the size of its delta. The search table still keeps
+        the full text of every chunk, so it saves nothing there.
+        """
+        conn = self.connect()
+        try:
+            total, duplicates, duplicate_bytes, stored_bytes, delta_bytes = conn.execute('''
+                SELECT COUNT(*),
+                       COUNT(c.duplicate_of),
+                       COALESCE(SUM(LENGTH(CAST(o.content AS BLOB))), 0),
+                       COALESCE(SUM(LENGTH(CAST(c.content AS BLOB))), 0),
+                       COALESCE(SUM(LENGTH(CAST(c.delta AS BLOB))), 0)
+                FROM chunks c
+                         LEFT JOIN chunks o ON o.id = c.duplicate_of
+            ''').fetchone()
+        finally:
+            conn.close()
+
+        return {
+            'enabled': self.deduplicate_chunks,
+            'similarity_threshold': 1 - self.chunk_max_distance / SimHash.BITS,
+            'chunks': total,
+            'stored_chunks': total - duplicates,
+            'near_duplicate_chunks': duplicates,
+            'stored_bytes': stored_bytes + delta_bytes,
+            'bytes_saved': duplicate_bytes - delta_bytes
+        }
+
+    def list_versions(self, file_id: str) -> List[Dict]:
+        """List the versions of a document, newest first; empty if it does not exist"""
+        conn = self.connect()
+        try:
+            rows = conn.execute('''
+                                SELECT id, version, filename, file_size, content_hash, last_modified,
+                                       chunk_count, version_of
+                                FROM files
+                                WHERE (id = ? AND version_of IS NULL)
+                                   OR version_of = ?
+                                ORDER BY version DESC
+                                ''', (file_id, file_id)).fetchall()
+        finally:
+            conn.close()
+
+        if not any(row[7] is None for row in rows):
+            return []
+        return [{
+            'file_id': row[0],
+            'version': row[1] or 1,
+            'filename': row[2],
+            'file_size': row[3],
+            'content_hash': row[4],
+            'modified': row[5],
+            'chunk_count': row[6],
+            'current': row[7] is None
+        } for row in rows]
+
+    @staticmethod
+    def search_rows_query(file_id: str) -> str:
+        """FTS5 query selecting the search rows of one file"""
+        return 'file_id:"' + file_id.replace('"', '""') + '"'
+
+    def delete_file(self, file_id: str, cursor: sqlite3.Cursor = None) -> bool:
+        """Remove a file from the index and storage.
+
+        If deduplicated uploads reference the file, the oldest of them takes
+        over its chunks, search entries and stored bytes instead. Earlier
+        versions of a document are removed with it. Runs in the caller's
+        transaction when a cursor is given, otherwise as a write of the index
+        writer.
+        """
+        if cursor is None:
+            return self.get_writer().write(lambda write_cursor: self.delete_file(file_id, write_cursor))
+
+        cursor.execute('SELECT file_path, duplicate_of FROM files WHERE id = ?', (file_id,))
+        row = cursor.fetchone()
+        if not row:
+            return False
+        file_path, duplicate_of = row
+
+        cursor.execute('SELECT id FROM files WHERE version_of = ?', (file_id,))
+        for (version_id,) in cursor.fetchall():
+            self.delete_file(version_id, cursor)
+
+        cursor.execute('''
+                       SELECT id
+                       FROM files
+                       WHERE duplicate_of = ?
+                       ORDER BY upload_date
+                       ''', (file_id,))
+        dependents = [dependent[0] for dependent in cursor.fetchall()]
+
+        if duplicate_of is None and dependents:
+            self.hand_over(cursor, file_id, dependents[0])
+        elif duplicate_of is None:
+            self.remove_chunks(cursor, file_id)
+
+        cursor.execute('DELETE FROM files WHERE id = ?', (file_id,))
+
+        cursor.execute('SELECT 1 FROM files WHERE file_path = ? LIMIT 1', (file_path,))
+        if cursor.fetchone() is None:
+            Path(file_path).unlink(missing_ok=True)
+
+        return True
+
+    def hand_over(self, cursor: sqlite3.Cursor, file_id: str, heir: str):
+        """Make a deduplicated upload the owner of its canonical file's chunks, search entries and rows"""
+        cursor.execute('UPDATE chunks SET file_id = ? WHERE file_id = ?', (heir, file_id))
+        cursor.execute('UPDATE spreadsheet_rows SET file_id = ? WHERE file_id = ?', (heir, file_id))
+        cursor.execute('''
+                       UPDATE file_search
+                       SET file_id = ?
+                       WHERE rowid IN (SELECT rowid FROM file_search WHERE file_search MATCH ?)
+                       ''', (heir, self.search_rows_query(file_id)))
+        cursor.execute('''
+                       UPDATE files
+                       SET duplicate_of = NULL, summary = (SELECT summary FROM files WHERE id = ?)
+                       WHERE id = ?
+                       ''', (file_id, heir))
+        cursor.execute('UPDATE files SET duplicate_of = ? WHERE duplicate_of = ?', (heir, file_id))
+
+    def worker_config(self) -> Dict:
+        """Constructor arguments for rebuilding this manager in a worker process"""
+        return {
+            'storage_dir': str(self.storage_dir),
+            'db_path': self.db_path,
+            'deduplicate': self.deduplicate,
+            'cache_dir': str(self.extraction_cache.cache_dir) if self.extraction_cache else '',
+            'cache_max_bytes': self.extraction_cache.max_bytes if self.extraction_cache else 0,
+            'chunker': self.chunker,
+            'summarizer': self.summarizer,
+            'pdf_workers': self.pdf_workers,
+            'deduplicate_chunks': self.deduplicate_chunks
+        }
+
+    def collect_bulk_files(self, directory: Path) -> List[Path]:
+        """List supported files below a directory in a stable order"""
+        return sorted(
+            file_path for file_path in directory.rglob('*')
+            if file_path.is_file() and file_path.suffix.lower() in self.SUPPORTED_EXTENSIONS
+        )
+
+    def prepare_bulk_upload(self, file_path: str, category: str = None,
+                            sandbox: ExtractionSandbox = None) -> Dict:
+        """Prepare one file for the bulk writer, with its chunks spooled"""
+        return self.finish_bulk_payload(self.prepare_upload(file_path, category=category), sandbox)
+
+    def finish_bulk_payload(self, payload: Dict, sandbox: ExtractionSandbox = None) -> Dict:
+        """Check a stored payload for duplicates and spool its chunks and spreadsheet rows"""
+        if self.deduplicate:
+            self.lookup_duplicate(payload)
+        if payload.get('duplicate_of'):
+            return payload
+        try:
+            # Spool the chunks and rows so they can be handed to the writer
+            payload['chunks'] = RecordSpool(self.extract_chunks(payload, sandbox))
+            payload['rows'] = RecordSpool(self.extract_rows(payload['file_path'], payload['file_type'],
+                                                            payload['content_hash'], sandbox))
+        except ExtractionError:
+            self.release_extracted(payload)
+            Path(payload['file_path']).unlink(missing_ok=True)
+            raise
+        return payload
+
+    def write_bulk_payload(self, cursor: sqlite3.Cursor, payload: Dict, on_written=None):
+        """Write one prepared bulk file; ``on_written(cursor, payload)`` joins its transaction"""
+        self.write_upload(cursor, payload)
+        if on_written:
+            on_written(cursor, payload)
+
+    def bulk_upload(self, directory_path: str, category: str = None, workers: int = None,
+                    batch_size: int = None) -> Dict:
+        """Upload all files from a directory.
+
+        Extraction and chunking run in a sandbox of ``workers`` processes
+        while the index writer group-commits the prepared files, with at
+        most ``batch_size`` of them waiting to be written. Files whose
+        extraction fails or times out are reported as failed with the reason.
+        """
         directory = Path(directory_path)
         if not directory.exists():
             return {'error': 'Directory not found'}
 
+        return self.ingest_files(self.collect_bulk_files(directory), category=category,
+                                 workers=workers, batch_size=batch_size)
+
+    def upload_archive(self, archive, archive_name: str = None, category: str = None,
+                       tags: List[str] = None, description: str = None, workers: int = None,
+                       batch_size: int = None) -> Dict:
+        """Ingest the supported files inside a ZIP archive without unpacking it.
+
+        ``archive`` is a path or a seekable binary file object. Members are
+        streamed from the archive straight into storage and then go through
+        the bulk pipeline; ``original_name`` keeps their path inside the
+        archive. Archives with more than ``ARCHIVE_MAX_MEMBERS`` files or more
+        than ``ARCHIVE_MAX_UNCOMPRESSED_MB`` of uncompressed supported
+        content are rejected before anything is stored.
+        """
+        if archive_name is None:
+            archive_name = Path(archive).name if isinstance(archive, (str, Path)) else 'archive.zip'
+
+        try:
+            zip_file = zipfile.ZipFile(archive)
+        except (zipfile.BadZipFile, OSError, ValueError) as e:
+            return {'success': False, 'error': f"Invalid ZIP archive {archive_name}: {e}"}
+
+        with zip_file:
+            checked = self.check_archive(zip_file, archive_name)
+            if not checked['success']:
+                return checked
+
+            tasks = [
+                (f"{archive_name}/{info.filename}",
+                 lambda sandbox, info=info: self.prepare_archive_member(zip_file, info, archive_name, category,
+                                                                        tags, description, sandbox))
+                for info in checked['members']
+            ]
+            result = self.run_ingestion(tasks, workers=workers, batch_size=batch_size)
+
+        result.update({'success': True, 'archive': archive_name, 'skipped': checked['skipped']})
+        return result
+
+    def check_archive(self, zip_file: zipfile.ZipFile, archive_name: str) -> Dict:
+        """Pick the members of an open archive to ingest, enforcing the archive limits.
+
+        Returns ``members`` (supported, unencrypted files) and ``skipped``
+        (the others with the reason), or an error when the archive has more
+        than ``ARCHIVE_MAX_MEMBERS`` files or its members expand to more than
+        ``ARCHIVE_MAX_UNCOMPRESSED_MB``.
+        """
+        max_members = int(os.environ.get('ARCHIVE_MAX_MEMBERS', 1000))
+        max_bytes = int(os.environ.get('ARCHIVE_MAX_UNCOMPRESSED_MB', 2048)) * 1024 * 1024
+
+        entries = [info for info in zip_file.infolist() if not info.is_dir()]
+        if len(entries) > max_members:
+            return {'success': False,
+                    'error': f"Archive {archive_name} has {len(entries)} files, the limit is {max_members}"}
+
+        members = []
+        skipped = []
+        for info in entries:
+            if Path(info.filename).suffix.lower() not in self.SUPPORTED_EXTENSIONS:
+                skipped.append({'file': info.filename, 'reason': 'unsupported file type'})
+            elif info.flag_bits & 0x1:
+                skipped.append({'file': info.filename, 'reason': 'encrypted'})
+            else:
+                members.append(info)
+
+        # Reads stop at the declared sizes, so they bound what is written
+        uncompressed = sum(info.file_size for info in members)
+        if uncompressed > max_bytes:
+            return {'success': False,
+                    'error': f"Archive {archive_name} expands to {uncompressed // (1024 * 1024)} MB, "
+                             f"the limit is {max_bytes // (1024 * 1024)} MB"}
+        return {'success': True, 'members': members, 'skipped': skipped}
+
+    @staticmethod
+    def archive_member_filename(info: zipfile.ZipInfo) -> str:
+        """File name of an archive member, without the folders it is in"""
+        return re.split(r'[\\/]', info.filename)[-1]
+
+    def prepare_archive_member(self, zip_file: zipfile.ZipFile, info: zipfile.ZipInfo, archive_name: str,
+                               category: str = None, tags: List[str] = None, description: str = None,
+                               sandbox: ExtractionSandbox = None) -> Dict:
+        """Stream one archive member into storage and prepare it for the bulk writer"""
+        with zip_file.open(info) as member:
+            payload = self.prepare_upload_stream(member, self.archive_member_filename(info), category=category,
+                                                 tags=tags, description=description,
+                                                 original_name=f"{archive_name}/{info.filename}")
+        return self.finish_bulk_payload(payload, sandbox)
+
+    def ingest_files(self, file_paths: List[Path], category: str = None, workers: int = None,
+                     batch_size: int = None, on_written=None, stop: Callable[[], bool] = None) -> Dict:
+        """Run the bulk ingestion pipeline over a list of files"""
+        tasks = [
+            (str(file_path), lambda sandbox, path=str(file_path): self.prepare_bulk_upload(path, category, sandbox))
+            for file_path in file_paths
+        ]
+        return self.run_ingestion(tasks, workers=workers, batch_size=batch_size, on_written=on_written,
+                                  stop=stop)
+
+    def discard_prepared(self, futures: Iterable[Future]):
+        """Remove the stored copies of prepared files that will not be written"""
+        for future in futures:
+            if future.cancelled() or future.exception() is not None:
+                continue
+            payload = future.result()
+            self.release_extracted(payload)
+            # A duplicate's path is the stored copy of the file it duplicates
+            if not payload.get('duplicate_of'):
+                Path(payload['file_path']).unlink(missing_ok=True)
+
+    def run_ingestion(self, tasks: List[Tuple[str, Callable]], workers: int = None,
+                      batch_size: int = None, on_written=None, stop: Callable[[], bool] = None) -> Dict:
+        """Run the bulk ingestion pipeline.
+
+        Each task is ``(label, prepare)`` where ``prepare(sandbox)`` stores
+        one file and returns its payload with chunks spooled; the label
+        names the file in failure reports. ``stop()`` is polled as files
+        complete: once it returns true, tasks not yet started are dropped and
+        the files already prepared are still written. The result reports
+        ``stopped`` in that case.
+        """
+        if workers is None:
+            workers = int(os.environ.get('BULK_UPLOAD_WORKERS', os.cpu_count() or 1))
+        if batch_size is None:
+            batch_size = int(os.environ.get('BULK_UPLOAD_BATCH_SIZE', 50))
+        workers = max(1, workers)
+        batch_size = max(1, batch_size)
+
+        start_time = time.time()
         results = {'successful': [], 'failed': []}
-        supported_extensions = {'.pdf', '.docx', '.xlsx', '.txt', '.md', '.html'}
+        writes = deque()
+        total_bytes = 0
+        stopped = False
+        writer = self.get_writer()
 
-        for file_path in directory.rglob('*'):
-            if file_path.is_file() and file_path.suffix.lower() in supported_extensions:
-                result = self.upload_file(str(file_path), category=category)
-                if result.get('success'):
-                    results['successful'].append(result)
-                else:
-                    results['failed'].append({'file': str(file_path), 'error': result.get('error')})
+        def collect(payload: Dict, stored_path: str, write: Future):
+            try:
+                write.result()
+                results['successful'].append(self.upload_result(payload))
+            except Exception as e:
+                logger.error(f"Error writing file {payload['original_name']}: {e}")
+                Path(stored_path).unlink(missing_ok=True)
+                results['failed'].append({'file': payload['original_name'], 'error': str(e)})
+            finally:
+                self.release_extracted(payload)
+
+        def handle(label: str, payload: Optional[Dict], error: Optional[str]):
+            nonlocal total_bytes
+            if payload is None:
+                results['failed'].append({'file': label, 'error': error})
+                return
+            total_bytes += payload['file_size']
+            writes.append((payload, payload['file_path'], writer.submit(
+                lambda cursor: self.write_bulk_payload(cursor, payload, on_written)
+            )))
+            # Bound the prepared files held in memory while the writer catches up
+            while len(writes) >= batch_size:
+                collect(*writes.popleft())
 
+        # Threads copy and hash files; extraction runs in the sandbox processes
+        pool_size = max(1, min(workers, len(tasks)))
+        sandbox = self.new_sandbox(pool_size)
+        executor = ThreadPoolExecutor(max_workers=pool_size)
+        futures = {}
+        handled = set()
+        try:
+            futures = {executor.submit(prepare, sandbox): label for label, prepare in tasks}
+            for future in as_completed(futures):
+                handled.add(future)
+                if future.cancelled():
+                    continue
+                try:
+                    payload, error = future.result(), None
+                except Exception as e:
+                    logger.error(f"Error uploading file {futures[future]}: {e}")
+                    payload, error = None, str(e)
+                handle(futures[future], payload, error)
+                if stop is not None and not stopped and stop():
+                    stopped = True
+                    for pending in futures:
+                        pending.cancel()
+        except BaseException:
+            # Interrupted (Ctrl+C) or failed: wait only for the files in flight, not the whole queue
+            executor.shutdown(cancel_futures=True)
+            self.discard_prepared(future for future in futures if future not in handled)
+            raise
+        finally:
+            executor.shutdown()
+            if sandbox is not None:
+                sandbox.close()
+            while writes:
+                collect(*writes.popleft())
+
+        elapsed = time.time() - start_time
         return {
             'total_processed': len(results['successful']) + len(results['failed']),
             'successful': len(results['successful']),
             'failed': len(results['failed']),
-            'details': results
-        }
\ No newline at end of file
+            'details': results,
+            'stopped': stopped,
+            'throughput': {
+                'workers': workers,
+                'elapsed_seconds': round(elapsed, 3),
+                'total_bytes': total_bytes,
+                'files_per_second': round(len(results['successful']) / elapsed, 2) if elapsed else 0.0,
+                'mb_per_second': round(total_bytes / (1024 * 1024) / elapsed, 2) if elapsed else 0.0
+            }
+        }
+
+    def sync_directory(self, directory_path: str, category: str = None, workers: int = None,
+                       batch_size: int = None) -> Dict:
+        """Bring the index in line with a directory, touching only what changed.
+
+        A manifest keeps size, mtime and hash per source file. Files whose
+        size and mtime are unchanged are skipped without being read; files
+        with new content are re-ingested as the next version of their
+        previous entry, which only indexes the chunks that changed; files
+        that disappeared from the directory are removed from the index.
+        """
+        directory = Path(directory_path)
+        if not directory.exists():
+            return {'error': 'Directory not found'}
+
+        start_time = time.time()
+        root = str(directory.resolve())
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                           SELECT source_path, file_id, file_size, mtime, content_hash
+                           FROM sync_manifest
+                           WHERE root = ?
+                           ''', (root,))
+            manifest = {row[0]: row[1:] for row in cursor.fetchall()}
+
+            changed = []
+            previous = {}  # source path -> file id being replaced
+            touched = []
+            unchanged = 0
+            for file_path in self.collect_bulk_files(directory):
+                source_path = str(file_path.resolve())
+                stat = file_path.stat()
+                entry = manifest.pop(source_path, None)
+                if entry and entry[1] == stat.st_size and entry[2] == stat.st_mtime:
+                    unchanged += 1
+                    continue
+                if entry and entry[1] == stat.st_size and self.calculate_file_hash(source_path) == entry[3]:
+                    # Touched but not modified: remember the new mtime only
+                    touched.append((stat.st_mtime, source_path))
+                    unchanged += 1
+                    continue
+                changed.append(Path(source_path))
+                if entry:
+                    previous[source_path] = entry[0]
+        finally:
+            conn.close()
+
+        if touched:
+            self.get_writer().write(
+                lambda cursor: cursor.executemany('UPDATE sync_manifest SET mtime = ? WHERE source_path = ?',
+                                                  touched)
+            )
+
+        counts = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': unchanged}
+
+        def prepare(sandbox: ExtractionSandbox, path: str) -> Dict:
+            payload = self.prepare_upload(path, category=category)
+            payload['document_id'] = previous.get(path)
+            return self.finish_bulk_payload(payload, sandbox)
+
+        def record(cursor: sqlite3.Cursor, payload: Dict):
+            source_path = payload['original_name']
+            if payload.get('document_id'):
+                counts['updated'] += 1
+            else:
+                counts['added'] += 1
+            stat = Path(source_path).stat()
+            cursor.execute('''
+                           INSERT OR REPLACE INTO sync_manifest
+                               (source_path, root, file_id, file_size, mtime, content_hash, synced_at)
+                           VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                           ''', (source_path, root, payload['file_id'], payload['file_size'],
+                                 stat.st_mtime, payload['content_hash']))
+
+        tasks = [(str(path), lambda sandbox, path=str(path): prepare(sandbox, path)) for path in changed]
+        result = self.run_ingestion(tasks, workers=workers, batch_size=batch_size, on_written=record)
+
+        # Whatever is left in the manifest no longer exists in the directory
+        def remove_missing(cursor: sqlite3.Cursor):
+            for source_path, entry in manifest.items():
+                self.delete_file(entry[0], cursor)
+                cursor.execute('DELETE FROM sync_manifest WHERE source_path = ?', (source_path,))
+                counts['removed'] += 1
+
+        if manifest:
+            self.get_writer().write(remove_missing)
+
+        result.update(counts)
+        result['mode'] = 'sync'
+        result['throughput']['elapsed_seconds'] = round(time.time() - start_time, 3)
+        return result
+
+
+# Per-process FileManager used by extraction sandbox workers
+_worker_manager = None
+
+
+def _init_ingest_worker(config: Dict):
+    """Build the FileManager used by this worker process.
+
+    It only extracts, chunks and caches, so it never opens the index.
+    """
+    global _worker_manager
+    _worker_manager = FileManager(config['storage_dir'], config['db_path'], config['deduplicate'],
+                                  config['cache_dir'], config['cache_max_bytes'], sandbox=False,
+                                  init_database=False)
+    _worker_manager.chunker = config['chunker']
+    _worker_manager.summarizer = config.get('summarizer')
+    DocumentProcessor.pdf_workers = config.get('pdf_workers', 1)
+    _worker_manager.deduplicate_chunks = config.get('deduplicate_chunks', False)
+
+
+def _extract_chunks_in_worker(file_path: str, file_type: str, content_hash: str, file_id: str) -> Iterator[Dict]:
+    """Extract and chunk one stored file inside a sandbox worker.
+
+    Chunks are fingerprinted here as well, so the index writer only looks
+    up near-duplicates.
+    """
+    chunks = _worker_manager.chunker.iter_chunks(
+        _worker_manager.iter_text_content(file_path, file_type, content_hash), file_id
+    )
+    if _worker_manager.summarizer is not None:
+        chunks = _worker_manager.summarizer.annotate(chunks)
+    if not _worker_manager.deduplicate_chunks:
+        return chunks
+    return ({**chunk, 'simhash': SimHash.fingerprint(chunk['content'])} for chunk in chunks)
+
+
+def _extract_rows_in_worker(file_path: str, content_hash: str) -> Iterator[Dict]:
+    """Read the rows of a stored spreadsheet inside a sandbox worker"""
+    return _worker_manager.iter_spreadsheet_rows(file_path, content_hash)
+
+
+def _run_sandbox_worker(requests: Connection, replies: Connection):
+    """Main loop of a sandbox worker process: run tasks until the pool closes the channel"""
+    # Turn SIGTERM into SystemExit so open page range pools are shut down
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    config, memory_limit = requests.recv()
+    if memory_limit and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        DocumentProcessor.pdf_memory_limit = memory_limit
+    _init_ingest_worker(config)
+
+    while True:
+        try:
+            func, args = requests.recv()
+        except EOFError:
+            return
+        try:
+            batch = []
+            for item in func(*args):
+                batch.append(item)
+                if len(batch) >= ExtractionSandbox.BATCH_SIZE:
+                    replies.send(('items', batch))
+                    batch = []
+            if batch:
+                replies.send(('items', batch))
+            replies.send(('done', None))
+        except MemoryError:
+            # The heap may be in a bad state: report and let the pool replace this process
+            batch = None
+            limit = f" of {memory_limit // (1024 * 1024)} MB" if memory_limit else ""
+            replies.send(('fatal', f"Extraction exceeded the memory limit{limit}"))
+            return
+        except Exception as e:
+            logger.error(f"Extraction task failed: {e}")
+            replies.send(('error', f"{type(e).__name__}: {e}"))
+
+
+# PDF opened once per page range pool process
+_pdf_reader = None
+
+
+def _init_pdf_range_worker(file_path: str, share: int = None):
+    """Page range pool initializer: take this process's share of the memory budget and open the PDF"""
+    global _pdf_reader
+    if share:
+        limits = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (_address_space_size() + share, limits[1]))
+    # Pass a file object: given a path, PdfReader reads the whole file into memory
+    _pdf_reader = PyPDF2.PdfReader(open(file_path, 'rb'))
+
+
+def _extract_pdf_page_range(page_range: Tuple[int, int]) -> str:
+    """Extract the text of pages ``start`` to ``end - 1``"""
+    start, end = page_range
+    return "".join((_pdf_reader.pages[page_number].extract_text() or "") + "\n"
+                   for page_number in range(start, end))
+
+
+def _address_space_size() -> int:
+    """Address space this process uses, as counted against RLIMIT_AS (0 where unknown)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return 0
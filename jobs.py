@@ -0,0 +1,586 @@
+import os
+import json
+import uuid
+import sqlite3
+import socket
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+import logging
+from typing import Dict, List, Optional
+
+from file_manager import FileManager
+
+logger = logging.getLogger(__name__)
+
+
+def process_owner() -> str:
+    """Identifies this process as the owner of the jobs it claims"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def owner_alive(owner: Optional[str]) -> bool:
+    """Whether the process that claimed a job is still running"""
+    if not owner:
+        return False
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname():
+        # Cannot check another machine; leave its jobs alone
+        return True
+    if os.name != 'posix':
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class IngestJobQueue:
+    """Background extraction and indexing of stored uploads.
+
+    An upload is stored and registered as an unprocessed file, and a job
+    row is committed before the request returns. A pool of threads then
+    runs the job through ``FileManager.store_upload``; the job row tracks
+    queued/processing/done/failed, its timings and the process that claimed
+    it. On start, each queue picks up the queued jobs and those whose owner
+    has died, so several processes can serve one database. Job rows are
+    written by the index writer, like the files they track.
+    """
+
+    # Payload fields kept with the job to rebuild it in a worker
+    PAYLOAD_FIELDS = ('file_id', 'filename', 'original_name', 'file_path', 'file_size', 'content_hash',
+                      'category', 'tags', 'description')
+
+    def __init__(self, file_manager: FileManager, workers: int = None):
+        if workers is None:
+            workers = int(os.environ.get('INGEST_WORKERS', 2))
+
+        self.file_manager = file_manager
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ingest')
+        self.owner = process_owner()
+        self.init_database()
+        self.resume_pending()
+
+    def init_database(self):
+        """Create the ingest jobs table"""
+        conn = self.file_manager.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS ingest_jobs
+                       (
+                           id TEXT PRIMARY KEY,
+                           file_id TEXT NOT NULL,
+                           filename TEXT NOT NULL,
+                           payload TEXT NOT NULL,
+                           user_id INTEGER,
+                           status TEXT DEFAULT 'queued',
+                           owner TEXT,
+                           result TEXT,
+                           error TEXT,
+                           created_at TEXT NOT NULL,
+                           started_at TEXT,
+                           finished_at TEXT
+                       )
+                       ''')
+        self.file_manager.ensure_columns(cursor, 'ingest_jobs', {'owner': 'TEXT'})
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs(status)')
+        conn.commit()
+        conn.close()
+
+    def submit(self, payload: Dict, user_id: int = None) -> Dict:
+        """Register a stored upload and queue its extraction, returning its upload result.
+
+        The stored bytes are flushed to disk and the file and job rows are
+        committed together by the index writer before the job is handed to
+        the pool, so an accepted upload survives a restart.
+        """
+        with open(payload['file_path'], 'rb') as stored:
+            os.fsync(stored.fileno())
+
+        job_id = uuid.uuid4().hex
+
+        def register(cursor):
+            self.file_manager.register_upload(cursor, payload)
+            cursor.execute('''
+                           INSERT INTO ingest_jobs (id, file_id, filename, payload, user_id, created_at)
+                           VALUES (?, ?, ?, ?, ?, ?)
+                           ''', (job_id, payload['file_id'], payload['filename'],
+                                 json.dumps({field: payload[field] for field in self.PAYLOAD_FIELDS}),
+                                 user_id, datetime.now().isoformat()))
+
+        try:
+            self.file_manager.get_writer().write(register)
+        except Exception:
+            Path(payload['file_path']).unlink(missing_ok=True)
+            raise
+
+        self.executor.submit(self.run_job, job_id)
+        logger.info(f"Queued ingest job {job_id} for {payload['filename']}")
+        return {
+            'file_id': payload['file_id'],
+            'filename': payload['filename'],
+            'file_type': payload['file_type'],
+            'job_id': job_id,
+            'status': 'queued',
+            'queued': True,
+            'success': True
+        }
+
+    def upload_stream(self, source, filename: str, category: str = None, tags: list = None,
+                      description: str = None, user_id: int = None, original_name: str = None) -> Dict:
+        """Store a file read from an open binary file object and queue its extraction"""
+        try:
+            payload = self.file_manager.prepare_upload_stream(source, filename, category=category, tags=tags,
+                                                              description=description, original_name=original_name)
+            return self.submit(payload, user_id)
+        except Exception as e:
+            logger.error(f"Error queueing upload {filename}: {e}")
+            return {'success': False, 'error': str(e)}
+
+    def upload_archive(self, archive, archive_name: str, category: str = None, tags: list = None,
+                       description: str = None, user_id: int = None) -> Dict:
+        """Store the supported members of a ZIP archive and queue one job per member.
+
+        The archive limits of ``FileManager.check_archive`` apply. Members
+        are streamed into storage in the caller's thread; their extraction
+        and indexing run on the pool like any other queued upload.
+        """
+        try:
+            zip_file = zipfile.ZipFile(archive)
+        except (zipfile.BadZipFile, OSError, ValueError) as e:
+            return {'success': False, 'error': f"Invalid ZIP archive {archive_name}: {e}"}
+
+        results = {'successful': [], 'failed': []}
+        with zip_file:
+            checked = self.file_manager.check_archive(zip_file, archive_name)
+            if not checked['success']:
+                return checked
+            for info in checked['members']:
+                original_name = f"{archive_name}/{info.filename}"
+                with zip_file.open(info) as member:
+                    result = self.upload_stream(member, self.file_manager.archive_member_filename(info),
+                                                category=category, tags=tags, description=description,
+                                                user_id=user_id, original_name=original_name)
+                if result['success']:
+                    results['successful'].append(result)
+                else:
+                    results['failed'].append({'file': original_name, 'error': result['error']})
+
+        return {
+            'success': True,
+            'archive': archive_name,
+            'queued': True,
+            'total_processed': len(results['successful']) + len(results['failed']),
+            'successful': len(results['successful']),
+            'failed': len(results['failed']),
+            'details': results,
+            'skipped': checked['skipped']
+        }
+
+    def update_job(self, job_id: str, **fields):
+        """Write changed job fields"""
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self.file_manager.get_writer().write(
+            lambda cursor: cursor.execute(f'UPDATE ingest_jobs SET {assignments} WHERE id = ?',
+                                          (*fields.values(), job_id))
+        )
+
+    def run_job(self, job_id: str):
+        """Extract and index the upload of one job"""
+        # Claim the job, so it runs once even if it was queued twice
+        def claim(cursor):
+            return cursor.execute('''
+                                  UPDATE ingest_jobs
+                                  SET status = 'processing', owner = ?, started_at = ?
+                                  WHERE id = ? AND status = 'queued'
+                                  ''', (self.owner, datetime.now().isoformat(), job_id)).rowcount
+
+        if not self.file_manager.get_writer().write(claim):
+            return
+        conn = self.file_manager.connect()
+        row = conn.execute('SELECT payload FROM ingest_jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.close()
+
+        stored = json.loads(row[0])
+
+        try:
+            if not Path(stored['file_path']).exists():
+                raise FileNotFoundError(f"Stored upload is missing: {stored['file_path']}")
+            fields = dict(stored)
+            fields['storage_path'] = Path(fields.pop('file_path'))
+            payload = self.file_manager.build_payload(**fields)
+            payload['registered'] = True
+            result = self.file_manager.store_upload(payload)
+        except Exception as e:
+            logger.error(f"Ingest job {job_id} failed for {stored['filename']}: {e}")
+            result = {'file_id': stored['file_id'], 'filename': stored['filename'],
+                      'success': False, 'error': str(e)}
+
+        if not result.get('success') and not self.is_processed(stored['file_id']):
+            # Drop the unprocessed files row so the failed upload is not listed
+            self.file_manager.delete_file(stored['file_id'])
+
+        self.update_job(
+            job_id,
+            status='done' if result.get('success') else 'failed',
+            owner=None,
+            result=json.dumps(result),
+            error=result.get('error'),
+            finished_at=datetime.now().isoformat()
+        )
+
+    def is_processed(self, file_id: str) -> bool:
+        """Whether a file's row has been completed by an earlier run"""
+        conn = self.file_manager.connect()
+        row = conn.execute('SELECT processed FROM files WHERE id = ?', (file_id,)).fetchone()
+        conn.close()
+        return bool(row and row[0])
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Return a job's status, result and timings in seconds"""
+        conn = self.file_manager.connect()
+        conn.row_factory = sqlite3.Row
+        row = conn.execute('SELECT * FROM ingest_jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.close()
+        if row is None:
+            return None
+
+        created = datetime.fromisoformat(row['created_at'])
+        started = datetime.fromisoformat(row['started_at']) if row['started_at'] else None
+        finished = datetime.fromisoformat(row['finished_at']) if row['finished_at'] else None
+        return {
+            'job_id': row['id'],
+            'file_id': row['file_id'],
+            'filename': row['filename'],
+            'user_id': row['user_id'],
+            'status': row['status'],
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+            'queued_seconds': ((started or datetime.now()) - created).total_seconds(),
+            'processing_seconds': ((finished or datetime.now()) - started).total_seconds() if started else None
+        }
+
+    def resume_pending(self) -> int:
+        """Queue the queued jobs, and again those a dead process left processing.
+
+        Jobs processed by a live process, this one or another worker on
+        the same database, are left to it.
+        """
+        conn = self.file_manager.connect()
+        rows = conn.execute('''
+                            SELECT id, status, owner
+                            FROM ingest_jobs
+                            WHERE status IN ('queued', 'processing')
+                            ORDER BY created_at
+                            ''').fetchall()
+        conn.close()
+        pending = []
+        orphaned = []
+        for job_id, status, owner in rows:
+            if status == 'processing':
+                if owner_alive(owner):
+                    continue
+                orphaned.append((job_id, owner))
+            pending.append(job_id)
+
+        if orphaned:
+            # Only the owner that was seen dead is replaced, in case another process got here first
+            self.file_manager.get_writer().write(lambda cursor: cursor.executemany('''
+                UPDATE ingest_jobs
+                SET status = 'queued', owner = NULL, started_at = NULL
+                WHERE id = ? AND status = 'processing' AND owner IS ?
+                ''', orphaned))
+
+        for job_id in pending:
+            self.executor.submit(self.run_job, job_id)
+        if pending:
+            logger.info(f"Re-queued {len(pending)} unfinished ingest jobs")
+        return len(pending)
+
+
+class BulkImportJobs:
+    """Durable bulk imports of a directory, checkpointed file by file.
+
+    Creating a job records every supported file of the directory as a
+    pending item. Running it sends the pending items through the bulk
+    pipeline, and each item is marked done in the same transaction that
+    writes its file. A run that is interrupted therefore resumes with
+    exactly the files that were not committed. Jobs can be paused,
+    resumed and cancelled between files. Job and item rows are written by
+    the index writer.
+    """
+
+    # How often a running job re-reads its status to notice pause and cancel
+    STATUS_POLL_SECONDS = 1.0
+
+    def __init__(self, file_manager: FileManager):
+        self.file_manager = file_manager
+        # Each run already spreads its files over a sandbox of processes
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bulk-import')
+        self.owner = process_owner()
+        self.init_database()
+
+    def init_database(self):
+        """Create the bulk job and bulk job item tables"""
+        conn = self.file_manager.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS bulk_jobs
+                       (
+                           id TEXT PRIMARY KEY,
+                           directory TEXT NOT NULL,
+                           category TEXT,
+                           workers INTEGER,
+                           batch_size INTEGER,
+                           user_id INTEGER,
+                           status TEXT DEFAULT 'queued',
+                           owner TEXT,
+                           error TEXT,
+                           created_at TEXT NOT NULL,
+                           started_at TEXT,
+                           finished_at TEXT
+                       )
+                       ''')
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS bulk_job_items
+                       (
+                           job_id TEXT NOT NULL,
+                           source_path TEXT NOT NULL,
+                           status TEXT DEFAULT 'pending',
+                           file_id TEXT,
+                           error TEXT,
+                           PRIMARY KEY (job_id, source_path)
+                       )
+                       ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_bulk_job_items_status ON bulk_job_items(job_id, status)')
+        conn.commit()
+        conn.close()
+
+    def create_job(self, directory_path: str, category: str = None, workers: int = None,
+                   batch_size: int = None, user_id: int = None) -> Dict:
+        """Record a bulk import of a directory with all its files pending"""
+        directory = Path(directory_path)
+        if not directory.exists():
+            return {'success': False, 'error': 'Directory not found'}
+
+        job_id = uuid.uuid4().hex
+        file_paths = self.file_manager.collect_bulk_files(directory)
+
+        def create(cursor):
+            cursor.execute('''
+                           INSERT INTO bulk_jobs (id, directory, category, workers, batch_size, user_id, created_at)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)
+                           ''', (job_id, str(directory), category, workers, batch_size, user_id,
+                                 datetime.now().isoformat()))
+            cursor.executemany('INSERT INTO bulk_job_items (job_id, source_path) VALUES (?, ?)',
+                               ((job_id, str(file_path)) for file_path in file_paths))
+
+        self.file_manager.get_writer().write(create)
+
+        logger.info(f"Bulk import job {job_id} created for {directory} ({len(file_paths)} files)")
+        return {'success': True, **self.get_job(job_id)}
+
+    def start(self, job_id: str):
+        """Run a queued job on the background thread"""
+        self.executor.submit(self.run_job, job_id)
+
+    def set_status(self, job_id: str, status: str, allowed: tuple, **fields) -> bool:
+        """Move a job to ``status`` if it is in one of the ``allowed`` states"""
+        assignments = ''.join(f", {name} = ?" for name in fields)
+        changed = self.file_manager.get_writer().write(lambda cursor: cursor.execute(f'''
+            UPDATE bulk_jobs
+            SET status = ?{assignments}
+            WHERE id = ? AND status IN ({','.join('?' * len(allowed))})
+            ''', (status, *fields.values(), job_id, *allowed)).rowcount)
+        return bool(changed)
+
+    def job_status(self, job_id: str) -> Optional[str]:
+        """Current status of a job"""
+        conn = self.file_manager.connect()
+        row = conn.execute('SELECT status FROM bulk_jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def stop_requested(self, job_id: str):
+        """Callback telling a run whether its job was paused or cancelled"""
+        last_check = [0.0, False]
+
+        def stop() -> bool:
+            now = time.monotonic()
+            if now - last_check[0] >= self.STATUS_POLL_SECONDS:
+                last_check[0] = now
+                last_check[1] = self.job_status(job_id) != 'running'
+            return last_check[1]
+
+        return stop
+
+    def run_job(self, job_id: str) -> Optional[Dict]:
+        """Ingest the pending files of a queued job in this thread"""
+        if not self.set_status(job_id, 'running', ('queued',), owner=self.owner,
+                               started_at=datetime.now().isoformat()):
+            return self.get_job(job_id)
+
+        conn = self.file_manager.connect()
+        conn.row_factory = sqlite3.Row
+        job = conn.execute('SELECT * FROM bulk_jobs WHERE id = ?', (job_id,)).fetchone()
+        pending = [Path(row[0]) for row in conn.execute('''
+                                                        SELECT source_path
+                                                        FROM bulk_job_items
+                                                        WHERE job_id = ? AND status = 'pending'
+                                                        ORDER BY rowid
+                                                        ''', (job_id,))]
+        conn.close()
+
+        def checkpoint(cursor: sqlite3.Cursor, payload: Dict):
+            cursor.execute('''
+                           UPDATE bulk_job_items
+                           SET status = 'done', file_id = ?
+                           WHERE job_id = ? AND source_path = ?
+                           ''', (payload['file_id'], job_id, payload['original_name']))
+
+        logger.info(f"Bulk import job {job_id}: {len(pending)} files pending")
+        try:
+            result = self.file_manager.ingest_files(pending, category=job['category'], workers=job['workers'],
+                                                    batch_size=job['batch_size'], on_written=checkpoint,
+                                                    stop=self.stop_requested(job_id))
+        except Exception as e:
+            logger.error(f"Bulk import job {job_id} failed: {e}")
+            self.set_status(job_id, 'failed', ('running',), owner=None, error=str(e),
+                            finished_at=datetime.now().isoformat())
+            return self.get_job(job_id)
+
+        failures = [(failure['error'], job_id, failure['file']) for failure in result['details']['failed']]
+        self.file_manager.get_writer().write(lambda cursor: cursor.executemany('''
+            UPDATE bulk_job_items
+            SET status = 'failed', error = ?
+            WHERE job_id = ? AND source_path = ? AND status = 'pending'
+            ''', failures))
+
+        # Paused and cancelled jobs keep their status unless nothing is left
+        pending = self.get_job(job_id)['pending']
+        if not pending:
+            self.set_status(job_id, 'done', ('running', 'paused'), finished_at=datetime.now().isoformat())
+        else:
+            self.set_status(job_id, 'failed', ('running',), error=f"{pending} files were not processed",
+                            finished_at=datetime.now().isoformat())
+        self.file_manager.get_writer().write(
+            lambda cursor: cursor.execute('UPDATE bulk_jobs SET owner = NULL WHERE id = ?', (job_id,))
+        )
+
+        job = self.get_job(job_id)
+        logger.info(f"Bulk import job {job_id} {job['status']}: {job['done']} done, {job['failed']} failed, "
+                    f"{job['pending']} pending")
+        return job
+
+    def pause(self, job_id: str) -> bool:
+        """Stop a job after the files in flight; ``resume`` continues it"""
+        return self.set_status(job_id, 'paused', ('queued', 'running'))
+
+    def resume(self, job_id: str, background: bool = True) -> bool:
+        """Queue a paused, failed or interrupted job again and start it.
+
+        With ``background=False`` the job is only queued, for the caller to
+        run it with ``run_job``.
+        """
+        self.release_orphaned(job_id)
+        if not self.set_status(job_id, 'queued', ('queued', 'paused', 'failed'), error=None, finished_at=None):
+            return False
+        if background:
+            self.start(job_id)
+        return True
+
+    def cancel(self, job_id: str) -> bool:
+        """Stop a job for good; files already imported stay in the index"""
+        if not self.set_status(job_id, 'cancelled', ('queued', 'running', 'paused'),
+                               finished_at=datetime.now().isoformat()):
+            return False
+        self.file_manager.get_writer().write(lambda cursor: cursor.execute(
+            "UPDATE bulk_job_items SET status = 'cancelled' WHERE job_id = ? AND status = 'pending'", (job_id,)
+        ))
+        return True
+
+    def release_orphaned(self, job_id: str) -> bool:
+        """Queue a job left running by a process that no longer exists"""
+        conn = self.file_manager.connect()
+        row = conn.execute('SELECT status, owner FROM bulk_jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.close()
+        if row is None or row[0] != 'running' or owner_alive(row[1]):
+            return False
+        return self.set_status(job_id, 'queued', ('running',), owner=None)
+
+    def resume_interrupted(self) -> int:
+        """Start the jobs a previous process left queued or stopped mid-run"""
+        conn = self.file_manager.connect()
+        rows = conn.execute('''
+                            SELECT id, status
+                            FROM bulk_jobs
+                            WHERE status IN ('queued', 'running')
+                            ORDER BY created_at
+                            ''').fetchall()
+        conn.close()
+
+        resumed = 0
+        for job_id, status in rows:
+            if status == 'queued' or self.release_orphaned(job_id):
+                self.start(job_id)
+                resumed += 1
+        if resumed:
+            logger.info(f"Resumed {resumed} bulk import jobs")
+        return resumed
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Return a job with its progress counts and the first failures"""
+        conn = self.file_manager.connect()
+        conn.row_factory = sqlite3.Row
+        job = conn.execute('SELECT * FROM bulk_jobs WHERE id = ?', (job_id,)).fetchone()
+        if job is None:
+            conn.close()
+            return None
+        counts = dict(conn.execute('''
+                                   SELECT status, COUNT(*)
+                                   FROM bulk_job_items
+                                   WHERE job_id = ?
+                                   GROUP BY status
+                                   ''', (job_id,)).fetchall())
+        failures = [{'file': row[0], 'error': row[1]} for row in conn.execute('''
+                    SELECT source_path, error
+                    FROM bulk_job_items
+                    WHERE job_id = ? AND status = 'failed'
+                    ORDER BY rowid
+                    LIMIT 100
+                    ''', (job_id,))]
+        conn.close()
+
+        return {
+            'job_id': job['id'],
+            'directory': job['directory'],
+            'category': job['category'],
+            'status': job['status'],
+            'error': job['error'],
+            'user_id': job['user_id'],
+            'total': sum(counts.values()),
+            'done': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+            'pending': counts.get('pending', 0),
+            'cancelled': counts.get('cancelled', 0),
+            'failures': failures,
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at']
+        }
+
+    def list_jobs(self, limit: int = 50) -> List[Dict]:
+        """Most recent bulk import jobs first"""
+        conn = self.file_manager.connect()
+        job_ids = [row[0] for row in conn.execute('SELECT id FROM bulk_jobs ORDER BY created_at DESC LIMIT ?',
+                                                  (limit,))]
+        conn.close()
+        return [self.get_job(job_id) for job_id in job_ids]
@@ -12,6 +12,9 @@ logger = logging.getLogger(__name__)
 class EnhancedKnowledgeBase:
     """Enhanced knowledge base that integrates with file management system"""
 
+    # Longest part of a matching document section put into a prompt
+    SECTION_PROMPT_CHARS = 1500
+
     def __init__(self, file_manager: FileManager):
         self.file_manager = file_manager
         self.static_data = {
@@ -119,16 +122,32 @@ Hörmətlə,
                 return ""
 
             document_info = []
+            summarized = set()
             for i, result in enumerate(search_results[:max_results]):
-                # Get relevant content from the document
-                file_content = self.file_manager.get_file_content(result['file_id'])
+                # The matching section is small and self-contained, so it goes
+                # into the prompt instead of the whole document
+                if result.get('chunk_index') is not None:
+                    file_content = self.file_manager.get_file_content(result['file_id'], result['chunk_index'])
+                    relevant = file_content.get('content', '')[:self.SECTION_PROMPT_CHARS]
+                else:
+                    file_content = self.file_manager.get_file_content(result['file_id'])
+                    relevant = result.get('snippet') or file_content.get('content', '')[:300]
 
                 doc_info = f"""
 Sənəd: {result['filename']} (Növ: {result['file_type']})
 Kateqoriya: {result.get('category', 'Təyin edilməyib')}
 Təsvir: {result.get('description', 'Təsvir yoxdur')}
-Əlaqəli məzmun: {result.get('snippet', file_content.get('content', '')[:300])}...
 """
+                if file_content.get('summary') and result['file_id'] not in summarized:
+                    summarized.add(result['file_id'])
+                    doc_info += f"Sənədin xülasəsi: {file_content['summary']}\n"
+                if result.get('section_path'):
+                    doc_info += f"Bölmə: {result['section_path']}\n"
+                # Precomputed summaries are compact; the raw text is the fallback
+                if file_content.get('section_summary'):
+                    doc_info += f"Bölmənin xülasəsi: {file_content['section_summary']}\n"
+                    relevant = result.get('snippet') or relevant
+                doc_info += f"Əlaqəli məzmun: {relevant}...\n"
                 document_info.append(doc_info)
 
             return "\n".join(document_info)
@@ -382,8 +401,12 @@ class EnhancedAIAssistant:
             document_content = ""
             if doc_request['has_document_request'] and doc_request['specific_filename']:
                 doc_result = self.kb.get_document_by_name(doc_request['specific_filename'])
-                if not doc_result.get('error'):
-                    document_content = f"\n=== XÜSUSI SƏNƏD MƏZMUNU ===\n{doc_result.get('content', '')[:2000]}..."
+                content = doc_result.get('content', '')
+                if len(content) > 2000 and doc_result.get('summary'):
+                    # Long documents are represented by their precomputed summary
+                    document_content = f"\n=== XÜSUSI SƏNƏD XÜLASƏSİ ===\n{doc_result['summary']}"
+                elif not doc_result.get('error'):
+                    document_content = f"\n=== XÜSUSI SƏNƏD MƏZMUNU ===\n{content[:2000]}..."
 
             # Create enhanced prompt with better structure
             system_prompt = f"""
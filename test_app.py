@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Web Application Upload Tests
+Checks the upload endpoints through the Flask test client on a temporary index
+"""
+
+import importlib
+import io
+import os
+import time
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    """The application, imported with its index, storage and user database in a temporary directory"""
+    directory = tmp_path_factory.mktemp('app')
+    environment = {
+        'DB_PATH': str(directory / 'index.db'),
+        'STORAGE_DIR': str(directory / 'documents'),
+        'EXTRACTION_CACHE_DIR': '',
+        'EXTRACTION_SANDBOX': 'False',
+    }
+    saved = {name: os.environ.get(name) for name in environment}
+    cwd = os.getcwd()
+    os.environ.update(environment)
+    # The user database is opened relative to the working directory
+    os.chdir(directory)
+    try:
+        yield importlib.import_module('app')
+    finally:
+        os.chdir(cwd)
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+@pytest.fixture
+def client(app_module):
+    """A test client logged in as an administrator"""
+    app_module.app.config['TESTING'] = True
+    with app_module.app.test_client() as client:
+        with client.session_transaction() as session:
+            session['user_id'] = 1
+            session['role'] = 'admin'
+        yield client
+
+
+def upload(name: str, data: bytes):
+    """A file field of a multipart form"""
+    return io.BytesIO(data), name
+
+
+def test_upload_multiple_reports_each_file(app_module, client, monkeypatch):
+    process_upload = app_module.process_upload
+
+    def failing(stream, filename, *args, **kwargs):
+        if filename == 'boom.md':
+            raise OSError('disk full')
+        return process_upload(stream, filename, *args, **kwargs)
+
+    monkeypatch.setattr(app_module, 'process_upload', failing)
+    response = client.post('/upload-multiple', content_type='multipart/form-data', data={
+        'category': 'hr',
+        'files': [
+            upload('birinci.md', "# Birinci\n\nalpha mətn.\n".encode('utf-8')),
+            upload('pozuq.zip', b"not a zip archive"),
+            upload('boom.md', b"# Boom\n"),
+            upload('ikinci.txt', "bravo mətn.\n".encode('utf-8')),
+        ],
+    })
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['success'], body['successful'], body['failed']) == (False, 2, 2)
+    assert [(result['filename'], result['success']) for result in body['results']] == [
+        ('birinci.md', True), ('pozuq.zip', False), ('boom.md', False), ('ikinci.txt', True)
+    ]
+    assert body['results'][1]['error'].startswith('Invalid ZIP archive pozuq.zip')
+    assert body['results'][2]['error'] == 'Fayl yükləmə zamanı xəta baş verdi'
+    # Accepted files are queued as ingest jobs
+    assert all(result['file_info']['queued'] for result in body['results'] if result['success'])
+
+
+def test_upload_multiple_rejects_too_many_files(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module.Config, 'MAX_FILES_PER_UPLOAD', 2)
+    response = client.post('/upload-multiple', content_type='multipart/form-data', data={
+        'files': [upload(f'{number}.txt', b"text") for number in range(3)],
+    })
+
+    assert response.status_code == 400
+    assert response.get_json() == {'success': False, 'error': 'Bir dəfəyə ən çox 2 fayl yükləmək olar'}
+
+
+def test_upload_multiple_requires_a_file(client):
+    response = client.post('/upload-multiple', content_type='multipart/form-data', data={})
+
+    assert response.status_code == 400
+
+
+def test_upload_returns_a_job_to_poll(client):
+    response = client.post('/upload', content_type='multipart/form-data', data={
+        'file': upload('təlimat.md', "# Təlimat\n\nalpha mətn.\n".encode('utf-8')),
+    })
+
+    assert response.status_code == 202
+    job_id = response.get_json()['file_info']['job_id']
+    for _ in range(500):
+        job = client.get(f'/jobs/{job_id}').get_json()
+        if job['status'] in ('done', 'failed'):
+            break
+        time.sleep(0.02)
+    assert (job['status'], job['user_id']) == ('done', 1)
+
+    with client.session_transaction() as session:
+        session['user_id'] = 2
+        session['role'] = 'user'
+    assert client.get(f'/jobs/{job_id}').status_code == 404
@@ -0,0 +1,957 @@
+#!/usr/bin/env python3
+"""
+File Manager Index Tests
+Checks chunk deduplication, search, document versions, extraction and its cache on a temporary index
+"""
+
+import codecs
+import hashlib
+import io
+import json
+import os
+import random
+import sqlite3
+import time
+import zipfile
+from datetime import datetime
+
+import docx
+import openpyxl
+import pytest
+
+import file_manager as file_manager_module
+from jobs import IngestJobQueue, process_owner
+from uploads import UploadSessionManager
+from file_manager import (HEADING_MARK, SECTION_BREAK, DocumentChunker, DocumentProcessor, ExtractionCache, FileManager,
+                          RecordSpool, SectionChunker)
+
+WORDS = ("işçi sənəd kadrlar şöbə təlimat müqavilə məzuniyyət əmək haqqı qayda rəhbər təqdim qəbul "
+         "tanışlıq prosedur müddət ərizə təsdiq nazirlik sistem").split()
+# 350 words; the seed keeps the two documents within the near-duplicate threshold
+_words = random.Random(2)
+BODY = " ".join(_words.choice(WORDS) for _ in range(350))
+
+
+def document(name: str) -> str:
+    """A policy text that differs between documents only in the responsible person"""
+    return f"# Təyinat\n\nMəsul şəxs: {name}.\n\n{BODY}\n"
+
+
+@pytest.fixture
+def file_manager(tmp_path):
+    """A file manager on an empty index, extracting in-process"""
+    return FileManager(str(tmp_path / 'documents'), str(tmp_path / 'index.db'), deduplicate=False,
+                       cache_dir='', sandbox=False)
+
+
+def upload(file_manager, tmp_path, filename: str, text: str, **options) -> dict:
+    """Upload a markdown file with the given text"""
+    path = tmp_path / filename
+    path.write_text(text, encoding='utf-8')
+    result = file_manager.upload_file(str(path), **options)
+    assert result['success'], result
+    return result
+
+
+def query(file_manager, sql: str, params=()) -> list:
+    """Run a read query on the index"""
+    conn = sqlite3.connect(file_manager.db_path)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+def found(results: list) -> set:
+    """File ids of search results"""
+    return {result['file_id'] for result in results}
+
+
+def test_near_duplicate_chunk_words_are_searchable(file_manager, tmp_path):
+    first = upload(file_manager, tmp_path, 'first.md', document("Anar Məmmədov"))
+    second = upload(file_manager, tmp_path, 'second.md', document("Leyla Hüseynova"))
+
+    # The second document is stored as a reference to the first one
+    references = query(file_manager, 'SELECT COUNT(*) FROM chunks WHERE file_id = ? AND duplicate_of IS NOT NULL',
+                       (second['file_id'],))
+    assert references[0][0] > 0
+
+    assert found(file_manager.search_files('Leyla')) == {second['file_id']}
+    assert found(file_manager.fallback_search('Leyla')) == {second['file_id']}
+    assert found(file_manager.fallback_search('Hüseynova')) == {second['file_id']}
+    assert found(file_manager.search_files('Anar')) == {first['file_id']}
+    # The text both documents share is one result, naming the other copy
+    hits = file_manager.search_files('kadrlar')
+    assert len(hits) == 1
+    assert {hits[0]['file_id'], *hits[0]['duplicate_files']} == {first['file_id'], second['file_id']}
+
+
+def test_shared_boilerplate_is_one_search_result(file_manager, tmp_path):
+    names = ["Anar Məmmədov", "Leyla Hüseynova", "Rəşad Quliyev", "Nigar Əliyeva"]
+    results = [upload(file_manager, tmp_path, f'policy_{index}.md',
+                      f"# Giriş\n\nMəsul şəxs: {name}.\n\n# Qaydalar\n\n{BODY}\n")
+               for index, name in enumerate(names)]
+    file_ids = [result['file_id'] for result in results]
+
+    for search in (file_manager.search_files, file_manager.fallback_search):
+        hits = search('kadrlar')
+        assert len(hits) == 1
+        assert hits[0]['section_path'] == 'Qaydalar'
+        assert {hits[0]['file_id'], *hits[0]['duplicate_files']} == set(file_ids)
+    # Text only one file has is still found in that file
+    assert found(file_manager.search_files('Rəşad')) == {file_ids[2]}
+    assert found(file_manager.search_files('Leyla')) == {file_ids[1]}
+
+
+def test_search_results_point_at_the_matching_chunk(file_manager, tmp_path):
+    result = upload(file_manager, tmp_path, 'sections.md', "# Giriş\n\nalpha mətn.\n\n# Məzuniyyət\n\nbravo mətn.\n")
+
+    hits = file_manager.search_files('bravo')
+    assert [(hit['file_id'], hit['section_path']) for hit in hits] == [(result['file_id'], 'Məzuniyyət')]
+    chunk = file_manager.get_file_content(result['file_id'], hits[0]['chunk_index'])
+    assert 'bravo' in chunk['content']
+
+
+def test_search_index_is_rebuilt_with_reference_chunks(file_manager, tmp_path):
+    upload(file_manager, tmp_path, 'first.md', document("Anar Məmmədov"))
+    second = upload(file_manager, tmp_path, 'second.md', document("Leyla Hüseynova"))
+
+    # An index written before reference chunks had search rows of their own
+    conn = sqlite3.connect(file_manager.db_path)
+    conn.execute('''
+                 DELETE FROM file_search
+                 WHERE chunk_id IN (SELECT id FROM chunks WHERE duplicate_of IS NOT NULL)
+                 ''')
+    conn.execute('PRAGMA user_version = 0')
+    conn.commit()
+    conn.close()
+    assert file_manager.search_files('Leyla') == []
+
+    reopened = FileManager(str(tmp_path / 'documents'), file_manager.db_path, cache_dir='', sandbox=False)
+    assert found(reopened.search_files('Leyla')) == {second['file_id']}
+
+
+def assert_consistent(file_manager):
+    """No chunk, search row or reference points at something that is gone"""
+    assert query(file_manager, '''
+                 SELECT c.id FROM chunks c LEFT JOIN chunks o ON o.id = c.duplicate_of
+                 WHERE c.duplicate_of IS NOT NULL AND (o.id IS NULL OR o.duplicate_of IS NOT NULL)
+                 ''') == []
+    assert query(file_manager, 'SELECT id FROM chunks WHERE file_id NOT IN (SELECT id FROM files)') == []
+    assert query(file_manager, 'SELECT chunk_id FROM file_search WHERE chunk_id NOT IN (SELECT id FROM chunks)') == []
+    assert query(file_manager, 'SELECT chunk_id FROM chunk_bands WHERE chunk_id NOT IN (SELECT id FROM chunks)') == []
+    assert query(file_manager, '''
+                 SELECT id FROM files WHERE duplicate_of IS NOT NULL AND duplicate_of NOT IN (SELECT id FROM files)
+                 ''') == []
+
+
+@pytest.mark.parametrize('original, text', [
+    ("alpha beta gamma", "alpha beta gamma"),
+    ("alpha beta gamma", "alpha beta delta gamma"),
+    ("alpha beta gamma", "alpha gamma"),
+    ("alpha beta gamma", "Leyla Hüseynova beta gamma\n"),
+    ("alpha  beta\n\ngamma ", "alpha beta gamma"),
+    ("alpha beta gamma", ""),
+    ("", "yeni mətn"),
+])
+def test_chunk_delta_round_trip(original, text):
+    delta = FileManager.encode_chunk_delta(original, text)
+    assert (delta is None) == (original == text)
+    assert FileManager.apply_chunk_delta(original, delta) == text
+
+
+def test_new_version_reuses_unchanged_chunks(file_manager, tmp_path):
+    sections = ["# Giriş\n\nalpha mətn burada.\n", "# Qaydalar\n\nbravo mətn burada.\n",
+                "# Əlaqə\n\ncharlie mətn burada.\n"]
+    first = upload(file_manager, tmp_path, 'rules.md', "\n".join(sections))
+    sections[1] = "# Qaydalar\n\ndelta mətn burada.\n"
+    second = upload(file_manager, tmp_path, 'rules_v2.md', "\n".join(sections), document_id=first['file_id'])
+
+    assert (second['file_id'], second['version'], second['reused_chunks']) == (first['file_id'], 2, 2)
+    versions = file_manager.list_versions(first['file_id'])
+    assert [(version['version'], version['current']) for version in versions] == [(2, True), (1, False)]
+
+    current = file_manager.get_file_content(first['file_id'])['content']
+    previous = file_manager.get_file_content(versions[1]['file_id'])['content']
+    assert 'delta' in current and 'bravo' not in current
+    assert 'bravo' in previous and 'delta' not in previous and 'charlie' in previous
+    # Retired chunks leave the search index; only the current text is found
+    assert file_manager.search_files('bravo') == []
+    assert found(file_manager.search_files('delta')) == {first['file_id']}
+    assert found(file_manager.search_files('charlie')) == {first['file_id']}
+    assert_consistent(file_manager)
+
+    file_manager.delete_file(first['file_id'])
+    assert query(file_manager, 'SELECT COUNT(*) FROM chunks')[0][0] == 0
+    assert query(file_manager, 'SELECT COUNT(*) FROM files')[0][0] == 0
+    assert_consistent(file_manager)
+
+
+def test_delete_hands_chunks_to_near_duplicate(file_manager, tmp_path):
+    first = upload(file_manager, tmp_path, 'first.md', document("Anar Məmmədov"))
+    second = upload(file_manager, tmp_path, 'second.md', document("Leyla Hüseynova"))
+    text = file_manager.get_file_content(second['file_id'])['content']
+
+    assert file_manager.delete_file(first['file_id'])
+    assert file_manager.get_file_content(second['file_id'])['content'] == text
+    assert query(file_manager, 'SELECT COUNT(*) FROM chunks WHERE duplicate_of IS NOT NULL')[0][0] == 0
+    assert found(file_manager.search_files('kadrlar')) == {second['file_id']}
+    assert file_manager.search_files('Anar') == []
+    assert_consistent(file_manager)
+
+
+def test_versions_and_deletes_leave_no_dangling_references(file_manager, tmp_path):
+    first = upload(file_manager, tmp_path, 'first.md', document("Anar Məmmədov"))
+    second = upload(file_manager, tmp_path, 'second.md', document("Leyla Hüseynova"))
+    second_text = file_manager.get_file_content(second['file_id'])['content']
+
+    # The chunk the second document references is retired by the new version
+    upload(file_manager, tmp_path, 'first_v2.md', "# Təyinat\n\nTamamilə yeni mətn.\n", document_id=first['file_id'])
+    assert_consistent(file_manager)
+    # ...so the second document's chunk now holds the text and the old version references it
+    assert query(file_manager, 'SELECT COUNT(*) FROM chunks WHERE file_id = ? AND duplicate_of IS NULL',
+                 (second['file_id'],))[0][0] > 0
+    assert file_manager.get_file_content(second['file_id'])['content'] == second_text
+    previous = file_manager.list_versions(first['file_id'])[1]['file_id']
+    assert 'Anar Məmmədov' in file_manager.get_file_content(previous)['content']
+
+    file_manager.delete_file(second['file_id'])
+    assert_consistent(file_manager)
+    assert 'Anar Məmmədov' in file_manager.get_file_content(previous)['content']
+
+    file_manager.delete_file(first['file_id'])
+    assert_consistent(file_manager)
+    for table in ('files', 'chunks', 'file_search', 'chunk_bands'):
+        assert query(file_manager, f'SELECT COUNT(*) FROM {table}')[0][0] == 0
+
+
+def test_spooled_chunks_are_written(file_manager, tmp_path, monkeypatch):
+    # Spill every document's chunks to disk
+    monkeypatch.setattr(RecordSpool, 'MAX_MEMORY', 64)
+    sections = [f"# Bölmə {index}\n\n{BODY}\n" for index in range(5)]
+    result = upload(file_manager, tmp_path, 'large.md', "\n".join(sections))
+
+    assert result['chunks'] >= 5
+    assert file_manager.get_file_content(result['file_id'])['content'].count('Bölmə') == 5
+
+
+def test_failed_write_removes_stored_copy(file_manager, tmp_path, monkeypatch):
+    def fail(cursor, payload):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(file_manager, 'write_upload', fail)
+    path = tmp_path / 'lost.md'
+    path.write_text(document("Anar Məmmədov"), encoding='utf-8')
+
+    result = file_manager.upload_file(str(path))
+    assert not result['success'] and 'disk I/O error' in result['error']
+    assert list((tmp_path / 'documents').iterdir()) == []
+
+
+def test_interrupted_ingestion_drops_queued_files(file_manager, tmp_path):
+    sources = []
+    for number in range(20):
+        path = tmp_path / f"source_{number}.md"
+        path.write_text(f"# Sənəd {number}\n\nmətn {number}\n", encoding='utf-8')
+        sources.append(path)
+
+    def interrupt() -> bool:
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        file_manager.ingest_files(sources, workers=2, stop=interrupt)
+
+    # Files already handed to the writer are indexed; the others left nothing in storage
+    stored = {str(path) for path in (tmp_path / 'documents').iterdir()}
+    indexed = {row[0] for row in query(file_manager, 'SELECT file_path FROM files')}
+    assert stored == indexed
+    assert 0 < len(indexed) < len(sources)
+
+
+def test_extraction_worker_does_not_open_the_index(file_manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(DocumentProcessor, 'pdf_workers', DocumentProcessor.pdf_workers)
+    config = file_manager.worker_config()
+    config['db_path'] = str(tmp_path / 'worker.db')
+    file_manager_module._init_ingest_worker(config)
+    path = tmp_path / 'worker.md'
+    path.write_text("# Giriş\n\nalpha mətn.\n", encoding='utf-8')
+
+    chunks = list(file_manager_module._extract_chunks_in_worker(str(path), 'markdown', None, 'document'))
+    assert 'alpha' in chunks[0]['content']
+    assert not (tmp_path / 'worker.db').exists()
+
+
+def test_failed_extraction_is_not_cached(tmp_path, monkeypatch):
+    cache_dir = tmp_path / 'cache'
+    file_manager = FileManager(str(tmp_path / 'documents'), str(tmp_path / 'index.db'), cache_dir=str(cache_dir),
+                               sandbox=False)
+    extract = DocumentProcessor.iter_text_from_html
+
+    def damaged(file_path):
+        # Fails once the text before the damage was read
+        yield from extract(file_path)
+        raise ValueError('damaged file')
+
+    monkeypatch.setattr(file_manager.processor, 'iter_text_from_html', damaged)
+    result = upload(file_manager, tmp_path, 'damaged.html', '<h1>Başlıq</h1><p>oxunan mətn</p>')
+    assert 'oxunan' in file_manager.get_file_content(result['file_id'])['content']
+    assert list(cache_dir.rglob('*.gz')) == [] and list(cache_dir.rglob('*.tmp')) == []
+
+    monkeypatch.undo()
+    upload(file_manager, tmp_path, 'intact.html', '<p>tam mətn</p>')
+    assert len(list(cache_dir.rglob('*.gz'))) == 1
+
+
+def test_cache_is_scanned_only_when_it_outgrows_its_limit(tmp_path, monkeypatch):
+    cache = ExtractionCache(str(tmp_path / 'cache'), max_bytes=2000)
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, 'evict', lambda: scans.append(1) or evict())
+
+    for number in range(40):
+        text = " ".join(random.Random(number).choice(WORDS) for _ in range(40))
+        assert "".join(cache.store(f"hash{number}", 'text', 1, [text])) == text
+    sizes = sum(path.stat().st_size for path in (tmp_path / 'cache').rglob('*.gz'))
+    assert sizes <= 2000
+    assert 1 < len(scans) < 40
+
+
+def test_spreadsheet_rows_are_served_from_the_cache(tmp_path, monkeypatch):
+    file_manager = FileManager(str(tmp_path / 'documents'), str(tmp_path / 'index.db'),
+                               cache_dir=str(tmp_path / 'cache'), sandbox=False)
+    workbook = openpyxl.Workbook()
+    workbook.active.append(['Layihə', 'Büdcə', 'Başlama'])
+    workbook.active.append(['Məktəb', 1500, datetime(2024, 3, 1)])
+    workbook.active.append(['Xəstəxana', 2750.5, datetime(2024, 5, 20, 9, 30)])
+    path = tmp_path / 'layihələr.xlsx'
+    workbook.save(path)
+
+    def rows(file_id):
+        result = file_manager.query_spreadsheet_rows({'Büdcə': {'gte': 1000}}, file_id=file_id)
+        return [row['cells'] for row in result['rows']]
+
+    first = file_manager.upload_file(str(path))
+    expected = [{'Layihə': 'Məktəb', 'Büdcə': 1500, 'Başlama': '2024-03-01'},
+                {'Layihə': 'Xəstəxana', 'Büdcə': 2750.5, 'Başlama': '2024-05-20T09:30:00'}]
+    assert rows(first['file_id']) == expected
+
+    # The same content again: rows come from the cache without opening the workbook
+    def unavailable(*args, **kwargs):
+        raise AssertionError('workbook parsed again')
+
+    monkeypatch.setattr(DocumentProcessor, 'iter_rows_from_excel', unavailable)
+    second = file_manager.upload_file(str(path))
+    assert second['file_id'] != first['file_id'] and rows(second['file_id']) == expected
+
+
+def json_lines(tmp_path, text: str) -> list:
+    """Lines extracted from a JSON file with the given text"""
+    path = tmp_path / 'data.json'
+    path.write_text(text, encoding='utf-8')
+    return "".join(DocumentProcessor.iter_text_from_json(str(path))).splitlines()
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('{"a": 1, "b": tru', ['a: 1']),
+    ('[1, 2,, 3, NaN, 4]', ['1', '2', '3', '4']),
+    ('{"ad": "Nazirlik", "status": undefined, "say": 2}', ['ad: Nazirlik', 'say: 2']),
+    ('{"ad": "bağlanmayan', []),
+    ('tamamilə mətn', []),
+])
+def test_malformed_json_is_skipped(tmp_path, text, expected):
+    assert json_lines(tmp_path, text) == expected
+
+
+def test_json_output_does_not_depend_on_block_size(tmp_path, monkeypatch):
+    records = [{"ad": f"işçi {index}", "say": index * 1.5, "aktiv": index % 2 == 0, "qeyd": None,
+                "etiketlər": ["kadr", 'sənəd "\\'], "cəmi": "-20e3"} for index in range(20)]
+    text = json.dumps({"records": records}, ensure_ascii=False).replace('"-20e3"', '-20e3')
+    expected = json_lines(tmp_path, text)
+    assert len(expected) == 20 * 6 and expected[-1] == 'records.cəmi: -20e3'
+
+    for block_size, max_buffered in ((1, 100), (3, 100), (7, 1024 * 1024)):
+        monkeypatch.setattr(DocumentProcessor, 'READ_BLOCK_SIZE', block_size)
+        monkeypatch.setattr(DocumentProcessor, 'JSON_MAX_BUFFERED', max_buffered)
+        assert json_lines(tmp_path, text) == expected
+
+
+def test_malformed_json_buffer_stays_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(DocumentProcessor, 'READ_BLOCK_SIZE', 16)
+    monkeypatch.setattr(DocumentProcessor, 'JSON_MAX_BUFFERED', 64)
+    # A bad token that never ends, then valid text the extractor must still reach
+    text = '{"a": ' + 'x' * 10000 + ', "b": "sonra"}'
+    assert json_lines(tmp_path, text)[-1:] == ['b: sonra']
+
+
+def test_pdf_range_processes_share_the_memory_budget(monkeypatch):
+    megabyte = 1024 * 1024
+    monkeypatch.setattr('file_manager._address_space_size', lambda: 200 * megabyte)
+    monkeypatch.setattr(DocumentProcessor, 'PDF_RANGE_MIN_MEMORY', 128 * megabyte)
+
+    monkeypatch.setattr(DocumentProcessor, 'pdf_memory_limit', None)
+    assert DocumentProcessor.pdf_range_budget(4) == (4, None)
+    monkeypatch.setattr(DocumentProcessor, 'pdf_memory_limit', 1200 * megabyte)
+    workers, share = DocumentProcessor.pdf_range_budget(4)
+    assert workers == 4 and (workers + 1) * share <= 1000 * megabyte
+    # Shares below the minimum mean fewer range processes, or none at all
+    assert DocumentProcessor.pdf_range_budget(16)[0] == 6
+    monkeypatch.setattr(DocumentProcessor, 'pdf_memory_limit', 400 * megabyte)
+    assert DocumentProcessor.pdf_range_budget(4) == (0, None)
+
+
+def test_heading_starts_a_new_chunk():
+    text = f"{HEADING_MARK}Giriş\nalpha mətn.\n{HEADING_MARK}Qaydalar\nbravo mətn.\n"
+    chunks = SectionChunker(512).chunk_text(text, 'document')
+
+    assert [(chunk['content'], chunk['section_path']) for chunk in chunks] == [
+        ("Giriş\nalpha mətn.", 'Giriş'), ("Qaydalar\nbravo mətn.", 'Qaydalar')
+    ]
+
+
+def sentences(count: int, word: str) -> str:
+    """``count`` sentences of four words and a full stop, five tokens each"""
+    return " ".join(f"{word} {number} mətn burada." for number in range(count))
+
+
+def test_budget_cut_falls_on_a_paragraph_end():
+    paragraphs = [sentences(2, 'alpha'), sentences(2, 'bravo'), sentences(2, 'charlie')]
+    text = "\n\n".join(paragraphs) + "\n"
+    chunks = SectionChunker(16).chunk_text(text, 'document')
+
+    assert [chunk['content'] for chunk in chunks] == paragraphs
+    for chunk in chunks:
+        assert text[chunk['start_offset']:chunk['end_offset']] == chunk['content']
+
+
+def test_budget_cut_falls_on_a_sentence_end():
+    chunker = SectionChunker(12)
+    chunks = chunker.chunk_text(sentences(7, 'alpha') + "\n", 'document')
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk['content'].endswith('burada.')
+        assert len(chunker.TOKEN.findall(chunk['content'])) <= 12
+
+
+def docx_document(path, blocks) -> str:
+    """Write a DOCX file of ``(heading level, text)`` paragraphs; level 0 is body text"""
+    document = docx.Document()
+    for level, text in blocks:
+        if level:
+            document.add_heading(text, level)
+        else:
+            document.add_paragraph(text)
+    document.save(str(path))
+    return str(path)
+
+
+@pytest.mark.parametrize('filename, file_type, content', [
+    ('atx.md', 'markdown', "# Bölmə 1\n\nGiriş mətni.\n\n## 1.1 Qaydalar\n\nalpha mətn.\n"),
+    ('setext.md', 'markdown', "Bölmə 1\n=======\n\nGiriş mətni.\n\n1.1 Qaydalar\n------------\n\nalpha mətn.\n"),
+    ('page.html', 'html', "<h1>Bölmə 1</h1><p>Giriş mətni.</p><h2>1.1 Qaydalar</h2><p>alpha mətn.</p>"),
+    ('policy.docx', 'docx', None),
+])
+def test_section_path_holds_nested_headings(tmp_path, filename, file_type, content):
+    path = tmp_path / filename
+    if content is None:
+        docx_document(path, [(1, "Bölmə 1"), (0, "Giriş mətni."), (2, "1.1 Qaydalar"), (0, "alpha mətn.")])
+    else:
+        path.write_text(content, encoding='utf-8')
+    extract = {'markdown': DocumentProcessor.iter_text_from_md, 'html': DocumentProcessor.iter_text_from_html,
+               'docx': DocumentProcessor.iter_text_from_docx}[file_type]
+
+    chunks = list(SectionChunker(512).iter_chunks(extract(str(path)), 'document'))
+    paths = {chunk['section_path'] for chunk in chunks if 'alpha' in chunk['content']}
+    assert paths == {'Bölmə 1 > 1.1 Qaydalar'}
+    assert chunks[0]['section_path'] == 'Bölmə 1'
+
+
+def test_bulk_upload_indexes_every_file(file_manager, tmp_path):
+    source = tmp_path / 'source'
+    (source / 'nested').mkdir(parents=True)
+    for number in range(6):
+        folder = source / 'nested' if number % 2 else source
+        (folder / f"sənəd_{number}.md").write_text(f"# Sənəd {number}\n\nkod{number} mətn.\n", encoding='utf-8')
+    (source / 'notes.bin').write_bytes(b"unsupported")
+
+    result = file_manager.bulk_upload(str(source), category='hr', workers=3, batch_size=2)
+
+    assert (result['total_processed'], result['successful'], result['failed']) == (6, 6, 0)
+    assert result['throughput']['workers'] == 3
+    assert query(file_manager, "SELECT COUNT(*) FROM files WHERE processed AND category = 'hr'")[0][0] == 6
+    for number in range(6):
+        assert len(file_manager.search_files(f"kod{number}")) == 1
+    assert len(list((tmp_path / 'documents').iterdir())) == 6
+
+
+def pdf_document(path, pages) -> str:
+    """Write a PDF with one line of Helvetica text per page"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode('latin-1')
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(data)
+    data += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    data += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    data += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_pdf_text_is_streamed_page_by_page(file_manager, tmp_path):
+    path = pdf_document(tmp_path / 'handbook.pdf', ["alpha page one", "bravo page two", "charlie page three"])
+
+    pieces = DocumentProcessor.iter_text_from_pdf(path, workers=1)
+    assert next(pieces) == "alpha page one\n"
+    assert list(pieces) == ["bravo page two\n", "charlie page three\n"]
+
+    result = file_manager.upload_file(path)
+    assert result['success'], result
+    assert found(file_manager.search_files('charlie')) == {result['file_id']}
+    assert 'alpha page one\nbravo page two' in file_manager.get_file_content(result['file_id'])['content']
+
+
+def test_word_chunks_are_offset_slices_independent_of_piece_size():
+    text = " ".join(f"söz{number}" for number in range(35)) + "\n"
+    chunker = DocumentChunker(max_chunk_size=10, overlap_size=3)
+    chunks = chunker.chunk_text(text, 'document')
+
+    assert len(chunks) == 5
+    for chunk in chunks:
+        assert text[chunk['start_offset']:chunk['end_offset']] == chunk['content']
+        assert len(chunk['content'].split()) <= 10
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous['content'].split()[-3:] == chunk['content'].split()[:3]
+
+    # Pieces cut anywhere, even inside a word, give the same chunks
+    for size in (1, 4, 7):
+        pieces = [text[start:start + size] for start in range(0, len(text), size)]
+        assert list(chunker.iter_chunks(pieces, 'document')) == [
+            {key: value for key, value in chunk.items() if key != 'total_chunks'} for chunk in chunks
+        ]
+
+
+class ReadOnlySource:
+    """A binary stream with ``read`` but no ``readinto``, like some upload wrappers"""
+
+    def __init__(self, data: bytes, fail_after: int = None):
+        self.stream = io.BytesIO(data)
+        self.fail_after = fail_after
+
+    def read(self, size: int) -> bytes:
+        if self.fail_after is not None and self.stream.tell() >= self.fail_after:
+            raise ConnectionResetError('client went away')
+        return self.stream.read(size)
+
+
+@pytest.mark.parametrize('make_source', [io.BytesIO, ReadOnlySource])
+def test_upload_is_hashed_while_it_is_copied(file_manager, tmp_path, monkeypatch, make_source):
+    monkeypatch.setattr(FileManager, 'COPY_BUFFER_SIZE', 1000)
+    data = ("# Hesabat\n\n" + BODY + "\n").encode('utf-8') * 3
+
+    result = file_manager.upload_stream(make_source(data), 'hesabat.md')
+    assert result['success'], result
+    stored, content_hash, file_size = query(file_manager, 'SELECT file_path, content_hash, file_size FROM files')[0]
+    assert (content_hash, file_size) == (hashlib.md5(data).hexdigest(), len(data))
+    with open(stored, 'rb') as copy:
+        assert copy.read() == data
+    assert file_manager.calculate_file_hash(stored) == content_hash
+
+
+def test_interrupted_copy_leaves_no_partial_file(file_manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(FileManager, 'COPY_BUFFER_SIZE', 1000)
+    destination = tmp_path / 'documents' / 'copy.md'
+
+    with pytest.raises(ConnectionResetError):
+        file_manager.copy_and_hash(ReadOnlySource(b"x" * 5000, fail_after=2000), destination)
+    assert list((tmp_path / 'documents').iterdir()) == []
+
+
+def test_sync_counts_added_updated_removed_and_unchanged(file_manager, tmp_path):
+    source = tmp_path / 'source'
+    source.mkdir()
+    for name in ('a', 'b', 'c', 'd'):
+        (source / f"{name}.md").write_text(f"# {name}\n\nilk{name} mətn.\n", encoding='utf-8')
+
+    first = file_manager.sync_directory(str(source), workers=2)
+    assert (first['added'], first['updated'], first['removed'], first['unchanged']) == (4, 0, 0, 0)
+
+    (source / 'a.md').write_text("# a\n\nyenilənmiş mətn burada.\n", encoding='utf-8')
+    os.utime(source / 'a.md', (1_000_000_000, 1_000_000_000))
+    (source / 'b.md').unlink()
+    os.utime(source / 'c.md', (1_000_000_000, 1_000_000_000))  # touched, same content
+    (source / 'e.md').write_text("# e\n\nilke mətn.\n", encoding='utf-8')
+
+    second = file_manager.sync_directory(str(source), workers=2)
+    assert (second['added'], second['updated'], second['removed'], second['unchanged']) == (1, 1, 1, 2)
+    assert second['successful'] == 2
+    assert file_manager.search_files('ilka') == []
+    assert len(file_manager.search_files('yenilənmiş')) == 1
+    assert file_manager.search_files('ilkb') == []
+    assert len(file_manager.search_files('ilke')) == 1
+
+    third = file_manager.sync_directory(str(source), workers=2)
+    assert (third['added'], third['updated'], third['removed'], third['unchanged']) == (0, 0, 0, 4)
+    assert third['total_processed'] == 0
+
+
+def test_excel_sheets_are_streamed_as_separate_sections(file_manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(DocumentProcessor, 'EXCEL_ROW_BATCH', 2)
+    workbook = openpyxl.Workbook()
+    workbook.active.title = 'Kadrlar'
+    for number in range(5):
+        workbook.active.append([f"işçi{number}", number])
+    workbook.create_sheet('Büdcə').append(['xərc', 1200])
+    path = tmp_path / 'hesabat.xlsx'
+    workbook.save(path)
+
+    pieces = list(DocumentProcessor.iter_text_from_excel(str(path)))
+    assert pieces.count(SECTION_BREAK) == 1
+    assert pieces[:4] == [f"{HEADING_MARK}Sheet: Kadrlar\n", "işçi0 | 0\nişçi1 | 1\n", "işçi2 | 2\nişçi3 | 3\n",
+                          "işçi4 | 4\n"]
+    truncated = "".join(DocumentProcessor.iter_text_from_excel(str(path), max_rows=2))
+    assert 'işçi1' in truncated and 'işçi2' not in truncated and 'xərc' in truncated
+
+    result = file_manager.upload_file(str(path))
+    assert result['success'], result
+    chunks = query(file_manager, 'SELECT content, section_path FROM chunks WHERE file_id = ? ORDER BY chunk_index',
+                   (result['file_id'],))
+    assert [section for _, section in chunks] == ['Sheet: Kadrlar', 'Sheet: Büdcə']
+    assert 'xərc' not in chunks[0][0] and 'işçi' not in chunks[1][0]
+
+
+def test_docx_tables_are_extracted_in_document_order(file_manager, tmp_path):
+    document = docx.Document()
+    document.add_paragraph("Giriş mətni.")
+    table = document.add_table(rows=4, cols=2)
+    table.cell(0, 0).text, table.cell(0, 1).text = 'Ad', 'Vəzifə'
+    table.cell(1, 0).text, table.cell(1, 1).text = 'Anar', 'Mühəndis'
+    table.cell(1, 1).add_paragraph('baş')
+    nested = table.cell(2, 0).add_table(rows=1, cols=2)
+    nested.cell(0, 0).text, nested.cell(0, 1).text = 'daxili', 'cədvəl'
+    document.add_paragraph("Son mətn.")
+    path = tmp_path / 'kadrlar.docx'
+    document.save(str(path))
+
+    # Cells are joined like spreadsheet rows, empty rows are dropped and
+    # a nested table's row stays in its cell
+    text = "".join(DocumentProcessor.iter_text_from_docx(str(path)))
+    assert text.splitlines() == ["Giriş mətni.", "Ad | Vəzifə", "Anar | Mühəndis baş", "daxili | cədvəl | ",
+                                 "Son mətn."]
+
+    result = file_manager.upload_file(str(path))
+    assert result['success'], result
+    assert found(file_manager.search_files('Anar')) == {result['file_id']}
+
+
+MARKDOWN_POLICY = """# Məzuniyyət *qaydaları*
+
+İllik məzuniyyət **30 gün** təşkil edir; [ərizə formu](https://example.az/forma) doldurulur.
+
+## Ərizə   ##
+
+- Rəhbərə təqdim edilir.
+- Kadrlar şöbəsi təsdiq edir.
+
+```
+kod_bloku = 1
+```
+"""
+
+HTML_POLICY = """<html><head><title>Siyasət</title><style>p { color: red; }</style></head><body>
+<h1>Məzuniyyət <em>qaydaları</em></h1>
+<p>İllik məzuniyyət <strong>30 gün</strong> təşkil edir; <a href="https://example.az/forma">ərizə formu</a> doldurulur.</p>
+<script>var gizli = 1;</script>
+<h2>
+  Ərizə
+</h2>
+<ul><li>Rəhbərə təqdim edilir.</li><li>Kadrlar şöbəsi təsdiq edir.</li></ul>
+<pre>kod_bloku = 1</pre>
+</body></html>
+"""
+
+
+def test_markdown_and_html_headings_match(tmp_path, monkeypatch):
+    # Small read blocks split the HTML headings between parser feeds
+    monkeypatch.setattr(DocumentProcessor, 'READ_BLOCK_SIZE', 7)
+    markdown_path = tmp_path / 'policy.md'
+    markdown_path.write_text(MARKDOWN_POLICY, encoding='utf-8')
+    html_path = tmp_path / 'policy.html'
+    html_path.write_text(HTML_POLICY, encoding='utf-8')
+
+    markdown_text = "".join(DocumentProcessor.iter_text_from_md(str(markdown_path)))
+    html_text = "".join(DocumentProcessor.iter_text_from_html(str(html_path)))
+
+    def headings(text: str) -> list:
+        return [line for line in text.split("\n") if line.startswith(HEADING_MARK)]
+
+    assert headings(markdown_text) == headings(html_text) == [
+        f"{HEADING_MARK}Məzuniyyət qaydaları", f"{HEADING_MARK * 2}Ərizə"
+    ]
+    # The HTML title is body text there; otherwise both carry the same words
+    html_words = html_text.replace(HEADING_MARK, '').split()
+    assert html_words[0] == 'Siyasət'
+    assert markdown_text.replace(HEADING_MARK, '').split() == html_words[1:]
+    assert 'gizli' not in html_text and 'color' not in html_text
+
+    chunker = SectionChunker(512)
+    assert [chunk['section_path'] for chunk in chunker.chunk_text(markdown_text, 'md')] == \
+        [chunk['section_path'] for chunk in chunker.chunk_text(html_text, 'html')][-2:]
+
+
+AZERBAIJANI_LATIN = "Çoxlu işçi öz günü üçün İş saatı ağır.\r\nŞuşa, Ağdam.\n"
+RUSSIAN = "Отдел кадров утверждает заявление.\n"
+
+
+@pytest.mark.parametrize('text, encoding, bom', [
+    (AZERBAIJANI_LATIN, 'utf-8', b''),
+    (AZERBAIJANI_LATIN, 'utf-8', codecs.BOM_UTF8),
+    (AZERBAIJANI_LATIN, 'cp1254', b''),
+    (RUSSIAN, 'cp1251', b''),
+    (AZERBAIJANI_LATIN, 'utf-16-le', codecs.BOM_UTF16_LE),
+    (AZERBAIJANI_LATIN, 'utf-16-be', codecs.BOM_UTF16_BE),
+    ("Plain policy text, version 2.\n", 'utf-16-le', b''),
+    ("Plain policy text, version 2.\n", 'utf-16-be', b''),
+])
+def test_text_encoding_is_detected(tmp_path, text, encoding, bom):
+    path = tmp_path / 'qeyd.txt'
+    path.write_bytes(bom + text.encode(encoding))
+
+    assert DocumentProcessor.extract_text_from_txt(str(path)) == text.replace("\r\n", "\n")
+
+
+def test_utf8_character_cut_by_the_sample_is_not_misdetected(tmp_path, monkeypatch):
+    # The sample ends inside the two bytes of "ğ"
+    monkeypatch.setattr(DocumentProcessor, 'ENCODING_SAMPLE_SIZE', 3)
+    path = tmp_path / 'qeyd.txt'
+    path.write_bytes("ağır iş günü\n".encode('utf-8'))
+
+    assert DocumentProcessor.detect_encoding(path.read_bytes()[:3]) == 'utf-8'
+    assert DocumentProcessor.extract_text_from_txt(str(path)) == "ağır iş günü\n"
+
+
+def zip_archive(path, members: dict) -> str:
+    """Write a ZIP archive of ``{name: text}`` members"""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, text in members.items():
+            archive.writestr(name, text)
+    return str(path)
+
+
+def test_archive_members_are_ingested(file_manager, tmp_path):
+    path = zip_archive(tmp_path / 'siyasətlər.zip', {
+        'kadrlar/məzuniyyət.md': "# Məzuniyyət\n\nalpha mətn.\n",
+        'qaydalar.txt': "bravo mətn.\n",
+        'şəkil.png': "not indexed",
+    })
+
+    result = file_manager.upload_archive(path, category='hr')
+    assert (result['success'], result['successful'], result['failed']) == (True, 2, 0)
+    assert result['skipped'] == [{'file': 'şəkil.png', 'reason': 'unsupported file type'}]
+    assert sorted(row[0] for row in query(file_manager, 'SELECT original_name FROM files')) == [
+        'siyasətlər.zip/kadrlar/məzuniyyət.md', 'siyasətlər.zip/qaydalar.txt'
+    ]
+    assert len(file_manager.search_files('bravo')) == 1
+
+
+@pytest.mark.parametrize('limit, value, members, error', [
+    ('ARCHIVE_MAX_MEMBERS', '2', {'a.txt': "a", 'b.txt': "b", 'c.txt': "c"}, "has 3 files, the limit is 2"),
+    ('ARCHIVE_MAX_UNCOMPRESSED_MB', '1', {'a.txt': "a" * (1024 * 1024), 'b.txt': "b"}, "the limit is 1 MB"),
+])
+def test_archive_over_its_limits_is_rejected(file_manager, tmp_path, monkeypatch, limit, value, members, error):
+    monkeypatch.setenv(limit, value)
+    path = zip_archive(tmp_path / 'böyük.zip', members)
+
+    result = file_manager.upload_archive(path)
+    assert not result['success'] and error in result['error']
+    # Rejected before any member is stored
+    assert list((tmp_path / 'documents').iterdir()) == []
+    assert query(file_manager, 'SELECT COUNT(*) FROM files')[0][0] == 0
+
+
+def test_invalid_archive_is_reported(file_manager, tmp_path):
+    path = tmp_path / 'pozuq.zip'
+    path.write_bytes(b"not a zip archive")
+
+    result = file_manager.upload_archive(str(path))
+    assert not result['success'] and result['error'].startswith("Invalid ZIP archive pozuq.zip")
+
+
+def finished_job(jobs: IngestJobQueue, job_id: str, timeout: float = 10) -> dict:
+    """Wait for an ingest job to finish and return it"""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = jobs.get_job(job_id)
+        if job['status'] in ('done', 'failed') or time.monotonic() > deadline:
+            return job
+        time.sleep(0.02)
+
+
+def test_queued_archive_members_are_indexed_as_jobs(file_manager, tmp_path):
+    jobs = IngestJobQueue(file_manager, workers=2)
+    path = zip_archive(tmp_path / 'siyasətlər.zip', {
+        'kadrlar/məzuniyyət.md': "# Məzuniyyət\n\nalpha mətn.\n",
+        'qaydalar.txt': "bravo mətn.\n",
+        'şəkil.png': "not indexed",
+    })
+
+    with open(path, 'rb') as archive:
+        result = jobs.upload_archive(archive, 'siyasətlər.zip', category='hr', user_id=7)
+    assert (result['queued'], result['successful'], result['failed']) == (True, 2, 0)
+    assert result['skipped'] == [{'file': 'şəkil.png', 'reason': 'unsupported file type'}]
+
+    for queued in result['details']['successful']:
+        job = finished_job(jobs, queued['job_id'])
+        assert (job['status'], job['user_id']) == ('done', 7)
+    assert len(file_manager.search_files('alpha')) == 1
+    assert sorted(row[0] for row in query(file_manager, 'SELECT original_name FROM files WHERE processed')) == [
+        'siyasətlər.zip/kadrlar/məzuniyyət.md', 'siyasətlər.zip/qaydalar.txt'
+    ]
+
+
+def test_queued_archive_over_its_limits_is_rejected(file_manager, tmp_path, monkeypatch):
+    monkeypatch.setenv('ARCHIVE_MAX_MEMBERS', '1')
+    jobs = IngestJobQueue(file_manager, workers=1)
+    path = zip_archive(tmp_path / 'böyük.zip', {'a.txt': "a", 'b.txt': "b"})
+
+    result = jobs.upload_archive(path, 'böyük.zip')
+    assert not result['success'] and 'the limit is 1' in result['error']
+    assert query(file_manager, 'SELECT COUNT(*) FROM ingest_jobs')[0][0] == 0
+
+
+def test_resumable_archive_upload_is_queued(file_manager, tmp_path):
+    jobs = IngestJobQueue(file_manager, workers=2)
+    sessions = UploadSessionManager(file_manager, str(tmp_path / 'incoming'), job_queue=jobs)
+    zip_archive(tmp_path / 'arxiv.zip', {'a.md': "# A\n\nalpha mətn.\n", 'b.txt': "bravo\n"})
+    data = (tmp_path / 'arxiv.zip').read_bytes()
+    upload_id = sessions.create_session('arxiv.zip', len(data), user_id=3)['upload_id']
+    assert sessions.append(upload_id, 0, io.BytesIO(data))['complete']
+
+    result = sessions.finalize(upload_id)
+    assert (result['queued'], result['successful'], result['archive']) == (True, 2, 'arxiv.zip')
+    for queued in result['details']['successful']:
+        assert finished_job(jobs, queued['job_id'])['status'] == 'done'
+    assert len(file_manager.search_files('bravo')) == 1
+    assert sessions.get_session(upload_id)['status'] == 'completed'
+
+
+def test_resumable_upload_rejects_a_wrong_offset_and_overflow(file_manager, tmp_path):
+    sessions = UploadSessionManager(file_manager, str(tmp_path / 'incoming'))
+    upload_id = sessions.create_session('qeyd.txt', 10)['upload_id']
+
+    assert sessions.append(upload_id, 0, io.BytesIO(b"0123"))['offset'] == 4
+    mismatch = sessions.append(upload_id, 0, io.BytesIO(b"0123"))
+    assert (mismatch['success'], mismatch['offset_mismatch'], mismatch['offset']) == (False, True, 4)
+    assert sessions.part_path(upload_id).stat().st_size == 4
+
+    incomplete = sessions.finalize(upload_id)
+    assert (incomplete['success'], incomplete['incomplete'], incomplete['offset']) == (False, True, 4)
+
+    # Bytes past the declared size are dropped and reported
+    overflow = sessions.append(upload_id, 4, io.BytesIO(b"456789EXTRA"))
+    assert (overflow['success'], overflow['offset'], overflow['complete']) == (False, 10, True)
+    assert 'declared file size' in overflow['error']
+
+    result = sessions.finalize(upload_id)
+    assert result['success'], result
+    assert query(file_manager, 'SELECT content_hash FROM files WHERE id = ?', (result['file_id'],))[0][0] == \
+        hashlib.md5(b"0123456789").hexdigest()
+    assert sessions.finalize(upload_id)['already_finalized']
+    assert not sessions.append(upload_id, 10, io.BytesIO(b"x"))['success']
+
+
+@pytest.mark.parametrize('restart', [False, True])
+def test_interrupted_upload_part_is_resumed(file_manager, tmp_path, monkeypatch, restart):
+    monkeypatch.setattr(FileManager, 'COPY_BUFFER_SIZE', 1000)
+    sessions = UploadSessionManager(file_manager, str(tmp_path / 'incoming'))
+    data = ("# Təlimat\n\n" + BODY + "\n").encode('utf-8') * 2
+    upload_id = sessions.create_session('təlimat.md', len(data), category='hr')['upload_id']
+
+    # The client breaks off after two blocks; what arrived is kept
+    with pytest.raises(ConnectionResetError):
+        sessions.append(upload_id, 0, ReadOnlySource(data, fail_after=2000))
+    assert sessions.get_session(upload_id)['offset'] == 2000
+
+    if restart:
+        # A new process rebuilds the hash from the partial file, cutting off a half-written tail
+        with open(sessions.part_path(upload_id), 'ab') as part:
+            part.write(b"half-written")
+        sessions = UploadSessionManager(file_manager, str(tmp_path / 'incoming'))
+
+    resumed = sessions.append(upload_id, 2000, io.BytesIO(data[2000:]))
+    assert (resumed['success'], resumed['offset'], resumed['complete']) == (True, len(data), True)
+
+    result = sessions.finalize(upload_id)
+    assert result['success'], result
+    stored, content_hash, category = query(file_manager, 'SELECT file_path, content_hash, category FROM files')[0]
+    assert (content_hash, category) == (hashlib.md5(data).hexdigest(), 'hr')
+    with open(stored, 'rb') as copy:
+        assert copy.read() == data
+    assert found(file_manager.search_files('kadrlar')) == {result['file_id']}
+    assert not sessions.part_path(upload_id).exists()
+
+
+def test_upload_is_queued_and_polled_until_indexed(file_manager, tmp_path):
+    jobs = IngestJobQueue(file_manager, workers=1)
+    path = tmp_path / 'təlimat.md'
+    path.write_text(document("Anar Məmmədov"), encoding='utf-8')
+
+    with open(path, 'rb') as source:
+        result = jobs.upload_stream(source, 'təlimat.md', category='hr', user_id=5)
+    assert (result['success'], result['queued'], result['status']) == (True, True, 'queued')
+    # The file is registered before the response, and listed once indexed
+    assert query(file_manager, 'SELECT COUNT(*) FROM files WHERE id = ?', (result['file_id'],))[0][0] == 1
+
+    job = finished_job(jobs, result['job_id'])
+    assert (job['status'], job['user_id'], job['file_id'], job['error']) == ('done', 5, result['file_id'], None)
+    assert job['result']['success'] and job['processing_seconds'] >= 0 and job['queued_seconds'] >= 0
+    assert found(file_manager.search_files('kadrlar')) == {result['file_id']}
+    assert jobs.get_job('unknown') is None
+
+
+def test_failed_job_drops_its_file(file_manager, tmp_path, monkeypatch):
+    jobs = IngestJobQueue(file_manager, workers=1)
+
+    def fail(payload, deduplicate=None):
+        raise sqlite3.OperationalError('disk I/O error')
+
+    monkeypatch.setattr(file_manager, 'store_upload', fail)
+    result = jobs.upload_stream(io.BytesIO(b"# Senet\n\nalpha\n"), 'senet.md')
+
+    job = finished_job(jobs, result['job_id'])
+    assert (job['status'], job['error']) == ('failed', 'disk I/O error')
+    assert query(file_manager, 'SELECT COUNT(*) FROM files')[0][0] == 0
+
+
+def test_jobs_of_a_dead_owner_are_resumed(file_manager, tmp_path, monkeypatch):
+    jobs = IngestJobQueue(file_manager, workers=1)
+    # Nothing runs, so the jobs stay as a crash would leave them
+    monkeypatch.setattr(jobs.executor, 'submit', lambda *args: None)
+    orphaned = jobs.upload_stream(io.BytesIO(b"# Yetim\n\nalpha\n"), 'yetim.md')
+    running = jobs.upload_stream(io.BytesIO(b"# Canli\n\nbravo\n"), 'canli.md')
+    queued = jobs.upload_stream(io.BytesIO(b"# Novbe\n\ncharlie\n"), 'novbe.md')
+    conn = sqlite3.connect(file_manager.db_path)
+    # No process has pid 2**22 + 1: pids stay below it on Linux
+    conn.execute("UPDATE ingest_jobs SET status = 'processing', owner = ? WHERE id = ?",
+                 (f"{process_owner().rpartition(':')[0]}:{2 ** 22 + 1}", orphaned['job_id']))
+    conn.execute("UPDATE ingest_jobs SET status = 'processing', owner = ? WHERE id = ?",
+                 (process_owner(), running['job_id']))
+    conn.commit()
+    conn.close()
+
+    restarted = IngestJobQueue(file_manager, workers=1)
+    assert finished_job(restarted, orphaned['job_id'])['status'] == 'done'
+    assert finished_job(restarted, queued['job_id'])['status'] == 'done'
+    # A live process's job is left to it
+    assert restarted.get_job(running['job_id'])['status'] == 'processing'
@@ -270,15 +270,16 @@ def show_system_capabilities():
     capabilities = {
         "Dəstəklənən Fayl Formatları": [
             "📄 PDF - PyPDF2 ilə mətn çıxarılması",
-            "📝 DOCX - python-docx ilə məzmun çıxarılması",
+            "📝 DOCX - document.xml axınla oxunur, cədvəllər daxil",
             "📊 XLSX/XLS - openpyxl ilə data çıxarılması",
             "📃 TXT - birbaşa mətn oxunması",
-            "🔤 HTML - BeautifulSoup ilə mətn çıxarılması",
-            "📋 Markdown - markdown parser ilə çevrilmə"
+            "🔤 HTML - axınlı HTMLParser ilə mətn çıxarılması",
+            "📋 Markdown - HTML-ə çevirmədən birbaşa mətn çıxarılması",
+            "🧾 JSON/XML - açar yolları ilə axınlı mətn çıxarılması"
         ],
         "Böyük Fayl İdarəetməsi": [
-            "🔧 Ağıllı chunking sistemi (4000 söz hər chunk)",
-            "🔄 200 söz overlap kontekst saxlamaq üçün",
+            "🔧 Bölmə əsaslı chunking (başlıqlar üzrə, hər chunk ən çox 512 token)",
+            "🔄 Hər chunk öz başlıq yolunu (section_path) saxlayır",
             "📚 80+ səhifəli sənədlər avtomatik bölünür",
             "💾 SQLite FTS5 sürətli axtarış üçün",
             "🔍 Chunk-əsaslı axtarış sistemi"
@@ -0,0 +1,351 @@
+import os
+import json
+import uuid
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+import logging
+from typing import Dict, Optional, Tuple
+
+from file_manager import FileManager
+
+try:
+    import fcntl
+except ImportError:  # Windows: parts are only serialised within one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class UploadSessionManager:
+    """Resumable uploads: a file is sent as byte ranges and ingested when complete.
+
+    A client creates a session with the file name and size, PUTs the bytes
+    in parts starting at the session's received offset and finalizes the
+    session once every byte has arrived. Parts are appended to a partial
+    file and hashed as they arrive, so an interrupted transfer is resumed
+    by asking for the offset and sending only the missing bytes.
+    """
+
+    def __init__(self, file_manager: FileManager, sessions_dir: str = None, max_upload_bytes: int = None,
+                 session_ttl: timedelta = None, job_queue=None):
+        if sessions_dir is None:
+            sessions_dir = os.environ.get('UPLOAD_SESSIONS_DIR', str(file_manager.storage_dir / 'incoming'))
+        if max_upload_bytes is None:
+            max_upload_bytes = int(os.environ.get('MAX_RESUMABLE_UPLOAD_MB', 2048)) * 1024 * 1024
+        if session_ttl is None:
+            session_ttl = timedelta(hours=int(os.environ.get('UPLOAD_SESSION_TTL_HOURS', 24)))
+
+        self.file_manager = file_manager
+        self.sessions_dir = Path(sessions_dir)
+        self.sessions_dir.mkdir(parents=True, exist_ok=True)
+        self.max_upload_bytes = max_upload_bytes
+        self.session_ttl = session_ttl
+        # With a job queue, finalized uploads are indexed in the background
+        self.job_queue = job_queue
+        # Running hash of the received bytes per open session
+        self._hashers = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.init_database()
+
+    def init_database(self):
+        """Create the upload sessions table"""
+        conn = self.file_manager.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS upload_sessions
+                       (
+                           id TEXT PRIMARY KEY,
+                           filename TEXT NOT NULL,
+                           total_size INTEGER NOT NULL,
+                           received INTEGER DEFAULT 0,
+                           category TEXT,
+                           tags TEXT,
+                           description TEXT,
+                           user_id INTEGER,
+                           status TEXT DEFAULT 'open',
+                           file_id TEXT,
+                           error TEXT,
+                           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                           updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                       )
+                       ''')
+        conn.commit()
+        conn.close()
+
+    def part_path(self, upload_id: str) -> Path:
+        """Partial file collecting the bytes of a session"""
+        return self.sessions_dir / f"{upload_id}.part"
+
+    def session_lock(self, upload_id: str) -> threading.Lock:
+        """Lock serialising the parts and finalization of one session in this process"""
+        with self._lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    @contextmanager
+    def locked_part(self, upload_id: str):
+        """Open the partial file of a session and hold it locked, or give None if there is none.
+
+        The file lock keeps worker processes serving the same session from
+        writing or finalizing it at the same time.
+        """
+        with self.session_lock(upload_id):
+            try:
+                part = open(self.part_path(upload_id), 'r+b')
+            except FileNotFoundError:
+                yield None
+                return
+            with part:
+                if fcntl is not None:
+                    fcntl.flock(part, fcntl.LOCK_EX)
+                yield part
+
+    def create_session(self, filename: str, total_size: int, category: str = None, tags: list = None,
+                       description: str = None, user_id: int = None) -> Dict:
+        """Open an upload session for a file of ``total_size`` bytes"""
+        if total_size < 0:
+            return {'success': False, 'error': 'File size must not be negative'}
+        if total_size > self.max_upload_bytes:
+            return {'success': False,
+                    'error': f"File is larger than the {self.max_upload_bytes // (1024 * 1024)} MB limit"}
+
+        self.expire_sessions()
+        upload_id = uuid.uuid4().hex
+        self.part_path(upload_id).touch()
+
+        self.file_manager.get_writer().write(lambda cursor: cursor.execute('''
+            INSERT INTO upload_sessions (id, filename, total_size, category, tags, description, user_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (upload_id, filename, total_size, category, json.dumps(tags or []), description, user_id)))
+
+        logger.info(f"Upload session {upload_id} opened for {filename} ({total_size} bytes)")
+        return {'success': True, **self.get_session(upload_id)}
+
+    def get_session(self, upload_id: str) -> Optional[Dict]:
+        """Return the state of a session, including the received offset"""
+        conn = self.file_manager.connect()
+        conn.row_factory = sqlite3.Row
+        row = conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+        conn.close()
+        if row is None:
+            return None
+
+        return {
+            'upload_id': row['id'],
+            'filename': row['filename'],
+            'size': row['total_size'],
+            'offset': row['received'],
+            'complete': row['received'] == row['total_size'],
+            'status': row['status'],
+            'file_id': row['file_id'],
+            'error': row['error'],
+            'category': row['category'],
+            'tags': json.loads(row['tags']) if row['tags'] else [],
+            'description': row['description'],
+            'user_id': row['user_id']
+        }
+
+    def update_session(self, upload_id: str, **fields):
+        """Write changed session fields"""
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self.file_manager.get_writer().write(lambda cursor: cursor.execute(
+            f'UPDATE upload_sessions SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            (*fields.values(), upload_id)
+        ))
+
+    def running_hash(self, upload_id: str, received: int):
+        """Hash of the first ``received`` bytes of a session.
+
+        The hash normally lives in memory between parts; after a restart it
+        is rebuilt from the partial file, which is also cut back to the last
+        recorded offset in case a part was interrupted half-written.
+        """
+        hasher = self._hashers.get(upload_id)
+        if hasher is not None and hasher[1] == received:
+            return hasher[0]
+
+        part_path = self.part_path(upload_id)
+        hash_md5 = hashlib.md5()
+        with open(part_path, 'r+b') as part:
+            part.truncate(received)
+            remaining = received
+            while remaining:
+                block = part.read(min(remaining, FileManager.COPY_BUFFER_SIZE))
+                if not block:
+                    break
+                hash_md5.update(block)
+                remaining -= len(block)
+        return hash_md5
+
+    def append(self, upload_id: str, offset: int, source) -> Dict:
+        """Write the bytes read from ``source`` at ``offset``.
+
+        ``offset`` must equal the received offset; otherwise nothing is
+        written and the result carries ``offset_mismatch`` and the offset to
+        resume from. A part that breaks off keeps the bytes that arrived; a
+        part that cannot be written is dropped whole.
+        """
+        with self.locked_part(upload_id) as part:
+            # Read under the lock: a part written by another process moves the offset
+            session = self.get_session(upload_id)
+            if session is None:
+                return {'success': False, 'not_found': True, 'error': 'Upload session not found'}
+            if session['status'] != 'open' or part is None:
+                return {**session, 'success': False, 'error': f"Upload session is {session['status']}"}
+            if offset != session['offset']:
+                return {**session, 'success': False, 'offset_mismatch': True,
+                        'error': f"Expected offset {session['offset']}, got {offset}"}
+            received, overflow, interrupted = self.write_part(upload_id, part, offset,
+                                                              session['size'] - offset, source)
+            self.update_session(upload_id, received=received)
+
+            if interrupted is not None:
+                raise interrupted
+            session['offset'] = received
+            session['complete'] = received == session['size']
+            if overflow:
+                return {**session, 'success': False, 'error': 'More bytes were sent than the declared file size'}
+            return {'success': True, **session}
+
+    def write_part(self, upload_id: str, part, offset: int, remaining: int,
+                   source) -> Tuple[int, bool, Optional[Exception]]:
+        """Copy up to ``remaining`` bytes from ``source`` into the partial file at ``offset``.
+
+        Returns the new received offset, whether more bytes were sent and
+        the error that broke the part off, if any. Bytes are hashed once
+        written; if writing fails, the cached hash is dropped and the error
+        raised, so the next part rebuilds it from the recorded offset.
+        """
+        hash_md5 = self.running_hash(upload_id, offset)
+        received = offset
+        buffer = bytearray(FileManager.COPY_BUFFER_SIZE)
+        view = memoryview(buffer)
+        readinto = getattr(source, 'readinto', None)
+        overflow = False
+        interrupted = None
+
+        try:
+            part.seek(offset)
+            while True:
+                try:
+                    if readinto is not None:
+                        size = readinto(buffer)
+                        block = view[:size]
+                    else:
+                        block = source.read(FileManager.COPY_BUFFER_SIZE)
+                        size = len(block)
+                except Exception as e:
+                    # The client broke off: keep the bytes that arrived
+                    interrupted = e
+                    break
+                if not size:
+                    break
+                if size > remaining:
+                    # Keep the declared size; the excess is rejected
+                    block, size, overflow = block[:remaining], remaining, True
+                part.write(block)
+                hash_md5.update(block)
+                received += size
+                remaining -= size
+                if overflow:
+                    break
+            # Bytes past the offset are left over from a part that failed
+            part.truncate()
+            part.flush()
+        except BaseException:
+            self._hashers.pop(upload_id, None)
+            raise
+
+        self._hashers[upload_id] = (hash_md5, received)
+        return received, overflow, interrupted
+
+    def finalize(self, upload_id: str) -> Dict:
+        """Hand a complete upload to the file manager for ingestion.
+
+        Returns the file manager's upload result, or the queued result when
+        a job queue is set. ZIP archives are ingested member by member, like
+        archives uploaded in a single request.
+        """
+        with self.locked_part(upload_id):
+            session = self.get_session(upload_id)
+            if session is None:
+                return {'success': False, 'not_found': True, 'error': 'Upload session not found'}
+            if session['status'] == 'completed':
+                return {'success': True, 'file_id': session['file_id'], 'filename': session['filename'],
+                        'already_finalized': True}
+            if session['status'] != 'open':
+                return {'success': False, 'error': f"Upload session is {session['status']}"}
+            if not session['complete']:
+                return {'success': False, 'incomplete': True, 'offset': session['offset'],
+                        'error': f"Received {session['offset']} of {session['size']} bytes"}
+
+            part_path = self.part_path(upload_id)
+            try:
+                if session['filename'].lower().endswith('.zip'):
+                    if self.job_queue is not None:
+                        result = self.job_queue.upload_archive(str(part_path), session['filename'],
+                                                               category=session['category'], tags=session['tags'],
+                                                               description=session['description'],
+                                                               user_id=session['user_id'])
+                    else:
+                        result = self.file_manager.upload_archive(str(part_path), session['filename'],
+                                                                  category=session['category'], tags=session['tags'],
+                                                                  description=session['description'])
+                    part_path.unlink(missing_ok=True)
+                else:
+                    hash_md5 = self.running_hash(upload_id, session['size'])
+                    payload = self.file_manager.prepare_received_upload(
+                        part_path, session['filename'], session['size'], hash_md5.hexdigest(),
+                        category=session['category'], tags=session['tags'], description=session['description']
+                    )
+                    if self.job_queue is not None:
+                        result = self.job_queue.submit(payload, session['user_id'])
+                    else:
+                        result = self.file_manager.store_upload(payload)
+            except Exception as e:
+                logger.error(f"Error finalizing upload {upload_id} ({session['filename']}): {e}")
+                result = {'success': False, 'error': str(e)}
+
+            self._hashers.pop(upload_id, None)
+            if result.get('success'):
+                self.update_session(upload_id, status='completed', file_id=result.get('file_id'))
+            else:
+                part_path.unlink(missing_ok=True)
+                self.update_session(upload_id, status='failed', error=result.get('error'))
+            return result
+
+    def cancel(self, upload_id: str) -> bool:
+        """Abort a session and drop its received bytes"""
+        with self.locked_part(upload_id):
+            if self.get_session(upload_id) is None:
+                return False
+            self.remove_session(upload_id)
+            return True
+
+    def remove_session(self, upload_id: str):
+        """Delete a session row, its partial file and its running hash"""
+        self.part_path(upload_id).unlink(missing_ok=True)
+        self._hashers.pop(upload_id, None)
+        self.file_manager.get_writer().write(
+            lambda cursor: cursor.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+        )
+        with self._lock:
+            self._locks.pop(upload_id, None)
+
+    def expire_sessions(self) -> int:
+        """Remove sessions not touched within the session TTL"""
+        cutoff = (datetime.utcnow() - self.session_ttl).strftime('%Y-%m-%d %H:%M:%S')
+        conn = self.file_manager.connect()
+        expired = [row[0] for row in conn.execute('SELECT id FROM upload_sessions WHERE updated_at < ?',
+                                                   (cutoff,))]
+        conn.close()
+
+        for upload_id in expired:
+            self.remove_session(upload_id)
+        if expired:
+            logger.info(f"Expired {len(expired)} upload sessions")
+        return len(expired)